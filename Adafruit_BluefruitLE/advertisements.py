@@ -0,0 +1,241 @@
+# Bounded store of the advertisements seen from each device, with expiry of
+# devices that stop advertising on a timing wheel.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+import time
+
+from .config import ADVERTISEMENT_TTL_SEC
+from .uuids import intern_uuid
+
+
+logger = logging.getLogger(__name__)
+
+# Properties of a bluez device that change when it advertises.
+_BLUEZ_PROPERTIES = ('RSSI', 'UUIDs', 'Name', 'ManufacturerData', 'ServiceData')
+
+
+class AdvertisementRecord(object):
+    """What's known about one advertising device: the set of service UUIDs it
+    advertised (each UUID is kept once), its name, the payload of its last
+    advertisement (like manufacturer data), its last RSSI, when it was first
+    and last seen, and how many advertisements were received.
+    """
+    __slots__ = ('key', 'uuids', 'name', 'data', 'rssi', 'first_seen',
+                 'last_seen', 'count', '_tick')
+
+    def __init__(self, key, now):
+        self.key = key
+        self.uuids = set()
+        self.name = None
+        self.data = None
+        self.rssi = None
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 0
+        self._tick = None
+
+
+class AdvertisementStore(object):
+    """Advertisement records keyed by device (its address, DBus path, or
+    CoreBluetooth peripheral).  Records of devices that haven't advertised for
+    ttl_sec seconds are expired with a timing wheel of resolution_sec slots:
+    seeing a device moves its record to the current slot and each slot that
+    comes around again holds only devices that have been silent for the whole
+    wheel, so both cost O(1) per device no matter how many are in range.
+    on_expire is called with each expired record, outside of the store's lock,
+    and can return False to keep the record (like for a connected device).
+    """
+
+    def __init__(self, ttl_sec=ADVERTISEMENT_TTL_SEC, resolution_sec=1.0,
+                 on_expire=None, clock=time.time):
+        self._resolution = float(resolution_sec)
+        self._slots = int(-(-ttl_sec // self._resolution)) + 1
+        self._wheel = [set() for i in range(self._slots)]
+        self._records = {}
+        # When each device was last seen, kept after its record expires for
+        # purging the OS's device cache.
+        self._seen = {}
+        self._on_expire = on_expire
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tick = int(clock() // self._resolution)
+        self._expired = 0
+
+    def update(self, key, uuids=None, name=None, data=None, rssi=None):
+        """Record an advertisement (or any sign of life) from the device with
+        the specified key and return its record.  New service UUIDs are added
+        to the record's set, and name, data, and rssi replace the last values
+        when they're not None.
+        """
+        now = self._clock()
+        expired = []
+        with self._lock:
+            tick = self._advance(now, expired)
+            record = self._records.get(key)
+            if record is None:
+                record = AdvertisementRecord(key, now)
+                self._records[key] = record
+            elif record._tick != tick:
+                self._wheel[record._tick % self._slots].discard(key)
+            if record._tick != tick:
+                record._tick = tick
+                self._wheel[tick % self._slots].add(key)
+            record.last_seen = now
+            self._seen[key] = now
+            record.count += 1
+            if uuids:
+                # Most advertisements repeat the same UUIDs, only add them to
+                # the set when something is new.
+                if not record.uuids.issuperset(uuids):
+                    record.uuids.update(uuids)
+            if name is not None:
+                record.name = name
+            if data is not None:
+                record.data = data
+            if rssi is not None:
+                record.rssi = rssi
+        self._expire(expired)
+        return record
+
+    def get(self, key):
+        """Return the record of the device with the specified key, or None if
+        it's unknown or has expired.
+        """
+        self.expire()
+        with self._lock:
+            return self._records.get(key)
+
+    def remove(self, key):
+        """Forget the device with the specified key."""
+        with self._lock:
+            self._seen.pop(key, None)
+            record = self._records.pop(key, None)
+            if record is not None:
+                self._wheel[record._tick % self._slots].discard(key)
+
+    def last_seen_times(self, keys):
+        """Return a dict of each of the keys to when the device was last
+        seen, even if its record expired since.  Devices never seen count as
+        seen now, so they only age from the first time they're asked about.
+        The times of devices not in keys are forgotten, so pass every device
+        that's still cached.
+        """
+        now = self._clock()
+        with self._lock:
+            seen = dict((x, self._seen.get(x, now)) for x in keys)
+            self._seen = dict(seen)
+        return seen
+
+    def records(self):
+        """Return a list of the records of every device that hasn't expired."""
+        self.expire()
+        with self._lock:
+            return list(self._records.values())
+
+    def expire(self):
+        """Expire the records of devices that haven't been seen within the
+        TTL.  Called by the other functions, so it only needs to be called to
+        get on_expire callbacks while nothing is advertising.
+        """
+        expired = []
+        with self._lock:
+            self._advance(self._clock(), expired)
+        self._expire(expired)
+
+    def stats(self):
+        """Return a dict with the number of records and expired records."""
+        with self._lock:
+            return {'devices': len(self._records), 'expired': self._expired}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _advance(self, now, expired):
+        # Move the wheel to the current tick, collecting the records in every
+        # slot it passes into expired.  Must be called with the lock held.
+        # Returns the current tick.
+        tick = int(now // self._resolution)
+        if tick - self._tick > self._slots:
+            # Nothing happened for longer than the whole wheel, only the last
+            # lap needs to be visited.
+            self._tick = tick - self._slots
+        while self._tick < tick:
+            self._tick += 1
+            slot = self._wheel[self._tick % self._slots]
+            if slot:
+                for key in slot:
+                    expired.append(self._records.pop(key))
+                slot.clear()
+        return tick
+
+    def _expire(self, expired):
+        # Tell the owner about expired records and put back any it keeps.
+        for record in expired:
+            keep = False
+            if self._on_expire is not None:
+                try:
+                    keep = self._on_expire(record) is False
+                except Exception:
+                    logger.exception('Error in advertisement expiry callback')
+            if keep:
+                with self._lock:
+                    if record.key not in self._records:
+                        self._records[record.key] = record
+                        record._tick = self._tick
+                        self._wheel[self._tick % self._slots].add(record.key)
+            else:
+                with self._lock:
+                    self._expired += 1
+
+
+def update_from_bluez(store, path, props):
+    """Update the store from the properties of the bluez device at the
+    specified DBus path (from an InterfacesAdded or PropertiesChanged signal).
+    Changes to properties that aren't set by advertisements are ignored.
+    Records are keyed by the device's address.
+    """
+    if not any([x in props for x in _BLUEZ_PROPERTIES]):
+        return None
+    parts = str(path).split('/')
+    if len(parts) < 5 or not parts[4].startswith('dev_'):
+        return None
+    data = None
+    if 'ManufacturerData' in props or 'ServiceData' in props:
+        data = {}
+        if 'ManufacturerData' in props:
+            data['manufacturer_data'] = dict([(int(k), bytes(bytearray(v)))
+                                              for k, v in props['ManufacturerData'].items()])
+        if 'ServiceData' in props:
+            data['service_data'] = dict([(intern_uuid(k), bytes(bytearray(v)))
+                                         for k, v in props['ServiceData'].items()])
+    name = props.get('Name')
+    rssi = props.get('RSSI')
+    return store.update(parts[4][4:].replace('_', ':'),
+                        uuids=[intern_uuid(x) for x in props.get('UUIDs', [])],
+                        name=str(name) if name is not None else None,
+                        data=data,
+                        rssi=int(rssi) if rssi is not None else None)
@@ -0,0 +1,93 @@
+# Python object to represent a bluez adapter for the asyncio DBus provider.
+# Properties are read from the provider's mirror of bluez's object tree.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
+from ..interfaces import Adapter
+from .. import tracing
+
+from .message import Variant
+
+
+_INTERFACE = 'org.bluez.Adapter1'
+
+
+class AsyncioBluezAdapter(Adapter):
+    """Bluez BLE network adapter."""
+
+    def __init__(self, provider, path):
+        """Create an instance of the bluetooth adapter at the specified bluez
+        DBus object path.
+        """
+        self._provider = provider
+        self._path = path
+
+    def _get(self, name, default=None):
+        return self._provider._get_property(self._path, _INTERFACE, name, default)
+
+    def _set(self, name, value):
+        self._provider._call(self._path, 'org.freedesktop.DBus.Properties', 'Set',
+                             'ssv', (_INTERFACE, name, value))
+
+    @property
+    def name(self):
+        """Return the name of this BLE network adapter."""
+        return self._get('Name')
+
+    def start_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Start scanning for BLE devices with this adapter."""
+        with tracing.span('scan.start', adapter=self._path):
+            deadline = as_deadline(timeout_sec)
+            self._provider._call(self._path, _INTERFACE, 'StartDiscovery',
+                                 timeout_sec=deadline)
+            if not self._provider._wait_for(lambda: self.is_scanning, deadline):
+                raise DeadlineExceeded('Exceeded timeout waiting for adapter to start scanning!')
+
+    def stop_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Stop scanning for BLE devices with this adapter."""
+        with tracing.span('scan.stop', adapter=self._path):
+            deadline = as_deadline(timeout_sec)
+            self._provider._call(self._path, _INTERFACE, 'StopDiscovery',
+                                 timeout_sec=deadline)
+            if not self._provider._wait_for(lambda: not self.is_scanning, deadline):
+                raise DeadlineExceeded('Exceeded timeout waiting for adapter to stop scanning!')
+
+    @property
+    def is_scanning(self):
+        """Return True if the BLE adapter is scanning for devices, otherwise
+        return False.
+        """
+        return self._get('Discovering', False)
+
+    def power_on(self):
+        """Power on this BLE adapter."""
+        self._set('Powered', Variant('b', True))
+
+    def power_off(self):
+        """Power off this BLE adapter."""
+        self._set('Powered', Variant('b', False))
+
+    @property
+    def is_powered(self):
+        """Return True if the BLE adapter is powered up, otherwise return False.
+        """
+        return self._get('Powered', False)
@@ -0,0 +1,269 @@
+# Minimal DBus message bus connection implemented directly on an asyncio
+# transport, without dbus-python or a GLib main loop.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import binascii
+import logging
+import os
+
+from .message import Message, HEADER_SIZE, METHOD_CALL, METHOD_RETURN, ERROR, SIGNAL
+from .message import NO_REPLY_EXPECTED
+
+
+logger = logging.getLogger(__name__)
+
+_BUS_NAME      = 'org.freedesktop.DBus'
+_BUS_PATH      = '/org/freedesktop/DBus'
+_BUS_INTERFACE = 'org.freedesktop.DBus'
+
+# Default address of the system bus when DBUS_SYSTEM_BUS_ADDRESS isn't set.
+_DEFAULT_SYSTEM_BUS_ADDRESS = 'unix:path=/var/run/dbus/system_bus_socket'
+
+
+def system_bus_address():
+    """Return the address of the system bus, which can be overridden with the
+    DBUS_SYSTEM_BUS_ADDRESS environment variable just like with libdbus.
+    """
+    return os.environ.get('DBUS_SYSTEM_BUS_ADDRESS', _DEFAULT_SYSTEM_BUS_ADDRESS)
+
+
+def _socket_paths(address):
+    # Yield the unix socket paths for each entry in a DBus server address list.
+    for entry in address.split(';'):
+        transport, _, options = entry.partition(':')
+        if transport != 'unix':
+            continue
+        params = dict([x.split('=', 1) for x in options.split(',') if '=' in x])
+        if 'path' in params:
+            yield params['path']
+        elif 'abstract' in params:
+            yield '\0' + params['abstract']
+
+
+class DBusError(RuntimeError):
+    """Error returned by a DBus method call."""
+
+    def __init__(self, name, text=''):
+        super(DBusError, self).__init__('{0}: {1}'.format(name, text) if text else name)
+        self.name = name
+        self.text = text
+
+    def get_dbus_name(self):
+        """Return the DBus error name, like dbus-python's DBusException."""
+        return self.name
+
+
+class _BusProtocol(asyncio.Protocol):
+    # Asyncio protocol that feeds received bytes to the bus.
+
+    def __init__(self, bus):
+        self._bus = bus
+
+    def data_received(self, data):
+        self._bus._data_received(data)
+
+    def connection_lost(self, exc):
+        self._bus._connection_lost(exc)
+
+
+class MessageBus(object):
+    """Connection to a DBus message bus.  All methods must be called from the
+    thread running the bus's asyncio event loop.  Method calls are pipelined:
+    any number of calls can be waiting for their replies at the same time.
+    """
+
+    def __init__(self, loop=None):
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._transport = None
+        self._buffer = bytearray()
+        self._authenticated = False
+        self._auth_reply = None
+        self._serial = 0
+        self._pending = {}
+        self._signal_handlers = []
+        self._exported = {}
+        self.unique_name = None
+
+    async def connect(self, address=None):
+        """Connect and authenticate to the bus at the specified DBus address, or
+        the system bus by default.
+        """
+        address = address if address is not None else system_bus_address()
+        error = None
+        for path in _socket_paths(address):
+            try:
+                self._transport, _ = await self._loop.create_unix_connection(
+                    lambda: _BusProtocol(self), path)
+                break
+            except OSError as ex:
+                error = ex
+        else:
+            raise RuntimeError('Failed to connect to DBus at {0}: {1}'.format(address, error))
+        # Authenticate as the current user with the EXTERNAL mechanism, which
+        # the bus checks against the socket's credentials.
+        uid = binascii.hexlify(str(os.getuid()).encode('ascii'))
+        self._auth_reply = self._loop.create_future()
+        self._transport.write(b'\0AUTH EXTERNAL ' + uid + b'\r\n')
+        reply = await self._auth_reply
+        if not reply.startswith(b'OK'):
+            self.close()
+            raise RuntimeError('DBus authentication failed: {0}'.format(reply.decode('ascii', 'replace')))
+        self._transport.write(b'BEGIN\r\n')
+        self._authenticated = True
+        # Any data after the authentication reply is the start of a message.
+        if len(self._buffer) > 0:
+            self._data_received(b'')
+        reply = await self.call_method(_BUS_NAME, _BUS_PATH, _BUS_INTERFACE, 'Hello')
+        self.unique_name = reply[0]
+
+    def close(self):
+        """Close the connection.  Calls waiting for a reply fail."""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def send(self, message):
+        """Send a message and return its serial number."""
+        if self._transport is None:
+            raise RuntimeError('DBus connection is closed!')
+        self._serial += 1
+        message.serial = self._serial
+        self._transport.write(message.marshal())
+        return message.serial
+
+    def call(self, message):
+        """Send a method call message and return a future for the reply
+        message.  The future fails with a DBusError if an error is returned.
+        """
+        future = self._loop.create_future()
+        serial = self.send(message)
+        self._pending[serial] = future
+        return future
+
+    async def call_method(self, destination, path, interface, member,
+                          signature='', body=()):
+        """Call a method and return the list of values in the reply body."""
+        reply = await self.call(Message(METHOD_CALL, path, interface, member,
+                                        signature, body, destination))
+        return reply.body
+
+    def add_match(self, **rule):
+        """Ask the bus to route signals matching the rule (keyword arguments
+        like type='signal', interface=..., member=...) to this connection.
+        Returns a future for the bus's reply.
+        """
+        match = ','.join(["{0}='{1}'".format(x, rule[x]) for x in sorted(rule)])
+        return self.call(Message(METHOD_CALL, _BUS_PATH, _BUS_INTERFACE, 'AddMatch',
+                                 's', (match,), _BUS_NAME))
+
+    def request_name(self, name):
+        """Request ownership of a well known bus name.  Returns a future."""
+        return self.call(Message(METHOD_CALL, _BUS_PATH, _BUS_INTERFACE, 'RequestName',
+                                 'su', (name, 4), _BUS_NAME))
+
+    def add_signal_handler(self, handler):
+        """Call handler with every signal message that is received."""
+        self._signal_handlers.append(handler)
+
+    def remove_signal_handler(self, handler):
+        """Remove a signal handler added with add_signal_handler."""
+        self._signal_handlers.remove(handler)
+
+    def export(self, path, handler):
+        """Handle method calls to the specified object path.  Handler is called
+        with each method call message and returns a tuple of the reply's
+        signature and body, or raises a DBusError.
+        """
+        self._exported[path] = handler
+
+    def emit(self, path, interface, member, signature='', body=()):
+        """Emit a signal from this connection."""
+        self.send(Message(SIGNAL, path, interface, member, signature, body))
+
+    def _data_received(self, data):
+        self._buffer.extend(data)
+        if not self._authenticated:
+            # Waiting for the reply to the authentication request.
+            end = self._buffer.find(b'\r\n')
+            if end >= 0 and self._auth_reply is not None and not self._auth_reply.done():
+                self._auth_reply.set_result(bytes(self._buffer[:end]))
+                del self._buffer[:end+2]
+            return
+        # Pull out every complete message in the buffer.
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= HEADER_SIZE:
+            length = Message.length(buffer[offset:offset+HEADER_SIZE])
+            if len(buffer) - offset < length:
+                break
+            message = Message.unmarshal(bytes(memoryview(buffer)[offset:offset+length]))
+            offset += length
+            self._dispatch(message)
+        if offset > 0:
+            del buffer[:offset]
+
+    def _dispatch(self, message):
+        # Route a received message to its waiting call, handlers, or exported
+        # object.
+        if message.type == METHOD_RETURN or message.type == ERROR:
+            future = self._pending.pop(message.reply_serial, None)
+            if future is None or future.done():
+                return
+            if message.type == ERROR:
+                text = message.body[0] if len(message.body) > 0 and isinstance(message.body[0], str) else ''
+                future.set_exception(DBusError(message.error_name, text))
+            else:
+                future.set_result(message)
+        elif message.type == SIGNAL:
+            for handler in list(self._signal_handlers):
+                try:
+                    handler(message)
+                except Exception:
+                    logger.exception('Error in DBus signal handler')
+        elif message.type == METHOD_CALL:
+            self._handle_call(message)
+
+    def _handle_call(self, message):
+        # Call the exported object's handler and send back its reply.
+        handler = self._exported.get(message.path)
+        try:
+            if handler is None:
+                raise DBusError('org.freedesktop.DBus.Error.UnknownObject',
+                                'No object at {0}'.format(message.path))
+            signature, body = handler(message)
+            reply = Message(METHOD_RETURN, signature=signature, body=body,
+                            reply_serial=message.serial, destination=message.sender)
+        except DBusError as ex:
+            reply = Message(ERROR, error_name=ex.name, signature='s', body=(ex.text,),
+                            reply_serial=message.serial, destination=message.sender)
+        if not message.flags & NO_REPLY_EXPECTED:
+            self.send(reply)
+
+    def _connection_lost(self, exc):
+        # Fail any calls that are still waiting for a reply.
+        self._transport = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError('DBus connection was closed!'))
+        self._pending.clear()
+        if self._auth_reply is not None and not self._auth_reply.done():
+            self._auth_reply.set_exception(RuntimeError('DBus connection was closed!'))
@@ -0,0 +1,171 @@
+# Python object to represent a bluez device for the asyncio DBus provider.
+# Properties are read from the provider's mirror of bluez's object tree.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
+from ..gatt_snapshot import from_bluez_objects
+from ..uuids import intern_uuid
+from ..interfaces import Device
+from .. import metrics, tracing
+
+from .gatt import AsyncioBluezGattService, _SERVICE_INTERFACE, _CHARACTERISTIC_INTERFACE
+from .gatt import _adapter_id, _device_address
+
+
+_INTERFACE = 'org.bluez.Device1'
+
+
+class AsyncioBluezDevice(Device):
+    """Bluez BLE device."""
+
+    def __init__(self, provider, path):
+        """Create an instance of the bluetooth device at the specified bluez
+        DBus object path.
+        """
+        self._provider = provider
+        self._path = path
+        self._address = _device_address(path)
+        self._adapter_id = _adapter_id(path)
+
+    def _disconnect_callbacks(self):
+        # Device objects are created for each lookup, so the provider keeps the
+        # callbacks of each device path.
+        return self._provider._disconnect_callbacks.setdefault(self._path, [])
+
+    def _get(self, name, default=None):
+        return self._provider._get_property(self._path, _INTERFACE, name, default)
+
+    def connect(self, timeout_sec=TIMEOUT_SEC):
+        """Connect to the device.  If not connected within the specified timeout
+        then an exception is thrown.
+        """
+        with tracing.span('device.connect', self._address), \
+             metrics.operation('connect', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            # Disconnecting aborts a connection that's still being made.
+            with deadline.on_cancel(lambda: self._provider._send(self._path, _INTERFACE, 'Disconnect')):
+                self._provider._call(self._path, _INTERFACE, 'Connect',
+                                     timeout_sec=deadline)
+                if not self._provider._wait_for(lambda: self.is_connected, deadline):
+                    raise DeadlineExceeded('Exceeded timeout waiting to connect to device!')
+
+    def disconnect(self, timeout_sec=TIMEOUT_SEC):
+        """Disconnect from the device.  If not disconnected within the specified
+        timeout then an exception is thrown.
+        """
+        with tracing.span('device.disconnect', self._address), \
+             metrics.operation('disconnect', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            self._provider._call(self._path, _INTERFACE, 'Disconnect',
+                                 timeout_sec=deadline)
+            if not self._provider._wait_for(lambda: not self.is_connected, deadline):
+                raise DeadlineExceeded('Exceeded timeout waiting to disconnect from device!')
+
+    def list_services(self):
+        """Return a list of GattService objects that have been discovered for
+        this device.
+        """
+        return [AsyncioBluezGattService(self._provider, x) for x in
+                self._provider._paths(_SERVICE_INTERFACE, self._path + '/')]
+
+    def gatt_snapshot(self):
+        """Return an immutable GattSnapshot of the services, characteristics,
+        and descriptors discovered for this device, from the object tree
+        without calling bluez.
+        """
+        with self._provider._changed:
+            objects = dict(self._provider._objects)
+        return from_bluez_objects(self._path, objects)
+
+    def discover(self, service_uuids, char_uuids, timeout_sec=TIMEOUT_SEC):
+        """Wait up to timeout_sec for the specified services and characteristics
+        to be discovered on the device, empty lists wait for every service.
+        Returns True if they were discovered or False if the timeout is
+        exceeded first.
+        """
+        expected_services = set(service_uuids)
+        expected_chars = set(char_uuids)
+        def discovered():
+            # Compare the UUIDs in the object tree with the expected UUIDs,
+            # this is checked again every time the tree changes.  Asking for
+            # nothing in particular waits for bluez to resolve every service.
+            if len(expected_services) == 0 and len(expected_chars) == 0:
+                return bool(self._get('ServicesResolved', False))
+            actual_chars = set([intern_uuid(self._provider._get_property(x, _CHARACTERISTIC_INTERFACE, 'UUID'))
+                                for x in self._provider._paths(_CHARACTERISTIC_INTERFACE, self._path + '/')])
+            return set(self.advertised) >= expected_services and actual_chars >= expected_chars
+        with tracing.span('device.discover', self._address,
+                          services=len(service_uuids), characteristics=len(char_uuids)) as span, \
+             metrics.operation('discover', self._adapter_id, self._address) as operation:
+            found = self._provider._wait_for(discovered, timeout_sec)
+            span.set('found', found)
+            if not found:
+                operation.fail()
+            return found
+
+    def operation_stats(self):
+        """Return a dict of statistics for the queue that schedules GATT
+        operations with this device.
+        """
+        return self._provider._operation_queue(self._path).stats()
+
+    @property
+    def advertised(self):
+        """Return a list of UUIDs for services that are advertised by this
+        device.
+        """
+        return [intern_uuid(x) for x in self._get('UUIDs', [])]
+
+    @property
+    def id(self):
+        """Return a unique identifier for this device.  On supported platforms
+        this will be the MAC address of the device, however on unsupported
+        platforms (Mac OSX) it will be a unique ID like a UUID.
+        """
+        return self._get('Address')
+
+    @property
+    def name(self):
+        """Return the name of this device."""
+        return self._get('Name')
+
+    @property
+    def is_connected(self):
+        """Return True if the device is connected to the system, otherwise False.
+        """
+        return self._get('Connected', False)
+
+    @property
+    def rssi(self):
+        """Return the RSSI signal strength in decibels."""
+        return self._get('RSSI')
+
+    @property
+    def address_type(self):
+        """Return the type of the device's address, 'public' or 'random'."""
+        return self._get('AddressType')
+
+    @property
+    def _adapter(self):
+        """Return the DBus path to the adapter that owns this device."""
+        return self._get('Adapter')
@@ -0,0 +1,220 @@
+# Python objects to represent bluez GATT objects for the asyncio DBus provider.
+# Properties are read from the provider's mirror of bluez's object tree.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
+from ..interfaces import GattService, GattCharacteristic, GattDescriptor
+from ..interfaces import WRITE_WITH_RESPONSE, WRITE_WITHOUT_RESPONSE
+from ..operation_queue import PRIORITY_CONTROL, PRIORITY_NORMAL
+from ..uuids import intern_uuid
+from .. import metrics, tracing
+
+from .message import Variant
+
+
+_SERVICE_INTERFACE        = 'org.bluez.GattService1'
+_CHARACTERISTIC_INTERFACE = 'org.bluez.GattCharacteristic1'
+_DESCRIPTOR_INTERFACE     = 'org.bluez.GattDescriptor1'
+
+# Map of write types to the value of the type option for bluez's WriteValue.
+_WRITE_TYPES = {
+    WRITE_WITH_RESPONSE:    'request',
+    WRITE_WITHOUT_RESPONSE: 'command'
+}
+
+
+def _device_address(path):
+    """Return the address of the device that owns the bluez object at the
+    specified DBus path, or None if the path isn't under a device.
+    """
+    parts = path.split('/')
+    if len(parts) < 5 or not parts[4].startswith('dev_'):
+        return None
+    return parts[4][4:].replace('_', ':')
+
+
+def _adapter_id(path):
+    """Return the id (like hci0) of the adapter that owns the bluez object at
+    the specified DBus path.
+    """
+    parts = path.split('/')
+    return parts[3] if len(parts) > 3 else None
+
+
+def _to_bytes(value):
+    """Convert a value to write into something the message writer can copy as
+    an array of bytes in one step: bytes, a bytearray, or a memoryview are used
+    as-is, a Python 3 string of byte values is encoded, and anything else (like
+    a list of ints) is converted to bytes.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    if isinstance(value, str):
+        return value.encode('latin-1')
+    return bytes(bytearray(value))
+
+
+class AsyncioBluezGattService(GattService):
+    """Bluez GATT service object."""
+
+    def __init__(self, provider, path):
+        """Create an instance of the GATT service at the specified bluez DBus
+        object path.
+        """
+        self._provider = provider
+        self._path = path
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT service."""
+        return intern_uuid(self._provider._get_property(self._path, _SERVICE_INTERFACE, 'UUID'))
+
+    def list_characteristics(self):
+        """Return list of GATT characteristics that have been discovered for this
+        service.
+        """
+        return [AsyncioBluezGattCharacteristic(self._provider, x) for x in
+                self._provider._paths(_CHARACTERISTIC_INTERFACE, self._path + '/')]
+
+
+class AsyncioBluezGattCharacteristic(GattCharacteristic):
+    """Bluez GATT characteristic object."""
+
+    def __init__(self, provider, path):
+        """Create an instance of the GATT characteristic at the specified bluez
+        DBus object path.
+        """
+        self._provider = provider
+        self._path = path
+        self._queue = provider._operation_queue(path)
+        self._address = _device_address(path)
+        self._adapter_id = _adapter_id(path)
+
+    def _call(self, member, signature='', body=(), priority=PRIORITY_NORMAL,
+              timeout_sec=TIMEOUT_SEC):
+        # Call a method of the characteristic through the device's queue, the
+        # wait for the turn and the reply share the timeout.
+        deadline = as_deadline(timeout_sec)
+        return self._queue.run(lambda: self._provider._call(self._path,
+                                   _CHARACTERISTIC_INTERFACE, member, signature, body, deadline),
+                               priority, self._path, deadline)
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT characteristic."""
+        return intern_uuid(self._provider._get_property(self._path, _CHARACTERISTIC_INTERFACE, 'UUID'))
+
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this characteristic and return it as bytes.  The
+        read is scheduled on the device's operation queue with the specified
+        priority, and waits up to timeout_sec for its turn and the value.
+        """
+        with tracing.span('gatt.read', self._address, path=self._path), \
+             metrics.operation('read', self._adapter_id, self._address):
+            value = self._call('ReadValue', 'a{sv}', ({},), priority, timeout_sec)[0]
+        metrics.received(self._adapter_id, self._address, len(value))
+        return value
+
+    def write_value(self, value, write_type=None, timeout_sec=TIMEOUT_SEC,
+                    offset=0, priority=PRIORITY_NORMAL):
+        """Write the specified value to this characteristic.  Value can be
+        bytes, a bytearray, or a memoryview and is copied into the DBus message
+        in one step.  Write_type can be WRITE_WITH_RESPONSE or
+        WRITE_WITHOUT_RESPONSE (or a bluez type name like 'reliable'), and
+        offset is the offset to write the value at.  When neither is specified
+        bluez picks the write type from the characteristic's flags.  The write
+        is scheduled on the device's operation queue with the specified
+        priority, use PRIORITY_CONTROL to jump ahead of waiting reads, and waits
+        up to timeout_sec.
+        """
+        options = {}
+        if write_type is not None:
+            options['type'] = Variant('s', _WRITE_TYPES.get(write_type, write_type))
+        if offset:
+            options['offset'] = Variant('q', offset)
+        with tracing.span('gatt.write', self._address, path=self._path, size=len(value)), \
+             metrics.operation('write', self._adapter_id, self._address, len(value)):
+            self._call('WriteValue', 'aya{sv}', (_to_bytes(value), options), priority,
+                       timeout_sec)
+
+    def start_notify(self, on_change, timeout_sec=TIMEOUT_SEC):
+        """Enable notification of changes for this characteristic on the
+        specified on_change callback.  on_change should be a function that takes
+        one parameter which is the value (as bytes) of the changed
+        characteristic value.  The callback is called from the provider's event
+        loop so it must not block.  Waits up to timeout_sec for notifications to
+        be enabled.
+        """
+        on_change = metrics.instrument_callback(on_change, self._adapter_id, self._address)
+        on_change = tracing.first_call(on_change, 'gatt.first_notification',
+                                       self._address, path=self._path)
+        with tracing.span('gatt.subscribe', self._address, path=self._path):
+            self._provider._notify_handlers[self._path] = on_change
+            self._call('StartNotify', priority=PRIORITY_CONTROL, timeout_sec=timeout_sec)
+
+    def stop_notify(self, timeout_sec=TIMEOUT_SEC):
+        """Disable notification of changes for this characteristic, waiting up
+        to timeout_sec.
+        """
+        with tracing.span('gatt.unsubscribe', self._address, path=self._path):
+            self._provider._notify_handlers.pop(self._path, None)
+            self._call('StopNotify', priority=PRIORITY_CONTROL, timeout_sec=timeout_sec)
+
+    def list_descriptors(self):
+        """Return list of GATT descriptors that have been discovered for this
+        characteristic.
+        """
+        return [AsyncioBluezGattDescriptor(self._provider, x) for x in
+                self._provider._paths(_DESCRIPTOR_INTERFACE, self._path + '/')]
+
+
+class AsyncioBluezGattDescriptor(GattDescriptor):
+    """Bluez GATT descriptor object."""
+
+    def __init__(self, provider, path):
+        """Create an instance of the GATT descriptor at the specified bluez DBus
+        object path.
+        """
+        self._provider = provider
+        self._path = path
+        self._queue = provider._operation_queue(path)
+        self._address = _device_address(path)
+        self._adapter_id = _adapter_id(path)
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT descriptor."""
+        return intern_uuid(self._provider._get_property(self._path, _DESCRIPTOR_INTERFACE, 'UUID'))
+
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this descriptor and return it as bytes.  The read
+        is scheduled on the device's operation queue with the specified
+        priority, and waits up to timeout_sec for its turn and the value.
+        """
+        with tracing.span('gatt.read_descriptor', self._address, path=self._path), \
+             metrics.operation('read', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            value = self._queue.run(lambda: self._provider._call(self._path,
+                                        _DESCRIPTOR_INTERFACE, 'ReadValue', 'a{sv}', ({},), deadline)[0],
+                                    priority, self._path, deadline)
+        metrics.received(self._adapter_id, self._address, len(value))
+        return value
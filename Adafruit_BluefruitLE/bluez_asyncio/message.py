@@ -0,0 +1,339 @@
+# DBus wire protocol messages.  Converts DBus messages to and from the bytes
+# sent over a bus connection, following the DBus specification:
+# https://dbus.freedesktop.org/doc/dbus-specification.html
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import struct
+
+
+# Message types.
+METHOD_CALL   = 1
+METHOD_RETURN = 2
+ERROR         = 3
+SIGNAL        = 4
+
+# Message flags.
+NO_REPLY_EXPECTED = 0x1
+
+# Header field codes and the type of each field's value.
+_PATH         = 1
+_INTERFACE    = 2
+_MEMBER       = 3
+_ERROR_NAME   = 4
+_REPLY_SERIAL = 5
+_DESTINATION  = 6
+_SENDER       = 7
+_SIGNATURE    = 8
+_FIELD_TYPES = {
+    _PATH:         'o',
+    _INTERFACE:    's',
+    _MEMBER:       's',
+    _ERROR_NAME:   's',
+    _REPLY_SERIAL: 'u',
+    _DESTINATION:  's',
+    _SENDER:       's',
+    _SIGNATURE:    'g'
+}
+
+# Struct format and size of each fixed size type.
+_FIXED = {
+    'y': ('B', 1),
+    'b': ('I', 4),
+    'n': ('h', 2),
+    'q': ('H', 2),
+    'i': ('i', 4),
+    'u': ('I', 4),
+    'x': ('q', 8),
+    't': ('Q', 8),
+    'd': ('d', 8),
+    'h': ('I', 4)
+}
+
+# Alignment of every type code.
+_ALIGN = {
+    'y': 1, 'b': 4, 'n': 2, 'q': 2, 'i': 4, 'u': 4, 'x': 8, 't': 8, 'd': 8,
+    'h': 4, 's': 4, 'o': 4, 'g': 1, 'a': 4, '(': 8, '{': 8, 'v': 1
+}
+
+# Size of the fixed part of the header, up to and including the length of the
+# header fields array.
+HEADER_SIZE = 16
+
+# Cache of signatures split into their complete types.
+_split_cache = {}
+
+
+class Variant(object):
+    """Value with an explicit DBus type signature, used to marshal values of
+    the variant ('v') type.  Variants received from the bus are unmarshalled to
+    their plain Python value.
+    """
+    __slots__ = ('signature', 'value')
+
+    def __init__(self, signature, value):
+        self.signature = signature
+        self.value = value
+
+    def __repr__(self):
+        return 'Variant({0!r}, {1!r})'.format(self.signature, self.value)
+
+
+def _type_end(signature, start):
+    # Return the index just past the complete type starting at start.
+    code = signature[start]
+    if code == 'a':
+        return _type_end(signature, start + 1)
+    if code in '({':
+        close = ')' if code == '(' else '}'
+        depth = 0
+        for i in range(start, len(signature)):
+            if signature[i] == code:
+                depth += 1
+            elif signature[i] == close:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        raise ValueError('Unbalanced DBus signature: {0}'.format(signature))
+    return start + 1
+
+
+def split_signature(signature):
+    """Split a DBus signature into a list of its complete types, for example
+    'sa{sv}as' becomes ['s', 'a{sv}', 'as'].
+    """
+    types = _split_cache.get(signature)
+    if types is None:
+        types = []
+        start = 0
+        while start < len(signature):
+            end = _type_end(signature, start)
+            types.append(signature[start:end])
+            start = end
+        _split_cache[signature] = types
+    return types
+
+
+class _Writer(object):
+    # Marshals values to a little endian byte buffer.  Alignment is relative to
+    # the start of the buffer, which must be the start of the message (or an
+    # 8 byte aligned offset into it, like the start of the body).
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def align(self, alignment):
+        padding = -len(self.buf) % alignment
+        if padding:
+            self.buf.extend(b'\0' * padding)
+
+    def write(self, signature, value):
+        # Write a value of a single complete type.
+        buf = self.buf
+        code = signature[0]
+        if code in _FIXED:
+            fmt, size = _FIXED[code]
+            self.align(size)
+            if code == 'b':
+                value = 1 if value else 0
+            buf.extend(struct.pack('<' + fmt, value))
+        elif code == 's' or code == 'o':
+            data = value.encode('utf-8')
+            self.align(4)
+            buf.extend(struct.pack('<I', len(data)))
+            buf.extend(data)
+            buf.append(0)
+        elif code == 'g':
+            data = value.encode('ascii')
+            buf.append(len(data))
+            buf.extend(data)
+            buf.append(0)
+        elif code == 'v':
+            self.write('g', value.signature)
+            self.write(value.signature, value.value)
+        elif code == '(':
+            self.align(8)
+            for item_signature, item in zip(split_signature(signature[1:-1]), value):
+                self.write(item_signature, item)
+        elif code == 'a':
+            element = signature[1:]
+            self.align(4)
+            length_offset = len(buf)
+            buf.extend(b'\0\0\0\0')
+            self.align(_ALIGN[element[0]])
+            start = len(buf)
+            if element == 'y':
+                # Fast path for byte arrays, copy the whole value at once.
+                buf.extend(value)
+            elif element[0] == '{':
+                key_signature, value_signature = split_signature(element[1:-1])
+                for key in value:
+                    self.align(8)
+                    self.write(key_signature, key)
+                    self.write(value_signature, value[key])
+            else:
+                for item in value:
+                    self.write(element, item)
+            struct.pack_into('<I', buf, length_offset, len(buf) - start)
+        else:
+            raise ValueError('Unsupported DBus type: {0}'.format(signature))
+
+
+class _Reader(object):
+    # Unmarshals values from a buffer in the specified byte order ('<' or '>').
+
+    def __init__(self, data, endian, offset=0):
+        self.data = data
+        self.endian = endian
+        self.offset = offset
+
+    def align(self, alignment):
+        self.offset += -self.offset % alignment
+
+    def read(self, signature):
+        # Read a value of a single complete type.
+        data = self.data
+        code = signature[0]
+        if code in _FIXED:
+            fmt, size = _FIXED[code]
+            self.align(size)
+            value = struct.unpack_from(self.endian + fmt, data, self.offset)[0]
+            self.offset += size
+            return bool(value) if code == 'b' else value
+        elif code == 's' or code == 'o':
+            self.align(4)
+            length = struct.unpack_from(self.endian + 'I', data, self.offset)[0]
+            start = self.offset + 4
+            self.offset = start + length + 1
+            return bytes(data[start:start+length]).decode('utf-8')
+        elif code == 'g':
+            length = data[self.offset]
+            start = self.offset + 1
+            self.offset = start + length + 1
+            return bytes(data[start:start+length]).decode('ascii')
+        elif code == 'v':
+            return self.read(self.read('g'))
+        elif code == '(':
+            self.align(8)
+            return tuple([self.read(x) for x in split_signature(signature[1:-1])])
+        elif code == 'a':
+            element = signature[1:]
+            self.align(4)
+            length = struct.unpack_from(self.endian + 'I', data, self.offset)[0]
+            self.offset += 4
+            self.align(_ALIGN[element[0]])
+            end = self.offset + length
+            if element == 'y':
+                value = bytes(data[self.offset:end])
+                self.offset = end
+                return value
+            if element[0] == '{':
+                key_signature, value_signature = split_signature(element[1:-1])
+                result = {}
+                while self.offset < end:
+                    self.align(8)
+                    key = self.read(key_signature)
+                    result[key] = self.read(value_signature)
+                return result
+            result = []
+            while self.offset < end:
+                result.append(self.read(element))
+            return result
+        raise ValueError('Unsupported DBus type: {0}'.format(signature))
+
+
+class Message(object):
+    """A DBus message: a method call, method return, error, or signal."""
+    __slots__ = ('type', 'flags', 'serial', 'path', 'interface', 'member',
+                 'error_name', 'reply_serial', 'destination', 'sender',
+                 'signature', 'body')
+
+    def __init__(self, type=METHOD_CALL, path=None, interface=None,
+                 member=None, signature='', body=(), destination=None,
+                 flags=0, error_name=None, reply_serial=None, sender=None,
+                 serial=0):
+        self.type = type
+        self.flags = flags
+        self.serial = serial
+        self.path = path
+        self.interface = interface
+        self.member = member
+        self.error_name = error_name
+        self.reply_serial = reply_serial
+        self.destination = destination
+        self.sender = sender
+        self.signature = signature
+        self.body = body
+
+    def marshal(self):
+        """Return the bytes of this message in the DBus wire format."""
+        body = _Writer()
+        for signature, value in zip(split_signature(self.signature), self.body):
+            body.write(signature, value)
+        fields = []
+        for code, value in ((_PATH, self.path), (_INTERFACE, self.interface),
+                            (_MEMBER, self.member),
+                            (_ERROR_NAME, self.error_name),
+                            (_REPLY_SERIAL, self.reply_serial),
+                            (_DESTINATION, self.destination),
+                            (_SENDER, self.sender)):
+            if value is not None:
+                fields.append((code, Variant(_FIELD_TYPES[code], value)))
+        if self.signature:
+            fields.append((_SIGNATURE, Variant('g', self.signature)))
+        header = _Writer()
+        header.buf.extend(struct.pack('<cBBBII', b'l', self.type, self.flags, 1,
+                                      len(body.buf), self.serial))
+        header.write('a(yv)', fields)
+        header.align(8)
+        header.buf.extend(body.buf)
+        return bytes(header.buf)
+
+    @staticmethod
+    def length(data):
+        """Return the total length of the message whose first HEADER_SIZE bytes
+        are provided.
+        """
+        endian = '<' if data[0:1] == b'l' else '>'
+        body_length, serial, fields_length = struct.unpack_from(endian + 'III', data, 4)
+        header_length = HEADER_SIZE + fields_length
+        return header_length + (-header_length % 8) + body_length
+
+    @classmethod
+    def unmarshal(cls, data):
+        """Create a message from a buffer holding exactly one marshalled
+        message.
+        """
+        endian = '<' if data[0:1] == b'l' else '>'
+        type, flags, version, body_length, serial = struct.unpack_from(endian + 'BBBII', data, 1)
+        reader = _Reader(data, endian, 12)
+        fields = dict(reader.read('a(yv)'))
+        reader.align(8)
+        message = cls(type=type, flags=flags, serial=serial,
+                      path=fields.get(_PATH),
+                      interface=fields.get(_INTERFACE),
+                      member=fields.get(_MEMBER),
+                      error_name=fields.get(_ERROR_NAME),
+                      reply_serial=fields.get(_REPLY_SERIAL),
+                      destination=fields.get(_DESTINATION),
+                      sender=fields.get(_SENDER),
+                      signature=fields.get(_SIGNATURE, ''))
+        message.body = [reader.read(x) for x in split_signature(message.signature)]
+        return message
@@ -0,0 +1,531 @@
+# BLE provider implementation using Linux's bluez library over its DBus
+# interface, talking to the bus directly from an asyncio event loop instead of
+# through dbus-python and a GLib main loop.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import logging
+import re
+import sys
+import threading
+import time
+
+from ..advertisements import AdvertisementStore, update_from_bluez
+from ..cache_maintenance import choose_evictions
+from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
+from ..interfaces import Provider
+from ..loop_monitor import timed
+from ..operation_queue import OperationQueue
+from ..uuids import intern_uuid
+from ..value_cache import services_changed
+from .. import metrics, tracing
+
+from .bus import MessageBus, DBusError
+from .message import Message, METHOD_CALL, Variant
+from .adapter import AsyncioBluezAdapter
+from .adapter import _INTERFACE as _ADAPTER_INTERFACE
+from .device import AsyncioBluezDevice
+from .device import _INTERFACE as _DEVICE_INTERFACE
+from .gatt import _CHARACTERISTIC_INTERFACE, _SERVICE_INTERFACE, _adapter_id, _device_address
+
+
+logger = logging.getLogger(__name__)
+
+_BLUEZ = 'org.bluez'
+_PROPERTIES_INTERFACE    = 'org.freedesktop.DBus.Properties'
+_OBJECT_MANAGER_INTERFACE = 'org.freedesktop.DBus.ObjectManager'
+
+# Pattern to pull the device path out of the path of any object underneath it,
+# like /org/bluez/hci0/dev_00_11_22_33_44_55/service000a/char000b.
+_DEVICE_PATH_RE = re.compile(r'^(/org/bluez/[^/]+/dev_[0-9A-Fa-f_]+)')
+
+# Maximum number of GATT operations to have outstanding with a device at once.
+# Bluez queues requests to different characteristics itself, so a few can be
+# pipelined (operations on the same characteristic are never overlapped).
+_MAX_IN_FLIGHT = 4
+
+# Number of RemoveDevice calls to have outstanding at once when evicting
+# devices from bluez's cache.
+_REMOVE_BATCH = 32
+
+
+def _is_transient(ex):
+    """Return True if the exception is a bluez error that is worth retrying,
+    like another operation being in progress on the characteristic.
+    """
+    if not isinstance(ex, DBusError):
+        return False
+    if ex.name == 'org.bluez.Error.InProgress':
+        return True
+    # Some bluez versions report in progress errors as a generic failure.
+    return ex.name == 'org.bluez.Error.Failed' and 'progress' in ex.text.lower()
+
+
+class AsyncioBluezProvider(Provider):
+    """BLE provider implementation using the bluez DBus interface over a DBus
+    connection driven by an asyncio event loop.  The event loop runs on a
+    background thread owned by the provider, so no GLib main loop (or
+    dbus-python) is needed.
+
+    The provider mirrors bluez's object tree in memory from a single
+    GetManagedObjects call and keeps it up to date from the InterfacesAdded,
+    InterfacesRemoved, and PropertiesChanged signals, so listing devices and
+    reading properties never waits on the bus.
+    """
+
+    def __init__(self):
+        self._address = None
+        self._bus = None
+        self._loop = None
+        self._loop_thread = None
+        self._init_lock = threading.RLock()
+        # Mirror of bluez's objects as a dict of object path to a dict of
+        # interface name to a dict of properties.  Only changed on the event
+        # loop thread, the condition is notified after every change.
+        self._objects = {}
+        self._changed = threading.Condition()
+        # Notification callbacks keyed by characteristic path.
+        self._notify_handlers = {}
+        # Disconnect callbacks of each device path.
+        self._disconnect_callbacks = {}
+        # State for clients sharing the event loop through start and stop.
+        self._loop_lock = threading.Lock()
+        self._loop_clients = 0
+        self._mainloop_done = None
+        self._return_code = 0
+        self._exception = None
+        # Keep a GATT operation queue for each device, keyed by its DBus path.
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+        # What each device advertised and when it was last seen.
+        self._advertisements = AdvertisementStore()
+
+    def initialize(self, address=None):
+        """Connect to the system bus (or the bus at the specified DBus address)
+        and load bluez's object tree.  Must be called before any other calls
+        are made!  Calling it again after it succeeded does nothing, so
+        independent clients in the same process can all call it.
+        """
+        with self._init_lock:
+            if self._bus is not None:
+                return
+            self._address = address
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever,
+                                                 name='AsyncioBluezProvider event loop')
+            self._loop_thread.daemon = True  # Don't let the event loop block exit.
+            self._loop_thread.start()
+            try:
+                self._run(self._connect(), TIMEOUT_SEC)
+            except Exception:
+                self._close()
+                raise
+
+    async def _connect(self):
+        # Connect to the bus and subscribe to bluez's signals before loading
+        # the object tree, so no change can be missed in between.  The match
+        # rules and object tree request are all sent before waiting for any
+        # reply.
+        bus = MessageBus(self._loop)
+        await bus.connect(self._address)
+        bus.add_signal_handler(timed(self._signal_received, 'signal'))
+        replies = [
+            bus.add_match(type='signal', sender=_BLUEZ,
+                          interface=_PROPERTIES_INTERFACE, member='PropertiesChanged'),
+            bus.add_match(type='signal', sender=_BLUEZ,
+                          interface=_OBJECT_MANAGER_INTERFACE, member='InterfacesAdded'),
+            bus.add_match(type='signal', sender=_BLUEZ,
+                          interface=_OBJECT_MANAGER_INTERFACE, member='InterfacesRemoved'),
+            bus.call(Message(METHOD_CALL, '/', _OBJECT_MANAGER_INTERFACE,
+                             'GetManagedObjects', destination=_BLUEZ))
+        ]
+        replies = await asyncio.gather(*replies)
+        self._bus = bus
+        self._update_objects(lambda: self._objects.update(replies[-1].body[0]))
+
+    def _signal_received(self, message):
+        # Apply a bluez signal to the object tree.  Called on the event loop.
+        if message.member == 'PropertiesChanged':
+            interface, changed, invalidated = message.body
+            def update():
+                # Ignore changes to objects that were already removed.
+                props = self._objects.get(message.path, {}).get(interface)
+                if props is None:
+                    return
+                props.update(changed)
+                for name in invalidated:
+                    props.pop(name, None)
+            self._update_objects(update)
+            if interface == _CHARACTERISTIC_INTERFACE and 'Value' in changed:
+                on_change = self._notify_handlers.get(message.path)
+                if on_change is not None:
+                    on_change(changed['Value'])
+            elif interface == _DEVICE_INTERFACE:
+                update_from_bluez(self._advertisements, message.path, changed)
+                if 'Connected' in changed and not changed['Connected']:
+                    for callback in list(self._disconnect_callbacks.get(message.path, ())):
+                        callback()
+                if 'ServicesResolved' in changed:
+                    services_changed(_device_address(message.path))
+        elif message.member == 'InterfacesAdded':
+            path, interfaces = message.body
+            self._update_objects(lambda: self._objects.setdefault(path, {}).update(interfaces))
+            if _DEVICE_INTERFACE in interfaces:
+                update_from_bluez(self._advertisements, path, interfaces[_DEVICE_INTERFACE])
+            if _SERVICE_INTERFACE in interfaces:
+                # A service added to a device means its services changed.
+                services_changed(_device_address(path))
+        elif message.member == 'InterfacesRemoved':
+            path, interfaces = message.body
+            def remove():
+                current = self._objects.get(path, {})
+                for name in interfaces:
+                    current.pop(name, None)
+                if len(current) == 0:
+                    self._objects.pop(path, None)
+            self._update_objects(remove)
+
+    def _update_objects(self, update):
+        # Change the object tree and wake up any thread waiting for a change.
+        with self._changed:
+            update()
+            self._changed.notify_all()
+
+    def _wait_for(self, predicate, timeout_sec=TIMEOUT_SEC):
+        """Wait up to timeout_sec for the predicate function to return True,
+        checking it after every change to the object tree.  Returns the
+        predicate's last result.
+        """
+        deadline = as_deadline(timeout_sec)
+        with self._changed:
+            try:
+                return deadline.wait_for(self._changed, predicate)
+            except DeadlineExceeded:
+                return predicate()
+
+    def _run(self, coroutine, timeout_sec=TIMEOUT_SEC):
+        """Run a coroutine on the event loop and wait up to timeout_sec for its
+        result.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        # Cancelling the future cancels the DBus call waiting for its reply.
+        return as_deadline(timeout_sec).wait_future(future, 'Exceeded timeout waiting for DBus reply!')
+
+    def _call(self, path, interface, member, signature='', body=(),
+              timeout_sec=TIMEOUT_SEC):
+        """Call a bluez method from any thread and return the values in its
+        reply.  Raises a DBusError if bluez returns an error.
+        """
+        return self._run(self._bus.call_method(_BLUEZ, path, interface, member,
+                                               signature, body), timeout_sec)
+
+    def _send(self, path, interface, member, signature='', body=()):
+        """Call a bluez method from any thread without waiting for its reply."""
+        asyncio.run_coroutine_threadsafe(self._bus.call_method(_BLUEZ, path, interface, member,
+                                                               signature, body), self._loop)
+
+    def _call_all(self, calls, timeout_sec=TIMEOUT_SEC):
+        """Send a list of (path, interface, member, signature, body) bluez
+        method calls at once and wait for all the replies.  Returns a list with
+        each call's reply values or the exception it failed with.
+        """
+        async def call_all():
+            return await asyncio.gather(*[self._bus.call_method(_BLUEZ, *x) for x in calls],
+                                        return_exceptions=True)
+        return self._run(call_all(), timeout_sec)
+
+    def _get_property(self, path, interface, name, default=None):
+        """Return a property of a bluez object from the object tree."""
+        return self._objects.get(path, {}).get(interface, {}).get(name, default)
+
+    def _paths(self, interface, parent_path='/org/bluez'):
+        """Return a sorted list of the paths of all bluez objects that implement
+        the requested interface and are under the specified path.
+        """
+        parent_path = parent_path.lower()
+        with self._changed:
+            return sorted([path for path, interfaces in self._objects.items()
+                           if interface in interfaces and path.lower().startswith(parent_path)])
+
+    def run_mainloop_with(self, target, on_mainloop=False):
+        """Run the specified target function while the provider's event loop
+        processes asyncronous BLE events.  Target function should be a function
+        that takes no parameters and optionally return an integer response code.
+        When the target function stops executing or returns with value then the
+        program will exit with the returned code.
+
+        The event loop always runs on the provider's own thread so the target
+        is simply called from this thread.  If on_mainloop is True the target is
+        instead called from the event loop itself, in which case it must not
+        block and if it returns None the program keeps processing events until
+        interrupted.
+        """
+        if not on_mainloop:
+            return_code = target()
+            sys.exit(return_code if return_code is not None else 0)
+        self._mainloop_done = threading.Event()
+        self._loop.call_soon_threadsafe(self._mainloop_target, target)
+        try:
+            # Wait in short steps so KeyboardInterrupt is delivered promptly.
+            while not self._mainloop_done.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            sys.exit(0)
+        if self._exception is not None:
+            from future.utils import raise_
+            raise_(self._exception[1], None, self._exception[2])
+        sys.exit(self._return_code)
+
+    def _mainloop_target(self, target):
+        # Run the user's target on the event loop.
+        try:
+            return_code = target()
+            if return_code is not None:
+                self._return_code = return_code
+                self._mainloop_done.set()
+        except Exception:
+            self._exception = sys.exc_info()
+            self._mainloop_done.set()
+
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Make sure the provider's event loop is running, for applications
+        that share the provider between independent clients.  The event loop
+        runs until each call to start has been matched by a call to stop.
+        """
+        with self._loop_lock:
+            self._loop_clients += 1
+            self.initialize(self._address)
+
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Release the event loop acquired with start.  When the last client
+        releases it the bus connection is closed and the event loop thread is
+        joined before returning, waiting up to timeout_sec for it to finish.
+        """
+        with self._loop_lock:
+            if self._loop_clients == 0:
+                return
+            self._loop_clients -= 1
+            if self._loop_clients == 0:
+                self._close(timeout_sec)
+
+    def _close(self, timeout_sec=TIMEOUT_SEC):
+        # Close the bus and stop the event loop thread.
+        with self._init_lock:
+            loop = self._loop
+            thread = self._loop_thread
+            bus = self._bus
+            self._bus = None
+            self._loop = None
+            self._loop_thread = None
+            if loop is None:
+                return
+            if bus is not None:
+                loop.call_soon_threadsafe(bus.close)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout_sec)
+            if thread.is_alive():
+                raise RuntimeError('Exceeded timeout waiting for event loop to stop!')
+            loop.close()
+            self._update_objects(self._objects.clear)
+
+    def clear_cached_data(self):
+        """Clear any internally cached BLE device data.  Necessary in some cases
+        to prevent issues with stale device data getting cached by the OS.
+        """
+        # Remove every device that isn't connected.
+        self._remove_devices([(props.get('Adapter'), path) for path, props in self._device_properties()
+                              if not props.get('Connected', False)])
+
+    def _purge_cache(self, max_age_sec, max_devices, timeout_sec):
+        """Evict devices that aren't connected, paired, or trusted from bluez's
+        cache by when they last advertised.  Returns a tuple of the number of
+        devices evicted and remaining.
+        """
+        devices = self._device_properties()
+        # Advertisement records expire long before max_age_sec, so use the
+        # last seen times the store keeps for every cached device.
+        seen = self._advertisements.last_seen_times([props.get('Address') for path, props in devices])
+        candidates = []
+        for path, props in devices:
+            if props.get('Connected', False) or props.get('Paired', False) or \
+               props.get('Trusted', False):
+                continue
+            candidates.append((seen[props.get('Address')], (props.get('Adapter'), path)))
+        evict = choose_evictions(candidates, len(devices), max_age_sec, max_devices, time.time())
+        self._remove_devices(evict, timeout_sec)
+        for adapter, path in evict:
+            self._advertisements.remove(_device_address(path))
+        return len(evict), len(devices) - len(evict)
+
+    def _device_properties(self):
+        """Return a list of (path, properties) tuples for every device from the
+        object tree.
+        """
+        with self._changed:
+            return [(path, dict(interfaces[_DEVICE_INTERFACE]))
+                    for path, interfaces in self._objects.items()
+                    if _DEVICE_INTERFACE in interfaces]
+
+    def _remove_devices(self, removals, timeout_sec=TIMEOUT_SEC):
+        """Remove a list of (adapter path, device path) tuples from bluez's
+        cache, sending RemoveDevice calls _REMOVE_BATCH at a time.  Devices
+        already gone are ignored, any other error is raised after every call
+        finished.
+        """
+        deadline = as_deadline(timeout_sec)
+        errors = []
+        for i in range(0, len(removals), _REMOVE_BATCH):
+            calls = [(adapter, _ADAPTER_INTERFACE, 'RemoveDevice', 'o', (path,))
+                     for adapter, path in removals[i:i+_REMOVE_BATCH]]
+            for result in self._call_all(calls, deadline):
+                if isinstance(result, DBusError) and result.name == 'org.bluez.Error.DoesNotExist':
+                    continue
+                if isinstance(result, Exception):
+                    errors.append(result)
+        self._drop_operation_queues([path for adapter, path in removals])
+        if errors:
+            raise errors[0]
+
+    def disconnect_devices(self, service_uuids=[], timeout_sec=TIMEOUT_SEC):
+        """Disconnect any connected devices that have the specified list of
+        service UUIDs.  The default is an empty list which means all devices
+        are disconnected.  Every device is disconnected at once and they share
+        the timeout.  Returns a dict of each matching device's id to None if it
+        disconnected, or the exception it failed with.
+        """
+        with tracing.span('provider.disconnect_devices'):
+            deadline = as_deadline(timeout_sec)
+            devices = self._connected_devices(set(service_uuids))
+            async def disconnect(path):
+                try:
+                    await asyncio.wait_for(self._bus.call_method(_BLUEZ, path, _DEVICE_INTERFACE,
+                                                                 'Disconnect', '', ()),
+                                           deadline.remaining())
+                except asyncio.TimeoutError:
+                    raise RuntimeError('Exceeded timeout waiting to disconnect from device!')
+            async def disconnect_all():
+                return await asyncio.gather(*[disconnect(x[0]) for x in devices],
+                                            return_exceptions=True)
+            # Each call has its own timeout so the wait for the replies is
+            # bounded without one.
+            replies = self._run(disconnect_all(), None) if devices else []
+            # Replies can arrive before the tree has the Connected change.
+            self._wait_for(lambda: not any([self._get_property(x[0], _DEVICE_INTERFACE, 'Connected', False)
+                                            for x, reply in zip(devices, replies) if reply is None]),
+                           deadline)
+            results = {}
+            for (path, address), reply in zip(devices, replies):
+                if reply is None and self._get_property(path, _DEVICE_INTERFACE, 'Connected', False):
+                    reply = RuntimeError('Exceeded timeout waiting to disconnect from device!')
+                with metrics.operation('disconnect', _adapter_id(path), address) as operation:
+                    if reply is not None:
+                        operation.fail()
+                results[address] = reply
+            return results
+
+    def _connected_devices(self, service_uuids):
+        """Return a list of (path, address) tuples for the connected devices
+        that have at least the specified set of service UUIDs, from the object
+        tree.  A device's UUIDs are its discovered services and the UUIDs bluez
+        cached for it from advertisements.
+        """
+        with self._changed:
+            objects = list(self._objects.items())
+        services = {}
+        for path, interfaces in objects:
+            if _SERVICE_INTERFACE in interfaces:
+                match = _DEVICE_PATH_RE.match(path)
+                if match is not None:
+                    services.setdefault(match.group(1), set()).add(
+                        intern_uuid(interfaces[_SERVICE_INTERFACE].get('UUID')))
+        devices = []
+        for path, interfaces in objects:
+            props = interfaces.get(_DEVICE_INTERFACE)
+            if props is None or not props.get('Connected', False):
+                continue
+            device_uuids = services.get(path, set()) | \
+                set([intern_uuid(x) for x in props.get('UUIDs', [])])
+            if device_uuids >= service_uuids:
+                devices.append((path, props.get('Address')))
+        return sorted(devices)
+
+    def list_adapters(self):
+        """Return a list of BLE adapter objects connected to the system."""
+        return [AsyncioBluezAdapter(self, x) for x in self._paths(_ADAPTER_INTERFACE)]
+
+    def list_devices(self):
+        """Return a list of BLE devices known to the system."""
+        return [AsyncioBluezDevice(self, x) for x in self._paths(_DEVICE_INTERFACE)]
+
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        if adapter is None:
+            adapter = self.get_default_adapter()
+            if adapter is None:
+                raise RuntimeError('Failed to find a bluetooth adapter!')
+        path = '{0}/dev_{1}'.format(adapter._path, address.upper().replace(':', '_'))
+        if self._get_property(path, _DEVICE_INTERFACE, 'Address') is None:
+            # Have bluez create the device and connect to it, which it can do
+            # without having seen the device advertise.
+            options = {'Address': Variant('s', address),
+                       'AddressType': Variant('s', address_type or 'public')}
+            try:
+                path = self._call(adapter._path, _ADAPTER_INTERFACE, 'ConnectDevice', 'a{sv}',
+                                  (options,), deadline)[0]
+            except DBusError as ex:
+                if ex.name == 'org.freedesktop.DBus.Error.UnknownMethod':
+                    raise RuntimeError('Connecting to a device bluez has not seen requires '
+                                       'ConnectDevice from bluez 5.49 or later run with --experimental!')
+                # A scan might have just found the device.
+                if ex.name != 'org.bluez.Error.AlreadyExists':
+                    raise
+            self._wait_for(lambda: self._get_property(path, _DEVICE_INTERFACE, 'Address') is not None,
+                           deadline)
+        return AsyncioBluezDevice(self, path)
+
+    def _operation_queue(self, path):
+        """Return the GATT operation queue for the device that owns the DBus
+        object at the specified path (the device itself or any of its services,
+        characteristics, or descriptors).
+        """
+        match = _DEVICE_PATH_RE.match(path)
+        device_path = match.group(1) if match is not None else path
+        with self._queues_lock:
+            queue = self._queues.get(device_path)
+            if queue is None:
+                queue = OperationQueue(max_in_flight=_MAX_IN_FLIGHT,
+                                       is_transient=_is_transient)
+                self._queues[device_path] = queue
+            return queue
+
+    def _drop_operation_queues(self, device_paths):
+        """Forget the GATT operation queues (and their stats) of devices that
+        were removed from bluez's cache.
+        """
+        with self._queues_lock:
+            for path in device_paths:
+                self._queues.pop(path, None)
+
+    def _call_later(self, delay_sec, callback):
+        """Call the callback once from the event loop after delay_sec seconds.
+        Can be called from any thread.
+        """
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay_sec, callback)
@@ -26,12 +26,30 @@ import threading
 import dbus
 
 from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
 from ..interfaces import Adapter
+from .. import tracing
+from ..loop_monitor import timed
 
 
 _INTERFACE = 'org.bluez.Adapter1'
 
 
+def _call(method, deadline, message, *args):
+    """Make a blocking DBus method call that waits for its reply no longer
+    than what's left of the deadline, and raise DeadlineExceeded with the
+    message if it runs out first.
+    """
+    remaining = deadline.remaining()
+    try:
+        # A timeout of -1 is dbus-python's default.
+        return method(*args, timeout=max(0.001, remaining) if remaining is not None else -1)
+    except dbus.exceptions.DBusException as ex:
+        if ex.get_dbus_name() == 'org.freedesktop.DBus.Error.NoReply' and deadline.expired:
+            raise DeadlineExceeded(message)
+        raise
+
+
 class BluezAdapter(Adapter):
     """Bluez BLE network adapter."""
 
@@ -39,11 +57,13 @@ class BluezAdapter(Adapter):
         """Create an instance of the bluetooth adapter from the provided bluez
         DBus object.
         """
+        self._path = dbus_obj.object_path
         self._adapter = dbus.Interface(dbus_obj, _INTERFACE)
         self._props = dbus.Interface(dbus_obj, 'org.freedesktop.DBus.Properties')
         self._scan_started = threading.Event()
         self._scan_stopped = threading.Event()
-        self._props.connect_to_signal('PropertiesChanged', self._prop_changed)
+        self._props.connect_to_signal('PropertiesChanged',
+                                      timed(self._prop_changed, 'adapter.properties_changed'))
 
     def _prop_changed(self, iface, changed_props, invalidated_props):
         # Handle property changes for the adapter.  Note this call happens in
@@ -58,6 +78,11 @@ class BluezAdapter(Adapter):
         if 'Discovering' in changed_props and changed_props['Discovering'] == 0:
             self._scan_stopped.set()
 
+    @property
+    def id(self):
+        """Return the identifier of this adapter in the system, like hci0."""
+        return self._path.rsplit('/', 1)[-1]
+
     @property
     def name(self):
         """Return the name of this BLE network adapter."""
@@ -65,17 +90,23 @@ class BluezAdapter(Adapter):
 
     def start_scan(self, timeout_sec=TIMEOUT_SEC):
         """Start scanning for BLE devices with this adapter."""
-        self._scan_started.clear()
-        self._adapter.StartDiscovery()
-        if not self._scan_started.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting for adapter to start scanning!')
+        with tracing.span('scan.start', adapter=self.id):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            self._scan_started.clear()
+            message = 'Exceeded timeout waiting for adapter to start scanning!'
+            _call(self._adapter.StartDiscovery, deadline, message)
+            deadline.wait(self._scan_started, message)
 
     def stop_scan(self, timeout_sec=TIMEOUT_SEC):
         """Stop scanning for BLE devices with this adapter."""
-        self._scan_stopped.clear()
-        self._adapter.StopDiscovery()
-        if not self._scan_stopped.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting for adapter to stop scanning!')
+        with tracing.span('scan.stop', adapter=self.id):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            self._scan_stopped.clear()
+            message = 'Exceeded timeout waiting for adapter to stop scanning!'
+            _call(self._adapter.StopDiscovery, deadline, message)
+            deadline.wait(self._scan_stopped, message)
 
     @property
     def is_scanning(self):
@@ -97,3 +128,21 @@ class BluezAdapter(Adapter):
         """Return True if the BLE adapter is powered up, otherwise return False.
         """
         return self._props.Get(_INTERFACE, 'Powered')
+
+    def _connect_device(self, address, address_type='public', timeout_sec=TIMEOUT_SEC):
+        """Create a device object for the specified address under this adapter
+        and connect to it with bluez's ConnectDevice, even if this adapter
+        hasn't seen the device advertise.  Returns the DBus path of the device.
+        ConnectDevice is experimental in bluez so a DBusException is raised if
+        it isn't supported.
+        """
+        params = dbus.Dictionary({'Address': address, 'AddressType': address_type},
+                                 signature='sv')
+        return _call(self._adapter.ConnectDevice, as_deadline(timeout_sec),
+                     'Exceeded timeout waiting to connect to device!', params)
+
+    def _device_path(self, address):
+        """Return the DBus path bluez uses for the device with the specified
+        address under this adapter.
+        """
+        return '{0}/dev_{1}'.format(self._path, address.upper().replace(':', '_'))
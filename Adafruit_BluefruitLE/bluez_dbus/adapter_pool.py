@@ -0,0 +1,264 @@
+# Pool of bluez adapters that spreads device connections over every powered
+# adapter and keeps scanning on a dedicated adapter.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+
+import dbus
+
+from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
+from ..platform import get_provider
+from ..uuids import intern_uuid
+
+from .device import BluezDevice
+from .device import _INTERFACE as _DEVICE_INTERFACE
+
+
+logger = logging.getLogger(__name__)
+
+# Default limit of connections per adapter.  Most USB dongles handle somewhere
+# between 5 and 10 LE connections before they start dropping them.
+_MAX_CONNECTIONS = 7
+
+# How many dB of signal strength one existing connection is worth when picking
+# an adapter: an adapter with one more connection is only picked if it hears
+# the device more than this much louder.
+_CONNECTION_COST_DB = 10
+
+# RSSI assumed for an adapter that hasn't heard the device advertise.
+_UNKNOWN_RSSI = -100
+
+
+class BluezAdapterPool(object):
+    """Pool of every powered bluez adapter.  One adapter is dedicated to
+    scanning while connections are spread over the others by their number of
+    connections (up to max_connections each) and how well they hear the device.
+    When there is only one adapter it does both.  Scan results heard by more
+    than one adapter are reported once.
+
+    Scan_adapter picks the scanning adapter by its id (like 'hci0'), the
+    default is the first adapter.
+    """
+
+    def __init__(self, provider=None, scan_adapter=None,
+                 max_connections=_MAX_CONNECTIONS,
+                 connection_cost_db=_CONNECTION_COST_DB):
+        self._provider = provider if provider is not None else get_provider()
+        self._scan_adapter_id = scan_adapter
+        self._max_connections = max_connections
+        self._connection_cost_db = connection_cost_db
+        # Connections being made right now, keyed by adapter path, so threads
+        # connecting at the same time don't all pick the same adapter.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._adapters = []
+        self._scan_adapter = None
+        self.refresh()
+
+    def refresh(self):
+        """Reload the list of powered adapters, for example after a dongle was
+        plugged in or removed.
+        """
+        adapters = [x for x in self._provider.list_adapters() if x.is_powered]
+        if len(adapters) == 0:
+            raise RuntimeError('No powered bluetooth adapters found!')
+        scan_adapter = adapters[0]
+        if self._scan_adapter_id is not None:
+            matches = [x for x in adapters if x.id == self._scan_adapter_id]
+            if len(matches) == 0:
+                raise RuntimeError('Scan adapter {0} is not available!'.format(self._scan_adapter_id))
+            scan_adapter = matches[0]
+        with self._lock:
+            self._adapters = adapters
+            self._scan_adapter = scan_adapter
+
+    @property
+    def adapters(self):
+        """Return the list of every adapter in the pool."""
+        return list(self._adapters)
+
+    @property
+    def scan_adapter(self):
+        """Return the adapter dedicated to scanning."""
+        return self._scan_adapter
+
+    @property
+    def connection_adapters(self):
+        """Return the list of adapters that connections are spread over.  This
+        is every adapter except the scan adapter, unless it's the only one.
+        """
+        adapters = [x for x in self._adapters if x is not self._scan_adapter]
+        return adapters if len(adapters) > 0 else [self._scan_adapter]
+
+    def start_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Start scanning for BLE devices with the scan adapter."""
+        self._scan_adapter.start_scan(timeout_sec)
+
+    def stop_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Stop scanning for BLE devices with the scan adapter."""
+        self._scan_adapter.stop_scan(timeout_sec)
+
+    def _snapshot(self):
+        # Return a dict of device address to a dict of adapter path to the
+        # device's DBus path and properties under that adapter, from a single
+        # GetManagedObjects call.
+        devices = {}
+        for path, interfaces in self._provider._bluez.GetManagedObjects().items():
+            props = interfaces.get(_DEVICE_INTERFACE)
+            if props is None:
+                continue
+            seen = devices.setdefault(str(props['Address']), {})
+            seen[str(props['Adapter'])] = (path, props)
+        return devices
+
+    def load(self):
+        """Return a dict of adapter id to the number of devices it's connected
+        to or is connecting to right now.
+        """
+        snapshot = self._snapshot()
+        with self._lock:
+            counts = self._connection_counts(snapshot)
+        return dict([(x.id, counts.get(x._path, 0)) for x in self._adapters])
+
+    def _connection_counts(self, snapshot):
+        # Count connected and pending connections per adapter path.  Must be
+        # called with the lock held.
+        counts = dict(self._pending)
+        for seen in snapshot.values():
+            for adapter_path, (path, props) in seen.items():
+                if props.get('Connected', False):
+                    counts[adapter_path] = counts.get(adapter_path, 0) + 1
+        return counts
+
+    def find_devices(self, service_uuids=[], name=None):
+        """Return devices that advertise the specified service UUIDs and/or
+        have the specified name, like Provider.find_devices, but each device
+        is only returned once even if several adapters have seen it.  The
+        copy from the adapter that hears the device loudest is returned.
+        """
+        expected = set(service_uuids)
+        found = []
+        for address, seen in self._snapshot().items():
+            path, props = max(seen.values(), key=lambda x: int(x[1].get('RSSI', _UNKNOWN_RSSI)))
+            if name is not None:
+                if props.get('Name') != name:
+                    continue
+            elif not set([intern_uuid(x) for x in props.get('UUIDs', [])]) >= expected:
+                continue
+            found.append(BluezDevice(self._provider._bus.get_object('org.bluez', path)))
+        return found
+
+    def select_adapter(self, device):
+        """Return the connection adapter that the device should be connected
+        with: the one with the fewest connections, preferring an adapter that
+        hears the device louder by more than connection_cost_db for each extra
+        connection.  Raises an exception if every adapter is full.
+        """
+        snapshot = self._snapshot()
+        with self._lock:
+            return self._select(snapshot.get(str(device.id), {}),
+                                self._connection_counts(snapshot))
+
+    def _select(self, seen, counts, known_only=False):
+        # Return the best connection adapter.  When known_only is True it's
+        # instead the best of every adapter that already knows the device,
+        # including the scan adapter.  Must be called with the lock held.
+        best = None
+        best_score = None
+        adapters = self.connection_adapters
+        if known_only:
+            adapters = [x for x in self._adapters if x._path in seen]
+        for adapter in adapters:
+            connections = counts.get(adapter._path, 0)
+            if connections >= self._max_connections:
+                continue
+            rssi = _UNKNOWN_RSSI
+            if adapter._path in seen:
+                rssi = int(seen[adapter._path][1].get('RSSI', _UNKNOWN_RSSI))
+            score = connections*self._connection_cost_db - rssi
+            if best_score is None or score < best_score:
+                best = adapter
+                best_score = score
+        if best is None:
+            raise RuntimeError('Every bluetooth adapter has reached its connection limit!')
+        return best
+
+    def connect(self, device, timeout_sec=TIMEOUT_SEC):
+        """Connect to the device with the adapter picked by select_adapter and
+        return the device object for that adapter, which might not be the
+        device object that was passed in (bluez keeps a separate object for each
+        adapter that knows the device).  When the picked adapter hasn't seen
+        the device it's connected with bluez's ConnectDevice, which needs
+        bluetoothd to run with --experimental.  If that isn't supported the
+        adapter that discovered the device (usually the scan adapter) is used
+        instead, as long as it's below max_connections, and an exception is
+        raised otherwise.  Waits up to timeout_sec in total.
+        """
+        deadline = as_deadline(timeout_sec)
+        address = str(device.id)
+        # Read bluez's devices before taking the lock so concurrent connects
+        # don't wait on each other's DBus call.  Connections still being made
+        # are counted by _pending.
+        snapshot = self._snapshot()
+        seen = snapshot.get(address, {})
+        with self._lock:
+            # Pick the adapter and count the connection as pending in one step
+            # so concurrent connects spread out.
+            adapter = self._select(seen, self._connection_counts(snapshot))
+            self._pending[adapter._path] = self._pending.get(adapter._path, 0) + 1
+        try:
+            if adapter._path in seen:
+                path = seen[adapter._path][0]
+            else:
+                address_type = 'public'
+                if len(seen) > 0:
+                    address_type = str(list(seen.values())[0][1].get('AddressType', 'public'))
+                try:
+                    path = adapter._connect_device(address, address_type, deadline)
+                except dbus.exceptions.DBusException as ex:
+                    logger.debug('ConnectDevice failed on {0}: {1}'.format(adapter.id, ex))
+                    # Fall back to an adapter that already knows the device,
+                    # like the scan adapter that found it, moving the pending
+                    # connection over to it.
+                    with self._lock:
+                        self._pending[adapter._path] -= 1
+                        adapter = None
+                        try:
+                            adapter = self._select(seen, self._connection_counts(snapshot),
+                                                   known_only=True)
+                        except RuntimeError:
+                            pass
+                        if adapter is None:
+                            raise RuntimeError('Failed to connect to {0}, ConnectDevice is not '
+                                               'available (run bluetoothd with --experimental) and '
+                                               'no adapter with room has seen the device!'.format(address))
+                        self._pending[adapter._path] = self._pending.get(adapter._path, 0) + 1
+                    path = seen[adapter._path][0]
+            connected = BluezDevice(self._provider._bus.get_object('org.bluez', path))
+            if not connected.is_connected:
+                connected.connect(deadline)
+            return connected
+        finally:
+            if adapter is not None:
+                with self._lock:
+                    self._pending[adapter._path] -= 1
@@ -0,0 +1,132 @@
+# Non-blocking socket channel for the file descriptors bluez hands out from a
+# characteristic's AcquireNotify and AcquireWrite methods.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import errno
+import os
+import select
+import socket
+import time
+
+from ..config import TIMEOUT_SEC
+
+
+# Errors that mean a non-blocking socket operation needs to be tried again.
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class AcquiredChannel(object):
+    """Data channel for a characteristic that was acquired from bluez.  Bluez
+    passes back one end of a SOCK_SEQPACKET socket pair where each packet is
+    one characteristic value (a notification or a write command), along with
+    the MTU which is the largest value a packet can hold.  Reads and writes are
+    non-blocking: reads are meant to be driven by a main loop watch on the
+    channel's fileno, and writes wait for the socket to be writable with select.
+
+    The channel works with any SOCK_SEQPACKET socket, so it can be exercised
+    without bluez using one end of socket.socketpair(socket.AF_UNIX,
+    socket.SOCK_SEQPACKET), like benchmarks/acquired_channel.py does.
+    """
+
+    def __init__(self, sock, mtu):
+        """Create a channel from a socket object or a raw file descriptor (which
+        the channel takes ownership of) and the MTU reported by bluez.
+        """
+        if not isinstance(sock, socket.socket):
+            fd = sock
+            sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            # fromfd duplicates the descriptor so close the original.
+            os.close(fd)
+        sock.setblocking(False)
+        self._sock = sock
+        self._mtu = int(mtu)
+        self._closed = False
+
+    @property
+    def mtu(self):
+        """Return the largest value that fits in a single packet."""
+        return self._mtu
+
+    @property
+    def closed(self):
+        """Return True if the channel has been closed."""
+        return self._closed
+
+    def fileno(self):
+        """Return the file descriptor of the channel's socket."""
+        return self._sock.fileno()
+
+    def read_available(self, on_data):
+        """Read every packet that is waiting on the socket without blocking and
+        call on_data with the bytes of each one.  Returns True if the channel is
+        still open, or False if the other end hung up (in which case the
+        channel is closed).
+        """
+        if self._closed:
+            return False
+        while True:
+            try:
+                # Read a little more than the MTU so a packet can't be
+                # truncated if the MTU changed after the channel was acquired.
+                data = self._sock.recv(self._mtu + 64)
+            except socket.error as ex:
+                if ex.errno in _WOULD_BLOCK:
+                    return True
+                self.close()
+                return False
+            if len(data) == 0:
+                # Zero length read means the other end closed the socket.
+                self.close()
+                return False
+            on_data(data)
+
+    def write(self, data, timeout_sec=TIMEOUT_SEC):
+        """Write data to the channel, splitting it into MTU sized packets.  Waits
+        up to timeout_sec for room in the socket's buffer and throws an
+        exception if the timeout is exceeded or the channel was closed.
+        """
+        if self._closed:
+            raise RuntimeError('Acquired characteristic channel is closed!')
+        view = memoryview(data)
+        start = time.time()
+        for offset in range(0, len(view), self._mtu):
+            packet = view[offset:offset+self._mtu]
+            while True:
+                try:
+                    self._sock.send(packet)
+                    break
+                except socket.error as ex:
+                    if ex.errno not in _WOULD_BLOCK:
+                        self.close()
+                        raise
+                # Socket buffer is full, wait for it to become writable.
+                remaining = timeout_sec - (time.time() - start)
+                if remaining <= 0:
+                    raise RuntimeError('Exceeded timeout waiting to write to characteristic!')
+                select.select([], [self._sock], [], remaining)
+
+    def close(self):
+        """Close the channel.  Bluez releases the acquired characteristic when
+        its end of the socket is closed.
+        """
+        if not self._closed:
+            self._closed = True
+            self._sock.close()
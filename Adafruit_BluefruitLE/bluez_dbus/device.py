@@ -21,19 +21,23 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from past.builtins import map
 import threading
-import time
-import uuid
 
 import dbus
 
 from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
+from ..gatt_snapshot import from_bluez_objects
 from ..interfaces import Device
 from ..platform import get_provider
+from ..uuids import intern_uuid
+from .. import metrics, tracing
+from ..loop_monitor import timed
 
 from .adapter import _INTERFACE as _ADAPTER_INTERFACE
-from .gatt import BluezGattService, BluezGattCharacteristic, _SERVICE_INTERFACE, _CHARACTERISTIC_INTERFACE
+from .adapter import _call
+from .gatt import BluezGattService, _SERVICE_INTERFACE
+from .gatt import _adapter_id, _device_address
 
 
 _INTERFACE = 'org.bluez.Device1'
@@ -48,9 +52,12 @@ class BluezDevice(Device):
         """
         self._device = dbus.Interface(dbus_obj, _INTERFACE)
         self._props = dbus.Interface(dbus_obj, 'org.freedesktop.DBus.Properties')
+        self._address = _device_address(dbus_obj.object_path)
+        self._adapter_id = _adapter_id(dbus_obj.object_path)
         self._connected = threading.Event()
         self._disconnected = threading.Event()
-        self._props.connect_to_signal('PropertiesChanged', self._prop_changed)
+        self._props.connect_to_signal('PropertiesChanged',
+                                      timed(self._prop_changed, 'device.properties_changed'))
 
     def _prop_changed(self, iface, changed_props, invalidated_props):
         # Handle property changes for the device.  Note this call happens in
@@ -64,60 +71,103 @@ class BluezDevice(Device):
         # If disconnected then fire the disconnected event.
         if 'Connected' in changed_props and changed_props['Connected'] == 0:
             self._disconnected.set()
+            self._fire_disconnected()
 
     def connect(self, timeout_sec=TIMEOUT_SEC):
         """Connect to the device.  If not connected within the specified timeout
         then an exception is thrown.
         """
-        self._connected.clear()
-        self._device.Connect()
-        if not self._connected.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting to connect to device!')
+        with tracing.span('device.connect', self._address), \
+             metrics.operation('connect', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            message = 'Exceeded timeout waiting to connect to device!'
+            self._connected.clear()
+            # Disconnecting aborts a connection that's still being made.
+            with deadline.on_cancel(self._abort_connect):
+                _call(self._device.Connect, deadline, message)
+                deadline.wait(self._connected, message)
 
     def disconnect(self, timeout_sec=TIMEOUT_SEC):
         """Disconnect from the device.  If not disconnected within the specified
         timeout then an exception is thrown.
         """
-        self._disconnected.clear()
-        self._device.Disconnect()
-        if not self._disconnected.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting to disconnect from device!')
+        with tracing.span('device.disconnect', self._address), \
+             metrics.operation('disconnect', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            message = 'Exceeded timeout waiting to disconnect from device!'
+            self._disconnected.clear()
+            _call(self._device.Disconnect, deadline, message)
+            deadline.wait(self._disconnected, message)
+
+    def _abort_connect(self):
+        # Called from the thread that cancelled a connect, don't wait for the
+        # reply.
+        self._device.Disconnect(reply_handler=lambda: None, error_handler=lambda ex: None)
 
     def list_services(self):
         """Return a list of GattService objects that have been discovered for
         this device.
         """
-        return map(BluezGattService,
-                   get_provider()._get_objects(_SERVICE_INTERFACE,
-                                               self._device.object_path))
+        return [BluezGattService(x) for x in
+                get_provider()._get_objects(_SERVICE_INTERFACE,
+                                            self._device.object_path)]
+
+    def gatt_snapshot(self):
+        """Return an immutable GattSnapshot of the services, characteristics,
+        and descriptors discovered for this device, from one GetManagedObjects
+        call.
+        """
+        path = str(self._device.object_path)
+        return from_bluez_objects(path, get_provider()._bluez.GetManagedObjects())
 
     def discover(self, service_uuids, char_uuids, timeout_sec=TIMEOUT_SEC):
         """Wait up to timeout_sec for the specified services and characteristics
-        to be discovered on the device.  If the timeout is exceeded without
-        discovering the services and characteristics then an exception is thrown.
+        to be discovered on the device, empty lists wait for every service.
+        Returns True if they were discovered or False if the timeout is
+        exceeded first.
         """
-        # Turn expected values into a counter of each UUID for fast comparison.
+        with tracing.span('device.discover', self._address,
+                          services=len(service_uuids), characteristics=len(char_uuids)) as span, \
+             metrics.operation('discover', self._adapter_id, self._address) as operation:
+            found = self._discover(service_uuids, char_uuids, timeout_sec)
+            span.set('found', found)
+            if not found:
+                operation.fail()
+            return found
+
+    def _discover(self, service_uuids, char_uuids, timeout_sec):
+        # Bluez always resolves the whole GATT table itself, so return as soon
+        # as just the expected UUIDs show up instead of waiting for it to
+        # finish.  Asking for nothing in particular waits for everything, until
+        # bluez says the services are resolved.  Each check reads the UUIDs from
+        # one GetManagedObjects call.
         expected_services = set(service_uuids)
         expected_chars = set(char_uuids)
-        # Loop trying to find the expected services for the device.
-        start = time.time()
+        full = len(expected_services) == 0 and len(expected_chars) == 0
+        provider = get_provider()
+        deadline = as_deadline(timeout_sec)
         while True:
-            # Find actual services discovered for the device.
-            actual_services = set(self.advertised)
-            # Find actual characteristics discovered for the device.
-            chars = map(BluezGattCharacteristic,
-                        get_provider()._get_objects(_CHARACTERISTIC_INTERFACE,
-                                                    self._device.object_path))
-            actual_chars = set(map(lambda x: x.uuid, chars))
-            # Compare actual discovered UUIDs with expected and return true if at
-            # least the expected UUIDs are available.
-            if actual_services >= expected_services and actual_chars >= expected_chars:
+            deadline.check_cancelled()
+            generation = provider._gatt_generation
+            actual_services, actual_chars, resolved = provider._gatt_uuids(self._device.object_path)
+            if full and resolved:
+                return True
+            if not full and actual_services >= expected_services and actual_chars >= expected_chars:
                 # Found at least the expected services!
                 return True
-            # Couldn't find the devices so check if timeout has expired and try again.
-            if time.time()-start >= timeout_sec:
+            # Couldn't find them so check if timeout has expired, then wait for
+            # bluez to add more GATT objects and try again.
+            if deadline.expired:
                 return False
-            time.sleep(1)
+            provider._wait_gatt_update(generation, deadline)
+
+    def operation_stats(self):
+        """Return a dict of statistics for the queue that schedules GATT
+        operations with this device.
+        """
+        return get_provider()._operation_queue(self._device.object_path).stats()
 
     @property
     def advertised(self):
@@ -134,7 +184,7 @@ class BluezDevice(Device):
             # a BLE device).
             if ex.get_dbus_name() != 'org.freedesktop.DBus.Error.InvalidArgs':
                 raise ex
-        return [uuid.UUID(str(x)) for x in uuids]
+        return [intern_uuid(x) for x in uuids]
 
     @property
     def id(self):
@@ -160,6 +210,11 @@ class BluezDevice(Device):
         """Return the RSSI signal strength in decibels."""
         return self._props.Get(_INTERFACE, 'RSSI')
 
+    @property
+    def address_type(self):
+        """Return the type of the device's address, 'public' or 'random'."""
+        return str(self._props.Get(_INTERFACE, 'AddressType'))
+
     @property
     def _adapter(self):
         """Return the DBus path to the adapter that owns this device."""
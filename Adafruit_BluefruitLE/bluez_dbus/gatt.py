@@ -21,19 +21,74 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from past.builtins import map
-import uuid
+import logging
 
 import dbus
 
+from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
 from ..interfaces import GattService, GattCharacteristic, GattDescriptor
+from ..interfaces import WRITE_WITH_RESPONSE, WRITE_WITHOUT_RESPONSE
+from ..operation_queue import PRIORITY_CONTROL, PRIORITY_NORMAL
 from ..platform import get_provider
+from ..uuids import intern_uuid
+from .. import metrics, tracing
+from ..loop_monitor import timed
 
+from .adapter import _call
+from .channel import AcquiredChannel
+
+
+logger = logging.getLogger(__name__)
 
 _SERVICE_INTERFACE        = 'org.bluez.GattService1'
 _CHARACTERISTIC_INTERFACE = 'org.bluez.GattCharacteristic1'
 _DESCRIPTOR_INTERFACE     = 'org.bluez.GattDescriptor1'
 
+# Map of write types to the value of the type option for bluez's WriteValue.
+_WRITE_TYPES = {
+    WRITE_WITH_RESPONSE:    'request',
+    WRITE_WITHOUT_RESPONSE: 'command'
+}
+
+
+def _device_address(path):
+    """Return the address of the device that owns the bluez object at the
+    specified DBus path (like /org/bluez/hci0/dev_00_11_22_33_44_55/service0010),
+    or None if the path isn't under a device.
+    """
+    parts = str(path).split('/')
+    if len(parts) < 5 or not parts[4].startswith('dev_'):
+        return None
+    return parts[4][4:].replace('_', ':')
+
+
+def _adapter_id(path):
+    """Return the id (like hci0) of the adapter that owns the bluez object at
+    the specified DBus path.
+    """
+    parts = str(path).split('/')
+    return parts[3] if len(parts) > 3 else None
+
+
+def _to_byte_array(value):
+    """Convert a value to write into a dbus.ByteArray so it's marshalled as
+    an array of bytes in one step instead of boxing each byte as a dbus.Byte.
+    Accepts bytes, bytearray, memoryview, or a string of bytes.  Any other value
+    (like a list of ints) is returned unchanged.
+    """
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    elif isinstance(value, bytearray):
+        value = bytes(value)
+    elif isinstance(value, str) and not isinstance(value, bytes):
+        # Python 3 string of byte values, like the ones passed to on_change
+        # callbacks.
+        value = value.encode('latin-1')
+    elif not isinstance(value, bytes):
+        return value
+    return dbus.ByteArray(value)
+
 
 class BluezGattService(GattService):
     """Bluez GATT service object."""
@@ -47,15 +102,15 @@ class BluezGattService(GattService):
     @property
     def uuid(self):
         """Return the UUID of this GATT service."""
-        return uuid.UUID(str(self._props.Get(_SERVICE_INTERFACE, 'UUID')))
+        return intern_uuid(self._props.Get(_SERVICE_INTERFACE, 'UUID'))
 
     def list_characteristics(self):
         """Return list of GATT characteristics that have been discovered for this
         service.
         """
         paths = self._props.Get(_SERVICE_INTERFACE, 'Characteristics')
-        return map(BluezGattCharacteristic,
-                   get_provider()._get_objects_by_path(paths))
+        return [BluezGattCharacteristic(x) for x in
+                get_provider()._get_objects_by_path(paths)]
 
 
 class BluezGattCharacteristic(GattCharacteristic):
@@ -67,26 +122,136 @@ class BluezGattCharacteristic(GattCharacteristic):
         """
         self._characteristic = dbus.Interface(dbus_obj, _CHARACTERISTIC_INTERFACE)
         self._props = dbus.Interface(dbus_obj, 'org.freedesktop.DBus.Properties')
+        self._queue = get_provider()._operation_queue(dbus_obj.object_path)
+        self._address = _device_address(dbus_obj.object_path)
+        self._adapter_id = _adapter_id(dbus_obj.object_path)
+        # State for the acquired file descriptor data path and the signal match
+        # used when notifications come through DBus property changes instead.
+        self._notify_channel = None
+        self._notify_watch = None
+        self._notify_match = None
+        self._write_channel = None
+        self._write_acquire_failed = False
 
     @property
     def uuid(self):
         """Return the UUID of this GATT characteristic."""
-        return uuid.UUID(str(self._props.Get(_CHARACTERISTIC_INTERFACE, 'UUID')))
+        return intern_uuid(self._props.Get(_CHARACTERISTIC_INTERFACE, 'UUID'))
+
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this characteristic.  The read is scheduled on the
+        device's operation queue with the specified priority, and waits up to
+        timeout_sec for its turn and the value.
+        """
+        with tracing.span('gatt.read', self._address,
+                          path=self._characteristic.object_path), \
+             metrics.operation('read', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            value = self._queue.run(lambda: _call(self._characteristic.ReadValue, deadline,
+                                                  'Exceeded timeout waiting to read characteristic!'),
+                                    priority, self._characteristic.object_path, deadline)
+        metrics.received(self._adapter_id, self._address, len(value))
+        return value
+
+    def write_value(self, value, write_type=None, timeout_sec=TIMEOUT_SEC,
+                    offset=0, priority=PRIORITY_NORMAL):
+        """Write the specified value to this characteristic.  Value can be
+        bytes, a bytearray, or a memoryview and is marshalled without copying
+        each byte into its own DBus object.  Write_type can be
+        WRITE_WITH_RESPONSE or WRITE_WITHOUT_RESPONSE (or a bluez type name like
+        'reliable'), and offset is the offset to write the value at.  When
+        neither is specified bluez picks the write type from the
+        characteristic's flags.  The write is scheduled on the device's
+        operation queue with the specified priority, use PRIORITY_CONTROL to
+        jump ahead of waiting reads, and waits up to timeout_sec.
+
+        Writes without response are sent through a socket acquired with bluez's
+        AcquireWrite when it is supported, which skips DBus entirely and splits
+        values longer than the MTU into multiple writes.
+        """
+        with tracing.span('gatt.write', self._address,
+                          path=self._characteristic.object_path, size=len(value)), \
+             metrics.operation('write', self._adapter_id, self._address, len(value)):
+            self._write_value(value, write_type, offset, priority, as_deadline(timeout_sec))
+
+    def _write_value(self, value, write_type, offset, priority, deadline):
+        # Write through an acquired socket when possible, otherwise with
+        # WriteValue.  Both take the value converted to bytes.
+        data = _to_byte_array(value)
+        if write_type == WRITE_WITHOUT_RESPONSE and not offset and isinstance(data, bytes):
+            if self._write_acquired(priority, deadline):
+                self._queue.run(lambda: self._write_channel.write(data, deadline.remaining(TIMEOUT_SEC)),
+                                priority, self._characteristic.object_path, deadline)
+                return
+        options = {}
+        if write_type is not None:
+            options['type'] = _WRITE_TYPES.get(write_type, write_type)
+        if offset:
+            options['offset'] = dbus.UInt16(offset)
+        if len(options) > 0:
+            # Only send the options dict when it's needed, older bluez versions
+            # don't accept it.
+            args = (data, dbus.Dictionary(options, signature='sv'))
+        else:
+            args = (data,)
+        self._queue.run(lambda: _call(self._characteristic.WriteValue, deadline,
+                                      'Exceeded timeout waiting to write characteristic!', *args),
+                        priority, self._characteristic.object_path, deadline)
 
-    def read_value(self):
-        """Read the value of this characteristic."""
-        return self._characteristic.ReadValue()
+    def stream_write_type(self, timeout_sec=TIMEOUT_SEC):
+        """Return WRITE_WITHOUT_RESPONSE if bluez hands out an acquired write
+        socket for this characteristic (acquiring it the first time, waiting up
+        to timeout_sec), otherwise None so bluez picks the write type.
+        """
+        if self._write_acquired(PRIORITY_NORMAL, as_deadline(timeout_sec)):
+            return WRITE_WITHOUT_RESPONSE
+        return None
 
-    def write_value(self, value):
-        """Write the specified value to this characteristic."""
-        self._characteristic.WriteValue(value)
+    def _write_acquired(self, priority, deadline):
+        # Make sure there's an acquired write channel, returns False if bluez
+        # doesn't support acquiring one for this characteristic.
+        if self._write_channel is not None and not self._write_channel.closed:
+            return True
+        if self._write_acquire_failed:
+            return False
+        try:
+            fd, mtu = self._queue.run(lambda: _call(self._characteristic.AcquireWrite, deadline,
+                                                    'Exceeded timeout waiting to acquire write!',
+                                                    dbus.Dictionary({}, signature='sv')),
+                                      priority, self._characteristic.object_path, deadline)
+        except dbus.exceptions.DBusException as ex:
+            # Not supported by this bluez version or characteristic, fall back
+            # to WriteValue from now on.
+            logger.debug('AcquireWrite not available: {0}'.format(ex))
+            self._write_acquire_failed = True
+            return False
+        self._write_channel = AcquiredChannel(fd.take(), mtu)
+        return True
 
-    def start_notify(self, on_change):
+    def start_notify(self, on_change, acquire=True, timeout_sec=TIMEOUT_SEC):
         """Enable notification of changes for this characteristic on the
         specified on_change callback.  on_change should be a function that takes
-        one parameter which is the value (as a string of bytes) of the changed
+        one parameter which is the value (as bytes) of the changed
         characteristic value.
+
+        When acquire is True (the default) and bluez supports AcquireNotify the
+        notifications are read from an acquired socket on the main loop instead
+        of through DBus property change signals.  Otherwise StartNotify is used.
+        Waits up to timeout_sec for notifications to be enabled.
         """
+        on_change = metrics.instrument_callback(on_change, self._adapter_id, self._address)
+        on_change = tracing.first_call(on_change, 'gatt.first_notification',
+                                       self._address, path=self._characteristic.object_path)
+        with tracing.span('gatt.subscribe', self._address,
+                          path=self._characteristic.object_path) as span:
+            deadline = as_deadline(timeout_sec)
+            if acquire and self._acquire_notify(on_change, deadline):
+                span.set('acquired', True)
+                return
+            self._start_notify(on_change, deadline)
+
+    def _start_notify(self, on_change, deadline):
+        # Subscribe to notifications through DBus property change signals.
         # Setup a closure to be the first step in handling the on change callback.
         # This closure will verify the characteristic is changed and pull out the
         # new value to pass to the user's on change callback.
@@ -97,24 +262,82 @@ class BluezGattCharacteristic(GattCharacteristic):
                 return
             if 'Value' not in changed_props:
                 return
-            # Send the new value to the on_change callback.
-            on_change(''.join(map(chr, changed_props['Value'])))
+            # Send the new value to the on_change callback as bytes, like
+            # notifications read from an acquired socket.
+            on_change(bytes(bytearray(changed_props['Value'])))
         # Hook up the property changed signal to call the closure above.
-        self._props.connect_to_signal('PropertiesChanged', characteristic_changed)
+        self._notify_match = self._props.connect_to_signal('PropertiesChanged',
+            timed(characteristic_changed, 'characteristic.properties_changed'))
         # Enable notifications for changes on the characteristic.
-        self._characteristic.StartNotify()
+        self._queue.run(lambda: _call(self._characteristic.StartNotify, deadline,
+                                      'Exceeded timeout waiting to start notifications!'),
+                        PRIORITY_CONTROL, self._characteristic.object_path, deadline)
 
-    def stop_notify(self):
-        """Disable notification of changes for this characteristic."""
-        self._characteristic.StopNotify()
+    def _acquire_notify(self, on_change, deadline):
+        # Try to acquire a notification socket and watch it on the main loop.
+        # Returns False if bluez doesn't support it for this characteristic.
+        try:
+            fd, mtu = self._queue.run(lambda: _call(self._characteristic.AcquireNotify, deadline,
+                                                    'Exceeded timeout waiting to acquire notifications!',
+                                                    dbus.Dictionary({}, signature='sv')),
+                                      PRIORITY_CONTROL,
+                                      self._characteristic.object_path, deadline)
+        except dbus.exceptions.DBusException as ex:
+            logger.debug('AcquireNotify not available: {0}'.format(ex))
+            return False
+        channel = AcquiredChannel(fd.take(), mtu)
+        self._notify_channel = channel
+        # Called by the main loop when the socket is readable or hung up.
+        # Returns False to remove the watch once the channel is closed.
+        def channel_ready():
+            return channel.read_available(on_change)
+        self._notify_watch = get_provider()._add_fd_watch(channel.fileno(),
+                                                          channel_ready)
+        return True
+
+    def stop_notify(self, timeout_sec=TIMEOUT_SEC):
+        """Disable notification of changes for this characteristic, waiting up
+        to timeout_sec.
+        """
+        with tracing.span('gatt.unsubscribe', self._address,
+                          path=self._characteristic.object_path):
+            self._stop_notify(as_deadline(timeout_sec))
+
+    def release_notify(self):
+        """Forget the notification callback of this characteristic without
+        calling bluez, for when the link was lost.  Bluez keeps the object path
+        across reconnects, so the property change signal receiver of this
+        object would otherwise keep delivering notifications enabled later on a
+        new characteristic object.
+        """
+        if self._notify_channel is not None:
+            # The watch already removed itself if bluez hung up the socket.
+            if not self._notify_channel.closed:
+                get_provider()._remove_watch(self._notify_watch)
+            self._notify_channel.close()
+            self._notify_channel = None
+            self._notify_watch = None
+        if self._notify_match is not None:
+            self._notify_match.remove()
+            self._notify_match = None
+
+    def _stop_notify(self, deadline):
+        if self._notify_channel is not None:
+            # Closing an acquired socket is what releases it in bluez.
+            self.release_notify()
+            return
+        self.release_notify()
+        self._queue.run(lambda: _call(self._characteristic.StopNotify, deadline,
+                                      'Exceeded timeout waiting to stop notifications!'),
+                        PRIORITY_CONTROL, self._characteristic.object_path, deadline)
 
     def list_descriptors(self):
         """Return list of GATT descriptors that have been discovered for this
         characteristic.
         """
         paths = self._props.Get(_CHARACTERISTIC_INTERFACE, 'Descriptors')
-        return map(BluezGattDescriptor,
-                   get_provider()._get_objects_by_path(paths))
+        return [BluezGattDescriptor(x) for x in
+                get_provider()._get_objects_by_path(paths)]
 
 
 class BluezGattDescriptor(GattDescriptor):
@@ -126,12 +349,26 @@ class BluezGattDescriptor(GattDescriptor):
         """
         self._descriptor = dbus.Interface(dbus_obj, _DESCRIPTOR_INTERFACE)
         self._props = dbus.Interface(dbus_obj, 'org.freedesktop.DBus.Properties')
+        self._queue = get_provider()._operation_queue(dbus_obj.object_path)
+        self._address = _device_address(dbus_obj.object_path)
+        self._adapter_id = _adapter_id(dbus_obj.object_path)
 
     @property
     def uuid(self):
         """Return the UUID of this GATT descriptor."""
-        return uuid.UUID(str(self._props.Get(_DESCRIPTOR_INTERFACE, 'UUID')))
+        return intern_uuid(self._props.Get(_DESCRIPTOR_INTERFACE, 'UUID'))
 
-    def read_value(self):
-        """Read the value of this descriptor."""
-        return self._descriptor.ReadValue()
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this descriptor.  The read is scheduled on the
+        device's operation queue with the specified priority, and waits up to
+        timeout_sec for its turn and the value.
+        """
+        with tracing.span('gatt.read_descriptor', self._address,
+                          path=self._descriptor.object_path), \
+             metrics.operation('read', self._adapter_id, self._address):
+            deadline = as_deadline(timeout_sec)
+            value = self._queue.run(lambda: _call(self._descriptor.ReadValue, deadline,
+                                                  'Exceeded timeout waiting to read descriptor!'),
+                                    priority, self._descriptor.object_path, deadline)
+        metrics.received(self._adapter_id, self._address, len(value))
+        return value
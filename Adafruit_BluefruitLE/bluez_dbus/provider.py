@@ -21,22 +21,61 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from past.builtins import map
+import re
 import sys
 import threading
 import time
 
 import dbus
 import dbus.mainloop.glib
-from future.utils import raise_
-from future.utils import iteritems
-from gi.repository import GObject
 
+from ..advertisements import AdvertisementStore, update_from_bluez
+from ..cache_maintenance import choose_evictions
+from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
 from ..interfaces import Provider
+from ..loop_monitor import timed
+from ..operation_queue import OperationQueue
+from ..uuids import intern_uuid
+from ..value_cache import services_changed
+from .. import metrics, tracing
 
-from .adapter import BluezAdapter
+from .adapter import BluezAdapter, _call
 from .adapter import _INTERFACE as _ADAPTER_INTERFACE
 from .device import BluezDevice
+from .device import _INTERFACE as _DEVICE_INTERFACE
+from .gatt import _CHARACTERISTIC_INTERFACE, _SERVICE_INTERFACE, _adapter_id, _device_address
+
+
+# Pattern to pull the device path out of the path of any object underneath it,
+# like /org/bluez/hci0/dev_00_11_22_33_44_55/service000a/char000b.
+_DEVICE_PATH_RE = re.compile(r'^(/org/bluez/[^/]+/dev_[0-9A-Fa-f_]+)')
+
+# Maximum number of GATT operations to have outstanding with a device at once.
+# Bluez queues requests to different characteristics itself, so a few can be
+# pipelined (operations on the same characteristic are never overlapped).
+_MAX_IN_FLIGHT = 4
+
+# Number of RemoveDevice calls to have outstanding at once when evicting
+# devices from bluez's cache.
+_REMOVE_BATCH = 32
+
+# Longest a discovery waits for a GATT object to be added before checking the
+# object tree again, in case a signal was missed.
+_DISCOVERY_POLL_SEC = 1.0
+
+
+def _is_transient(ex):
+    """Return True if the exception is a bluez error that is worth retrying,
+    like another operation being in progress on the characteristic.
+    """
+    if not isinstance(ex, dbus.exceptions.DBusException):
+        return False
+    name = ex.get_dbus_name()
+    if name == 'org.bluez.Error.InProgress':
+        return True
+    # Some bluez versions report in progress errors as a generic failure.
+    return name == 'org.bluez.Error.Failed' and 'progress' in str(ex).lower()
 
 
 class BluezProvider(Provider):
@@ -52,17 +91,42 @@ class BluezProvider(Provider):
         self._mainloop = None
         self._gobject_mainloop = None
         self._user_thread = None
+        self._mainloop_running = None
         self._return_code = 0
         self._exception = None
+        # State for a main loop running on a background thread, shared by any
+        # number of clients that called start().
+        self._loop_lock = threading.Lock()
+        self._loop_thread = None
+        self._loop_clients = 0
+        # Keep a GATT operation queue for each device, keyed by its DBus path.
+        self._queues = {}
+        self._queues_lock = threading.Lock()
+        # DBus path of the only adapter to use, set by bind_adapter.
+        self._adapter_path = None
+        # What each device advertised and when it was last seen.
+        self._advertisements = AdvertisementStore()
+        # Counter of GATT objects added and services resolved, notified so
+        # discovery checks again as soon as something new shows up.
+        self._gatt_changed = threading.Condition()
+        self._gatt_generation = 0
 
     def initialize(self):
         """Initialize bluez DBus communication.  Must be called before any other
-        calls are made!
+        calls are made!  Calling it again after it succeeded does nothing, so
+        independent clients in the same process can all call it.
         """
+        if self._bus is not None:
+            return
         # Ensure GLib's threading is initialized to support python threads, and
         # make a default mainloop that all DBus objects will inherit.  These
-        # commands MUST execute before any other DBus commands!
-        GObject.threads_init()
+        # commands MUST execute before any other DBus commands!  PyGObject 3.11
+        # and later initialize threading themselves, so in that case avoid the
+        # cost of importing GObject until the main loop is needed.
+        import gi
+        if gi.version_info < (3, 11):
+            from gi.repository import GObject
+            GObject.threads_init()
         dbus.mainloop.glib.threads_init()
         # Set the default main loop, this also MUST happen before other DBus calls.
         self._mainloop = dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
@@ -70,8 +134,25 @@ class BluezProvider(Provider):
         self._bus = dbus.SystemBus()
         self._bluez = dbus.Interface(self._bus.get_object('org.bluez', '/'),
                                      'org.freedesktop.DBus.ObjectManager')
+        # Feed the advertisement store from new devices and changes to the
+        # RSSI, name, UUIDs, and data of devices while scanning.
+        self._bus.add_signal_receiver(timed(self._interfaces_added, 'provider.interfaces_added'),
+                                      'InterfacesAdded',
+                                      'org.freedesktop.DBus.ObjectManager', 'org.bluez')
+        self._bus.add_signal_receiver(timed(self._properties_changed, 'provider.properties_changed'),
+                                      'PropertiesChanged',
+                                      'org.freedesktop.DBus.Properties', 'org.bluez',
+                                      path_keyword='path')
 
-    def run_mainloop_with(self, target):
+    def bind_adapter(self, adapter_id):
+        """Limit the provider to the adapter with the specified id (like hci0):
+        list_adapters only returns that adapter and list_devices only returns
+        devices it has seen.  Used by processes that each own one adapter.  An
+        adapter_id of None uses every adapter again.
+        """
+        self._adapter_path = '/org/bluez/' + adapter_id if adapter_id is not None else None
+
+    def run_mainloop_with(self, target, on_mainloop=False):
         """Start the OS's main loop to process asyncronous BLE events and then
         run the specified target function in a background thread.  Target
         function should be a function that takes no parameters and optionally
@@ -79,6 +160,14 @@ class BluezProvider(Provider):
         executing or returns with value then the main loop will be stopped and
         the program will exit with the returned code.
 
+        If on_mainloop is True the target is instead called directly from the
+        main loop as soon as it starts, without a background thread.  In this
+        mode the target must not block (so it can't call functions that wait
+        for BLE events, like connect) and is meant for programs driven by
+        callbacks: if it returns None the main loop keeps running to process
+        events until interrupted, otherwise the program exits with the returned
+        code.
+
         Note that an OS main loop is required to process asyncronous BLE events
         and this function is provided as a convenience for writing simple tools
         and scripts that don't need to be full-blown GUI applications.  If you
@@ -86,12 +175,21 @@ class BluezProvider(Provider):
         on Linux, or a Cocoa main loop on OSX) then you don't need to call this
         function.
         """
-        # Spin up a background thread to run the target code.
-        self._user_thread = threading.Thread(target=self._user_thread_main, args=(target,))
-        self._user_thread.daemon = True  # Don't let the user thread block exit.
-        self._user_thread.start()
-        # Spin up a GLib main loop in the main thread to process async BLE events.
+        from gi.repository import GObject
         self._gobject_mainloop = GObject.MainLoop()
+        if on_mainloop:
+            # Call the target from the main loop once it's running.
+            GObject.idle_add(self._mainloop_target, target)
+        else:
+            # Spin up a background thread to run the target code.  The thread
+            # waits until the main loop signals it's running from an idle
+            # callback, which is the first thing the main loop processes.
+            self._mainloop_running = threading.Event()
+            GObject.idle_add(self._signal_mainloop_running)
+            self._user_thread = threading.Thread(target=self._user_thread_main, args=(target,))
+            self._user_thread.daemon = True  # Don't let the user thread block exit.
+            self._user_thread.start()
+        # Run the GLib main loop in the main thread to process async BLE events.
         try:
             self._gobject_mainloop.run()  # Doesn't return until the mainloop ends.
         except KeyboardInterrupt:
@@ -102,20 +200,88 @@ class BluezProvider(Provider):
         if self._exception is not None:
             # Rethrow exception with its original stack trace following advice from:
             # http://nedbatchelder.com/blog/200711/rethrowing_exceptions_in_python.html
+            from future.utils import raise_
             raise_(self._exception[1], None, self._exception[2])
         else:
             sys.exit(self._return_code)
 
+    def _signal_mainloop_running(self):
+        """Idle callback that tells the user thread the main loop is running."""
+        self._mainloop_running.set()
+        return False  # Only call once.
+
+    def _mainloop_target(self, target):
+        """Idle callback that runs the user's target on the main loop."""
+        try:
+            return_code = target()
+            if return_code is not None:
+                self._return_code = return_code
+                self._gobject_mainloop.quit()
+        except Exception as ex:
+            # Something went wrong.  Stop the main loop and raise the exception.
+            self._exception = sys.exc_info()
+            self._gobject_mainloop.quit()
+        return False  # Only call once.
+
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Start running the GLib main loop on a background thread that is
+        managed by the provider, as an alternative to run_mainloop_with for
+        applications that need to keep their main thread (like servers with
+        their own event loop).  Can be called by several independent clients in
+        the same process, the main loop keeps running until each call to start
+        has been matched by a call to stop.  Waits up to timeout_sec for the
+        main loop to start processing events.
+        """
+        from gi.repository import GObject
+        with self._loop_lock:
+            self._loop_clients += 1
+            if self._loop_thread is not None:
+                # Main loop is already running for another client.
+                return
+            self._gobject_mainloop = GObject.MainLoop()
+            # Have the main loop tell us when it's processing events.
+            running = threading.Event()
+            def loop_running():
+                running.set()
+                return False  # Only call once.
+            GObject.idle_add(loop_running)
+            self._loop_thread = threading.Thread(target=self._gobject_mainloop.run,
+                                                 name='BluezProvider main loop')
+            self._loop_thread.daemon = True  # Don't let the main loop block exit.
+            self._loop_thread.start()
+            if not running.wait(timeout_sec):
+                self._loop_clients -= 1
+                self._stop_loop_thread(timeout_sec)
+                raise RuntimeError('Exceeded timeout waiting for main loop to start!')
+
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Release a main loop started with start.  When the last client
+        releases it the main loop is stopped and its thread is joined before
+        returning, waiting up to timeout_sec for it to finish.
+        """
+        with self._loop_lock:
+            if self._loop_clients == 0:
+                return
+            self._loop_clients -= 1
+            if self._loop_clients == 0:
+                self._stop_loop_thread(timeout_sec)
+
+    def _stop_loop_thread(self, timeout_sec):
+        # Quit the background main loop and wait for its thread to end.  Must be
+        # called with the loop lock held.
+        thread = self._loop_thread
+        self._loop_thread = None
+        self._gobject_mainloop.quit()
+        thread.join(timeout_sec)
+        if thread.is_alive():
+            raise RuntimeError('Exceeded timeout waiting for main loop to stop!')
+
     def _user_thread_main(self, target):
         """Main entry point for the thread that will run user's code."""
         try:
             # Wait for GLib main loop to start running before starting user code.
-            while True:
-                if self._gobject_mainloop is not None and self._gobject_mainloop.is_running():
-                    # Main loop is running, we should be ready to make bluez DBus calls.
-                    break
-                # Main loop isn't running yet, give time back to other threads.
-                time.sleep(0)
+            # Once it's running we're ready to make bluez DBus calls.
+            self._mainloop_running.wait()
             # Run user's code.
             self._return_code = target()
             # Assume good result (0 return code) if none is returned.
@@ -133,41 +299,288 @@ class BluezProvider(Provider):
         """Clear any internally cached BLE device data.  Necessary in some cases
         to prevent issues with stale device data getting cached by the OS.
         """
-        # Go through and remove any device that isn't currently connected.
-        for device in self.list_devices():
-            # Skip any connected device.
-            if device.is_connected:
+        # Remove every device that isn't currently connected.
+        self._remove_devices([(props['Adapter'], path) for path, props in self._device_properties()
+                              if not props.get('Connected', False)])
+
+    def _purge_cache(self, max_age_sec, max_devices, timeout_sec):
+        """Evict devices that aren't connected, paired, or trusted from bluez's
+        cache by when they last advertised.  Returns a tuple of the number of
+        devices evicted and remaining.
+        """
+        devices = self._device_properties()
+        # Advertisement records expire long before max_age_sec, so use the
+        # last seen times the store keeps for every cached device.
+        seen = self._advertisements.last_seen_times([str(props.get('Address', '')) for path, props in devices])
+        candidates = []
+        for path, props in devices:
+            if props.get('Connected', False) or props.get('Paired', False) or \
+               props.get('Trusted', False):
                 continue
-            # Remove this device.  First get the adapter associated with the device.
-            adapter = dbus.Interface(self._bus.get_object('org.bluez', device._adapter),
-                                     _ADAPTER_INTERFACE)
-            # Now call RemoveDevice on the adapter to remove the device from
-            # bluez's DBus hierarchy.
-            adapter.RemoveDevice(device._device.object_path)
-
-    def disconnect_devices(self, service_uuids=[]):
+            candidates.append((seen[str(props.get('Address', ''))], (props['Adapter'], path)))
+        evict = choose_evictions(candidates, len(devices), max_age_sec, max_devices, time.time())
+        self._remove_devices(evict, timeout_sec)
+        for adapter, path in evict:
+            self._advertisements.remove(_device_address(path))
+        return len(evict), len(devices) - len(evict)
+
+    def _device_properties(self):
+        """Return a list of (path, properties) tuples for every device (of the
+        bound adapter), from one GetManagedObjects call.
+        """
+        parent_path = (self._adapter_path + '/' if self._adapter_path is not None else '/org/bluez').lower()
+        return [(path, interfaces[_DEVICE_INTERFACE])
+                for path, interfaces in self._bluez.GetManagedObjects().items()
+                if _DEVICE_INTERFACE in interfaces and path.lower().startswith(parent_path)]
+
+    def _replies_delivered(self):
+        """Return True if replies to asynchronous DBus calls are delivered
+        while the calling thread waits, that is a main loop is running on
+        another thread.  Otherwise (on the main loop's own thread or before it
+        runs) only blocking calls work.
+        """
+        loop = self._gobject_mainloop
+        if loop is None or not loop.is_running():
+            return False
+        from gi.repository import GLib
+        return not GLib.main_context_default().is_owner()
+
+    def _remove_devices(self, removals, timeout_sec=TIMEOUT_SEC):
+        """Remove a list of (adapter path, device path) tuples from bluez's
+        cache.  RemoveDevice calls are sent _REMOVE_BATCH at a time without
+        waiting for each reply when the main loop is running on another thread,
+        and one at a time otherwise.  Devices already gone are ignored, any
+        other error is raised after every call finished.
+        """
+        deadline = as_deadline(timeout_sec)
+        blocking = not self._replies_delivered()
+        adapters = {}
+        errors = []
+        for i in range(0, len(removals), _REMOVE_BATCH):
+            batch = removals[i:i+_REMOVE_BATCH]
+            lock = threading.Lock()
+            pending = [len(batch)]
+            finished = threading.Event()
+            def reply(*args):
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        finished.set()
+            def error(ex):
+                if ex.get_dbus_name() != 'org.bluez.Error.DoesNotExist':
+                    errors.append(ex)
+                reply()
+            for adapter_path, path in batch:
+                adapter = adapters.get(adapter_path)
+                if adapter is None:
+                    adapter = dbus.Interface(self._bus.get_object('org.bluez', adapter_path),
+                                             _ADAPTER_INTERFACE)
+                    adapters[adapter_path] = adapter
+                if blocking:
+                    try:
+                        _call(adapter.RemoveDevice, deadline,
+                              'Exceeded timeout waiting to remove devices!', path)
+                    except dbus.exceptions.DBusException as ex:
+                        error(ex)
+                    else:
+                        reply()
+                else:
+                    adapter.RemoveDevice(path, reply_handler=reply, error_handler=error)
+            deadline.wait(finished, 'Exceeded timeout waiting to remove devices!')
+        self._drop_operation_queues([path for adapter_path, path in removals])
+        if errors:
+            raise errors[0]
+
+    def disconnect_devices(self, service_uuids=[], timeout_sec=TIMEOUT_SEC):
         """Disconnect any connected devices that have the specified list of
         service UUIDs.  The default is an empty list which means all devices
-        are disconnected.
+        are disconnected.  Every device is disconnected at once and they share
+        the timeout.  Returns a dict of each matching device's id to None if it
+        disconnected, or the exception it failed with.
+        """
+        with tracing.span('provider.disconnect_devices'):
+            devices = self._connected_devices(set(service_uuids))
+            return self._disconnect_all(devices, timeout_sec)
+
+    def _connected_devices(self, service_uuids):
+        """Return a list of (path, address) tuples for the connected devices
+        that have at least the specified set of service UUIDs, from one
+        GetManagedObjects call.  A device's UUIDs are its discovered services
+        and the UUIDs bluez cached for it from advertisements.
         """
-        service_uuids = set(service_uuids)
-        for device in self.list_devices():
-            # Skip devices that aren't connected.
-            if not device.is_connected:
+        objects = self._bluez.GetManagedObjects()
+        services = {}
+        for path, interfaces in objects.items():
+            if _SERVICE_INTERFACE in interfaces:
+                match = _DEVICE_PATH_RE.match(path)
+                if match is not None:
+                    services.setdefault(match.group(1), set()).add(
+                        intern_uuid(interfaces[_SERVICE_INTERFACE]['UUID']))
+        devices = []
+        for path, interfaces in objects.items():
+            props = interfaces.get(_DEVICE_INTERFACE)
+            if props is None or not props.get('Connected', False):
+                continue
+            if self._adapter_path is not None and props.get('Adapter') != self._adapter_path:
                 continue
-            device_uuids = set(map(lambda x: x.uuid, device.list_services()))
+            device_uuids = services.get(path, set()) | \
+                set([intern_uuid(x) for x in props.get('UUIDs', [])])
             if device_uuids >= service_uuids:
-                # Found a device that has at least the requested services, now
-                # disconnect from it.
-                device.disconnect()
+                devices.append((path, str(props['Address'])))
+        return devices
+
+    def _disconnect_all(self, devices, timeout_sec):
+        """Send Disconnect to a list of (path, address) devices without waiting
+        for each reply, then wait for them all until timeout_sec.  When replies
+        can't be delivered while waiting (see _replies_delivered) the devices
+        are disconnected one at a time instead.  Returns a dict of address to
+        None or the exception the disconnect failed with.
+        """
+        deadline = as_deadline(timeout_sec)
+        blocking = not self._replies_delivered()
+        lock = threading.Lock()
+        results = {}
+        finished = threading.Event()
+        def done(path, address, ex=None):
+            with metrics.operation('disconnect', _adapter_id(path), address) as operation:
+                if ex is not None:
+                    operation.fail()
+            with lock:
+                results[address] = ex
+                if len(results) == len(devices):
+                    finished.set()
+        if len(devices) == 0:
+            return results
+        for path, address in devices:
+            device = dbus.Interface(self._bus.get_object('org.bluez', path), _DEVICE_INTERFACE)
+            if blocking:
+                try:
+                    _call(device.Disconnect, deadline,
+                          'Exceeded timeout waiting to disconnect from device!')
+                except Exception as ex:
+                    done(path, address, ex)
+                else:
+                    done(path, address)
+                continue
+            device.Disconnect(reply_handler=lambda path=path, address=address: done(path, address),
+                              error_handler=lambda ex, path=path, address=address: done(path, address, ex))
+        try:
+            deadline.wait(finished)
+        except DeadlineExceeded:
+            pass
+        with lock:
+            for path, address in devices:
+                if address not in results:
+                    results[address] = RuntimeError('Exceeded timeout waiting to disconnect from device!')
+            return dict(results)
 
     def list_adapters(self):
         """Return a list of BLE adapter objects connected to the system."""
-        return map(BluezAdapter, self._get_objects('org.bluez.Adapter1'))
+        adapters = self._get_objects('org.bluez.Adapter1')
+        if self._adapter_path is not None:
+            adapters = [x for x in adapters if x.object_path == self._adapter_path]
+        return [BluezAdapter(x) for x in adapters]
 
     def list_devices(self):
         """Return a list of BLE devices known to the system."""
-        return map(BluezDevice, self._get_objects('org.bluez.Device1'))
+        if self._adapter_path is not None:
+            return [BluezDevice(x) for x in
+                    self._get_objects('org.bluez.Device1', self._adapter_path + '/')]
+        return [BluezDevice(x) for x in self._get_objects('org.bluez.Device1')]
+
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        if adapter is None:
+            adapter = self.get_default_adapter()
+            if adapter is None:
+                raise RuntimeError('Failed to find a bluetooth adapter!')
+        path = adapter._device_path(address)
+        if not self._device_exists(path):
+            # Have bluez create the device and connect to it, which it can do
+            # without having seen the device advertise.
+            try:
+                path = adapter._connect_device(address, address_type or 'public', deadline)
+            except dbus.exceptions.DBusException as ex:
+                name = ex.get_dbus_name()
+                if name == 'org.freedesktop.DBus.Error.UnknownMethod':
+                    raise RuntimeError('Connecting to a device bluez has not seen requires '
+                                       'ConnectDevice from bluez 5.49 or later run with --experimental!')
+                # A scan might have just found the device.
+                if name != 'org.bluez.Error.AlreadyExists':
+                    raise
+        return BluezDevice(self._bus.get_object('org.bluez', path))
+
+    def _device_exists(self, path):
+        # Check for a device object with one property read instead of listing
+        # every object bluez knows.
+        props = dbus.Interface(self._bus.get_object('org.bluez', path, introspect=False),
+                               'org.freedesktop.DBus.Properties')
+        try:
+            props.Get(_DEVICE_INTERFACE, 'Address')
+            return True
+        except dbus.exceptions.DBusException as ex:
+            if ex.get_dbus_name() in ('org.freedesktop.DBus.Error.UnknownObject',
+                                      'org.freedesktop.DBus.Error.UnknownMethod',
+                                      'org.freedesktop.DBus.Error.InvalidArgs'):
+                return False
+            raise
+
+    def _interfaces_added(self, path, interfaces):
+        props = interfaces.get(_DEVICE_INTERFACE)
+        if props is not None:
+            update_from_bluez(self._advertisements, path, props)
+        if _SERVICE_INTERFACE in interfaces or _CHARACTERISTIC_INTERFACE in interfaces:
+            self._gatt_updated()
+        if _SERVICE_INTERFACE in interfaces:
+            # A service added to a device means its services changed.
+            services_changed(_device_address(path))
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+        if interface == _DEVICE_INTERFACE:
+            update_from_bluez(self._advertisements, path, changed)
+            if 'ServicesResolved' in changed or 'UUIDs' in changed:
+                self._gatt_updated()
+            if 'ServicesResolved' in changed:
+                services_changed(_device_address(path))
+
+    def _gatt_updated(self):
+        with self._gatt_changed:
+            self._gatt_generation += 1
+            self._gatt_changed.notify_all()
+
+    def _gatt_uuids(self, device_path):
+        """Return a tuple of the set of service UUIDs (discovered or listed by
+        the device), the set of characteristic UUIDs bluez has for a device,
+        and whether bluez finished resolving the device's services, from one
+        GetManagedObjects call.
+        """
+        prefix = device_path + '/'
+        services = set()
+        chars = set()
+        resolved = False
+        for path, interfaces in self._bluez.GetManagedObjects().items():
+            if path == device_path:
+                device = interfaces.get(_DEVICE_INTERFACE, {})
+                services.update(intern_uuid(x) for x in device.get('UUIDs', []))
+                resolved = bool(device.get('ServicesResolved', False))
+            elif path.startswith(prefix):
+                if _SERVICE_INTERFACE in interfaces:
+                    services.add(intern_uuid(interfaces[_SERVICE_INTERFACE]['UUID']))
+                elif _CHARACTERISTIC_INTERFACE in interfaces:
+                    chars.add(intern_uuid(interfaces[_CHARACTERISTIC_INTERFACE]['UUID']))
+        return services, chars, resolved
+
+    def _wait_gatt_update(self, generation, deadline):
+        """Wait until a GATT object is added after the generation was read,
+        _DISCOVERY_POLL_SEC passes, or the deadline passes or is cancelled.
+        """
+        end = time.time() + _DISCOVERY_POLL_SEC
+        with self._gatt_changed:
+            while self._gatt_generation == generation and not deadline.expired:
+                deadline.check_cancelled()
+                left = end - time.time()
+                if left <= 0:
+                    return
+                self._gatt_changed.wait(min(0.05, left, deadline.remaining(left)))
 
     def _get_objects(self, interface, parent_path='/org/bluez'):
         """Return a list of all bluez DBus objects that implement the requested
@@ -178,7 +591,7 @@ class BluezProvider(Provider):
         # any that implement the requested interface under the specified path.
         parent_path = parent_path.lower()
         objects = []
-        for opath, interfaces in iteritems(self._bluez.GetManagedObjects()):
+        for opath, interfaces in self._bluez.GetManagedObjects().items():
             if interface in interfaces.keys() and opath.lower().startswith(parent_path):
                 objects.append(self._bus.get_object('org.bluez', opath))
         return objects
@@ -186,7 +599,56 @@ class BluezProvider(Provider):
     def _get_objects_by_path(self, paths):
         """Return a list of all bluez DBus objects from the provided list of paths.
         """
-        return map(lambda x: self._bus.get_object('org.bluez', x), paths)
+        return [self._bus.get_object('org.bluez', x) for x in paths]
+
+    def _operation_queue(self, path):
+        """Return the GATT operation queue for the device that owns the DBus
+        object at the specified path (the device itself or any of its services,
+        characteristics, or descriptors).
+        """
+        match = _DEVICE_PATH_RE.match(path)
+        device_path = match.group(1) if match is not None else path
+        with self._queues_lock:
+            queue = self._queues.get(device_path)
+            if queue is None:
+                queue = OperationQueue(max_in_flight=_MAX_IN_FLIGHT,
+                                       is_transient=_is_transient)
+                self._queues[device_path] = queue
+            return queue
+
+    def _drop_operation_queues(self, device_paths):
+        """Forget the GATT operation queues (and their stats) of devices that
+        were removed from bluez's cache.
+        """
+        with self._queues_lock:
+            for path in device_paths:
+                self._queues.pop(path, None)
+
+    def _add_fd_watch(self, fd, callback):
+        """Call the callback from the main loop whenever the file descriptor is
+        readable or hung up.  The watch is removed when the callback returns
+        False.  Returns an ID that can be passed to _remove_watch.
+        """
+        from gi.repository import GObject
+        callback = timed(callback, 'fd_watch')
+        return GObject.io_add_watch(fd,
+            GObject.IO_IN | GObject.IO_HUP | GObject.IO_ERR,
+            lambda source, condition: callback())
+
+    def _remove_watch(self, watch_id):
+        """Remove a main loop watch added by _add_fd_watch."""
+        from gi.repository import GObject
+        GObject.source_remove(watch_id)
+
+    def _call_later(self, delay_sec, callback):
+        """Call the callback once from the GLib main loop after delay_sec
+        seconds.
+        """
+        from gi.repository import GObject
+        def call():
+            callback()
+            return False  # Only call once.
+        GObject.timeout_add(int(delay_sec*1000), call)
 
     def _print_tree(self):
         """Print tree of all bluez objects, useful for debugging."""
@@ -0,0 +1,488 @@
+# Supervisor that runs one worker process per bluetooth adapter, each with its
+# own BluezProvider and main loop, and streams their scan results and decoded
+# notifications back through shared memory ring buffers.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import binascii
+import collections
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+from ..config import TIMEOUT_SEC
+from ..ring_buffer import SharedRingBuffer
+from ..uuids import intern_uuid, intern_uuid_bytes
+
+
+logger = logging.getLogger(__name__)
+
+# Header of every record a worker sends to the supervisor: the record kind, the
+# RSSI (scan records only), the device's address as 6 bytes, and a UUID as 16
+# bytes (the characteristic of a notification).  The payload follows it.
+_RECORD = struct.Struct('<Bb6s16s')
+_SCAN   = 1
+_NOTIFY = 2
+
+# Payload of a scan record after the header: the length of the name in bytes,
+# then the name, then 16 bytes for each advertised service UUID.
+_NAME_LENGTH = struct.Struct('<B')
+
+_NO_UUID = b'\0' * 16
+
+# Properties of a device that are reported in scan records.
+_SCAN_PROPERTIES = ('RSSI', 'Name', 'UUIDs')
+
+
+WorkerDevice = collections.namedtuple('WorkerDevice',
+    ['address', 'name', 'rssi', 'advertised', 'adapter'])
+WorkerDevice.__doc__ = """Device seen by a worker: its address, name, RSSI,
+list of advertised service UUIDs, and the id of the adapter that hears it
+loudest."""
+
+
+def _address_bytes(address):
+    return binascii.unhexlify(address.replace(':', ''))
+
+
+def _address_string(data):
+    return ':'.join(['{0:02X}'.format(x) for x in bytearray(data)])
+
+
+def list_adapter_ids():
+    """Return the ids (like hci0) of the bluetooth adapters in the system,
+    without talking to bluez.
+    """
+    try:
+        names = os.listdir('/sys/class/bluetooth')
+    except OSError:
+        return []
+    return sorted([x for x in names if x.startswith('hci') and ':' not in x])
+
+
+class _Worker(object):
+    # Runs in the worker process: owns a BluezProvider bound to one adapter,
+    # executes commands from the supervisor, and writes scan results and
+    # notifications to the ring buffer.
+
+    def __init__(self, provider, ring, connection):
+        self._provider = provider
+        self._ring = ring
+        self._connection = connection
+        self._adapter = provider.get_default_adapter()
+        self._devices = {}
+        self._subscriptions = {}
+        self._decoders = {}
+
+    def run(self):
+        # Execute commands until told to stop or the supervisor goes away.
+        self._watch_devices()
+        while True:
+            # Commands start with an id that's sent back with the reply, so
+            # the supervisor can tell a late reply from the one it waits for.
+            try:
+                command_id, command = self._connection.recv()
+            except EOFError:
+                break
+            if command[0] == 'stop':
+                self._connection.send((command_id, 'ok', None))
+                break
+            try:
+                result = getattr(self, '_do_' + command[0])(*command[1:])
+                self._connection.send((command_id, 'ok', result))
+            except Exception as ex:
+                logger.exception('Worker command {0} failed'.format(command[0]))
+                self._connection.send((command_id, 'error', '{0}: {1}'.format(type(ex).__name__, ex)))
+        for address, char_uuid in list(self._subscriptions.keys()):
+            try:
+                self._do_unsubscribe(address, char_uuid)
+            except Exception:
+                pass
+        self._ring.close()
+
+    def _watch_devices(self):
+        # Report every device the adapter knows about now, and then any new
+        # device or change to its RSSI, name, or UUIDs from bluez's signals.
+        bus = self._provider._bus
+        bus.add_signal_receiver(self._interfaces_added, 'InterfacesAdded',
+                                'org.freedesktop.DBus.ObjectManager', 'org.bluez')
+        bus.add_signal_receiver(self._properties_changed, 'PropertiesChanged',
+                                'org.freedesktop.DBus.Properties', 'org.bluez',
+                                path_keyword='path')
+        for path, interfaces in self._provider._bluez.GetManagedObjects().items():
+            self._interfaces_added(path, interfaces)
+
+    def _interfaces_added(self, path, interfaces):
+        props = interfaces.get('org.bluez.Device1')
+        if props is None or str(props.get('Adapter')) != self._provider._adapter_path:
+            return
+        self._devices[path] = dict(props)
+        self._send_scan(self._devices[path])
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+        if interface != 'org.bluez.Device1' or path not in self._devices:
+            return
+        props = self._devices[path]
+        props.update(changed)
+        if any([x in changed for x in _SCAN_PROPERTIES]):
+            self._send_scan(props)
+
+    def _send_scan(self, props):
+        name = str(props.get('Name', '')).encode('utf-8')[:255]
+        uuids = b''.join([intern_uuid(x).bytes for x in props.get('UUIDs', [])])
+        rssi = max(-128, min(127, int(props.get('RSSI', -128))))
+        self._ring.put(_RECORD.pack(_SCAN, rssi, _address_bytes(str(props['Address'])), _NO_UUID),
+                       _NAME_LENGTH.pack(len(name)), name, uuids)
+
+    def _find_characteristic(self, address, service_uuid, char_uuid, timeout_sec):
+        devices = [x for x in self._provider.list_devices() if x.id == address]
+        if len(devices) == 0:
+            raise RuntimeError('Device {0} not found!'.format(address))
+        device = devices[0]
+        if not device.is_connected:
+            device.connect(timeout_sec)
+        if not device.discover([service_uuid], [char_uuid], timeout_sec):
+            raise RuntimeError('Failed to discover characteristic {0}!'.format(char_uuid))
+        return device.find_service(service_uuid).find_characteristic(char_uuid)
+
+    def _do_start_scan(self, timeout_sec):
+        self._adapter.start_scan(timeout_sec)
+
+    def _do_stop_scan(self, timeout_sec):
+        self._adapter.stop_scan(timeout_sec)
+
+    def _do_subscribe(self, address, service_uuid, char_uuid, dtype, batch_size,
+                      timeout_sec):
+        characteristic = self._find_characteristic(address, service_uuid,
+                                                   char_uuid, timeout_sec)
+        header = _RECORD.pack(_NOTIFY, 0, _address_bytes(address), char_uuid.bytes)
+        put = self._ring.put
+        if dtype is None:
+            # Forward raw payloads.
+            def on_change(value):
+                if isinstance(value, str):
+                    # Values from DBus property changes are strings of bytes.
+                    value = value.encode('latin-1')
+                put(header, value)
+        else:
+            # Decode payloads into record batches in this process and forward
+            # the batches.
+            from ..decoder import RecordDecoder
+            decoder = RecordDecoder(dtype, batch_size, lambda batch: put(header, batch))
+            self._decoders[(address, char_uuid)] = decoder
+            on_change = decoder.feed
+        characteristic.start_notify(on_change)
+        self._subscriptions[(address, char_uuid)] = characteristic
+
+    def _do_unsubscribe(self, address, char_uuid):
+        characteristic = self._subscriptions.pop((address, char_uuid), None)
+        if characteristic is not None:
+            characteristic.stop_notify()
+        decoder = self._decoders.pop((address, char_uuid), None)
+        if decoder is not None:
+            decoder.flush()
+
+    def _do_write_value(self, address, service_uuid, char_uuid, value, timeout_sec):
+        characteristic = self._find_characteristic(address, service_uuid,
+                                                   char_uuid, timeout_sec)
+        characteristic.write_value(value)
+
+    def _do_disconnect(self, address, timeout_sec):
+        for device in self._provider.list_devices():
+            if device.id == address and device.is_connected:
+                device.disconnect(timeout_sec)
+
+
+def _worker_main(adapter_id, ring_name, connection):
+    """Entry point of a worker process."""
+    from .. import platform
+    from .provider import BluezProvider
+    provider = BluezProvider()
+    # GATT objects look up the provider globally.
+    platform._provider = provider
+    provider.bind_adapter(adapter_id)
+    provider.initialize()
+    provider.start()
+    try:
+        _Worker(provider, SharedRingBuffer.attach(ring_name), connection).run()
+    finally:
+        provider.stop()
+
+
+class _WorkerHandle(object):
+    # Supervisor's view of one worker process.
+
+    def __init__(self, adapter_id, process, ring, connection):
+        self.adapter_id = adapter_id
+        self.process = process
+        self.ring = ring
+        self.connection = connection
+        self.lock = threading.Lock()
+        # Id of the last command sent, replies with an older id are late
+        # replies to commands that timed out.
+        self.command_id = 0
+        self.records = 0
+        self.subscriptions = 0
+
+
+class WorkerSupervisor(object):
+    """Runs one worker process for each bluetooth adapter, each with its own
+    BluezProvider bound to that adapter and its own main loop, so scanning,
+    notification handling, and decoding are spread over the CPU's cores instead
+    of sharing one interpreter.  Workers stream scan results and notifications
+    back through a SharedRingBuffer each, the supervisor only dispatches them.
+
+    The supervisor gives one view of every device seen by any adapter and
+    routes subscriptions and writes to the worker whose adapter hears the
+    device best (preferring adapters with fewer subscriptions).  Callbacks run
+    on the supervisor's dispatch thread.
+
+    The supervisor process doesn't need to talk to bluez, so it can run the
+    workers even when it doesn't import dbus itself.
+    """
+
+    def __init__(self, adapter_ids=None, ring_capacity=1 << 22,
+                 poll_interval_sec=0.001):
+        """Create a supervisor for the adapters with the specified ids (like
+        ['hci0', 'hci1']), the default is every adapter in the system.  Each
+        worker gets a ring buffer of ring_capacity bytes, and the dispatch
+        thread sleeps for poll_interval_sec when every ring is empty.
+        """
+        self._adapter_ids = adapter_ids if adapter_ids is not None else list_adapter_ids()
+        if len(self._adapter_ids) == 0:
+            raise RuntimeError('No bluetooth adapters found!')
+        self._ring_capacity = ring_capacity
+        self._poll_interval_sec = poll_interval_sec
+        self._workers = []
+        self._lock = threading.Lock()
+        # Seen devices as a dict of address to a dict of adapter id to the
+        # device's latest name, RSSI, and advertised UUIDs.
+        self._devices = {}
+        self._owners = {}
+        self._callbacks = {}
+        self._thread = None
+        self._running = False
+
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Start the worker processes and the dispatch thread."""
+        # Spawn fresh interpreters so no main loop or DBus state is inherited.
+        context = multiprocessing.get_context('spawn')
+        for adapter_id in self._adapter_ids:
+            ring = SharedRingBuffer(self._ring_capacity)
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker_main,
+                                      args=(adapter_id, ring.name, child),
+                                      name='BLE worker {0}'.format(adapter_id))
+            process.daemon = True
+            process.start()
+            child.close()
+            self._workers.append(_WorkerHandle(adapter_id, process, ring, parent))
+        self._running = True
+        self._thread = threading.Thread(target=self._dispatch_main,
+                                        name='WorkerSupervisor dispatch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Stop every worker process and free the ring buffers."""
+        for worker in self._workers:
+            try:
+                self._command(worker, ('stop',), timeout_sec)
+            except Exception as ex:
+                logger.warning('Worker {0} did not stop cleanly: {1}'.format(worker.adapter_id, ex))
+        for worker in self._workers:
+            worker.process.join(timeout_sec)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout_sec)
+            self._thread = None
+        for worker in self._workers:
+            worker.connection.close()
+            worker.ring.close()
+            worker.ring.unlink()
+        self._workers = []
+
+    def _command(self, worker, command, timeout_sec=TIMEOUT_SEC):
+        # Send a command to a worker and wait for its reply, discarding late
+        # replies to earlier commands that timed out.
+        end = time.time() + timeout_sec
+        with worker.lock:
+            worker.command_id += 1
+            worker.connection.send((worker.command_id, command))
+            while True:
+                if not worker.connection.poll(max(0, end - time.time())):
+                    raise RuntimeError('Exceeded timeout waiting for worker {0}!'.format(worker.adapter_id))
+                command_id, status, result = worker.connection.recv()
+                if command_id == worker.command_id:
+                    break
+                logger.debug('Discarding late reply from worker {0}'.format(worker.adapter_id))
+        if status != 'ok':
+            raise RuntimeError('Worker {0} failed: {1}'.format(worker.adapter_id, result))
+        return result
+
+    def _dispatch_main(self):
+        # Drain every worker's ring buffer, sleeping when they're all empty.
+        handlers = [(x, self._make_handler(x)) for x in self._workers]
+        while self._running:
+            count = 0
+            for worker, handler in handlers:
+                read = worker.ring.read(handler)
+                worker.records += read
+                count += read
+            if count == 0:
+                time.sleep(self._poll_interval_sec)
+
+    def _make_handler(self, worker):
+        adapter_id = worker.adapter_id
+        def handle(record):
+            kind, rssi, address, char_uuid = _RECORD.unpack_from(record)
+            payload = record[_RECORD.size:]
+            address = _address_string(address)
+            if kind == _SCAN:
+                length = payload[0]
+                name = bytes(payload[1:1+length]).decode('utf-8', 'replace')
+                uuids = payload[1+length:]
+                advertised = [intern_uuid_bytes(uuids[i:i+16]) for i in range(0, len(uuids), 16)]
+                with self._lock:
+                    self._devices.setdefault(address, {})[adapter_id] = (name, rssi, advertised)
+            elif kind == _NOTIFY:
+                callback = self._callbacks.get((address, char_uuid))
+                if callback is None:
+                    return
+                on_change, dtype = callback
+                try:
+                    if dtype is None:
+                        on_change(payload.tobytes())
+                    else:
+                        import numpy as np
+                        on_change(np.frombuffer(payload, dtype))
+                except Exception:
+                    logger.exception('Error in notification callback')
+        return handle
+
+    def devices(self):
+        """Return a list of WorkerDevice tuples for every device seen by any
+        adapter.
+        """
+        with self._lock:
+            seen = list(self._devices.items())
+        result = []
+        for address, by_adapter in seen:
+            adapter_id, (name, rssi, advertised) = max(by_adapter.items(), key=lambda x: x[1][1])
+            result.append(WorkerDevice(address, name, rssi, advertised, adapter_id))
+        return result
+
+    def find_devices(self, service_uuids=[], name=None):
+        """Return WorkerDevice tuples for devices that advertise the specified
+        service UUIDs and/or have the specified name.
+        """
+        expected = set(service_uuids)
+        if name is not None:
+            return [x for x in self.devices() if x.name == name]
+        return [x for x in self.devices() if set(x.advertised) >= expected]
+
+    def start_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Start scanning on every adapter."""
+        for worker in self._workers:
+            self._command(worker, ('start_scan', timeout_sec), timeout_sec)
+
+    def stop_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Stop scanning on every adapter."""
+        for worker in self._workers:
+            self._command(worker, ('stop_scan', timeout_sec), timeout_sec)
+
+    def _owner(self, address):
+        # Return the worker that handles the device, picking the one whose
+        # adapter hears it loudest (with fewer subscriptions breaking ties)
+        # the first time.
+        with self._lock:
+            worker = self._owners.get(address)
+            if worker is not None:
+                return worker
+            by_adapter = self._devices.get(address)
+            if by_adapter is None:
+                raise RuntimeError('Device {0} has not been seen by any adapter!'.format(address))
+            candidates = [x for x in self._workers if x.adapter_id in by_adapter]
+            worker = max(candidates, key=lambda x: (by_adapter[x.adapter_id][1], -x.subscriptions))
+            self._owners[address] = worker
+            return worker
+
+    def subscribe(self, address, service_uuid, char_uuid, on_change,
+                  dtype=None, batch_size=1, timeout_sec=TIMEOUT_SEC):
+        """Connect to the device (if needed) and call on_change with each
+        notification of the characteristic.  Without a dtype on_change gets the
+        raw bytes of each notification.  With a dtype (anything np.dtype
+        accepts) the worker decodes notifications with a RecordDecoder and
+        on_change gets a NumPy structured array of batch_size records that
+        points into the ring buffer and is only valid during the call.
+        """
+        worker = self._owner(address)
+        key = (address, char_uuid.bytes)
+        with self._lock:
+            self._callbacks[key] = (on_change, dtype)
+        try:
+            self._command(worker, ('subscribe', address, service_uuid, char_uuid,
+                                   dtype, batch_size, timeout_sec), timeout_sec * 2)
+        except Exception:
+            with self._lock:
+                self._callbacks.pop(key, None)
+            raise
+        with self._lock:
+            worker.subscriptions += 1
+
+    def unsubscribe(self, address, char_uuid, timeout_sec=TIMEOUT_SEC):
+        """Stop notifications of the characteristic."""
+        worker = self._owner(address)
+        self._command(worker, ('unsubscribe', address, char_uuid), timeout_sec)
+        with self._lock:
+            self._callbacks.pop((address, char_uuid.bytes), None)
+            worker.subscriptions -= 1
+
+    def write_value(self, address, service_uuid, char_uuid, value,
+                    timeout_sec=TIMEOUT_SEC):
+        """Write the value to the characteristic, connecting to the device if
+        needed.
+        """
+        self._command(self._owner(address), ('write_value', address, service_uuid,
+                      char_uuid, bytes(value), timeout_sec), timeout_sec * 2)
+
+    def disconnect(self, address, timeout_sec=TIMEOUT_SEC):
+        """Disconnect from the device."""
+        worker = self._owner(address)
+        self._command(worker, ('disconnect', address, timeout_sec), timeout_sec)
+        with self._lock:
+            self._owners.pop(address, None)
+
+    def stats(self):
+        """Return a dict of adapter id to a dict of statistics for its worker:
+        whether the process is alive, records received, records dropped because
+        the ring buffer was full, and subscriptions.
+        """
+        return dict([(x.adapter_id, {
+            'alive':         x.process.is_alive(),
+            'records':       x.records,
+            'dropped':       x.ring.dropped,
+            'subscriptions': x.subscriptions
+        }) for x in self._workers])
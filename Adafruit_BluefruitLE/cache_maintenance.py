@@ -0,0 +1,122 @@
+# Background maintenance of the OS's cache of BLE devices: evicts devices that
+# aren't connected or paired by how long ago they were last seen and a cap on
+# the number of cached devices.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+
+from . import metrics
+from .config import CACHE_MAINTENANCE_INTERVAL_SEC
+
+
+logger = logging.getLogger(__name__)
+
+
+def choose_evictions(candidates, total, max_age_sec, max_devices, now):
+    """Return the list of devices to evict from a cache of total devices.
+    candidates is a list of (last seen time, device) tuples for the devices
+    that can be evicted (not connected or paired).  Every candidate last seen
+    more than max_age_sec ago is evicted, then the least recently seen until at
+    most max_devices remain in the cache.  Either limit can be None.
+    """
+    candidates = sorted(candidates, key=lambda x: x[0])
+    evict = 0
+    if max_age_sec is not None:
+        while evict < len(candidates) and now - candidates[evict][0] > max_age_sec:
+            evict += 1
+    if max_devices is not None:
+        evict = max(evict, min(len(candidates), total - max_devices))
+    return [x[1] for x in candidates[:evict]]
+
+
+class CacheMaintenance(object):
+    """Runs a provider's purge_cache every interval_sec seconds on a background
+    thread and keeps statistics of what was evicted.  Use
+    Provider.maintain_cache to create one.
+    """
+
+    def __init__(self, purge, interval_sec=CACHE_MAINTENANCE_INTERVAL_SEC):
+        self._purge = purge
+        self._interval_sec = interval_sec
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._runs = 0
+        self._failures = 0
+        self._evicted = 0
+        self._seconds = 0.0
+        self._last = None
+
+    def start(self):
+        """Start purging, the first purge runs right away."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='BLE cache maintenance')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout_sec=None):
+        """Stop purging and wait up to timeout_sec for a purge in progress."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._stopped.set()
+            thread.join(timeout_sec)
+
+    def stats(self):
+        """Return a dict with the number of purges run and failed, the total
+        devices evicted and seconds spent purging, and the result of the last
+        purge.
+        """
+        with self._lock:
+            return {
+                'runs':     self._runs,
+                'failures': self._failures,
+                'evicted':  self._evicted,
+                'seconds':  self._seconds,
+                'last':     self._last
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                result = self._purge()
+            except Exception:
+                logger.exception('Error purging the BLE device cache')
+                with self._lock:
+                    self._runs += 1
+                    self._failures += 1
+            else:
+                with self._lock:
+                    self._runs += 1
+                    self._evicted += result['evicted']
+                    self._seconds += result['seconds']
+                    self._last = result
+                if metrics.METRICS:
+                    metrics.CACHE_EVICTIONS.labels().inc(result['evicted'])
+                logger.debug('Evicted {0} cached devices in {1:.3f} seconds, {2} remain'.format(
+                    result['evicted'], result['seconds'], result['remaining']))
+            self._stopped.wait(self._interval_sec)
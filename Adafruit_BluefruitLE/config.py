@@ -20,8 +20,72 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import os
 
 
 # Default timeout for an action which waits for something to happen, like
 # connecting or discovering services.
 TIMEOUT_SEC = 60
+
+# Provider to use on Linux: 'bluez_dbus' for the dbus-python and GLib based
+# provider, or 'bluez_asyncio' for the provider that talks to the bus directly
+# from an asyncio event loop.  Can be set with the
+# ADAFRUIT_BLUEFRUITLE_LINUX_PROVIDER environment variable.
+LINUX_PROVIDER = os.environ.get('ADAFRUIT_BLUEFRUITLE_LINUX_PROVIDER', 'bluez_dbus')
+
+# Provider to use on every platform instead of the platform's own, currently
+# only 'gateway' to use the BLE devices of a gateway daemon.  Can be set with
+# the ADAFRUIT_BLUEFRUITLE_PROVIDER environment variable.
+PROVIDER = os.environ.get('ADAFRUIT_BLUEFRUITLE_PROVIDER')
+
+# Path of the Unix domain socket the gateway daemon listens on.  Can be set
+# with the ADAFRUIT_BLUEFRUITLE_GATEWAY_SOCKET environment variable.
+GATEWAY_SOCKET = os.environ.get('ADAFRUIT_BLUEFRUITLE_GATEWAY_SOCKET', '/tmp/adafruit_bluefruitle.sock')
+
+# Record spans of BLE operations from the start (see tracing.py), set with the
+# ADAFRUIT_BLUEFRUITLE_TRACE environment variable.  The tracer keeps the most
+# recent TRACE_CAPACITY events.
+TRACE = os.environ.get('ADAFRUIT_BLUEFRUITLE_TRACE', '') not in ('', '0')
+TRACE_CAPACITY = 10000
+
+# Record counters and histograms of BLE activity (see metrics.py), disable by
+# setting the ADAFRUIT_BLUEFRUITLE_METRICS environment variable to 0.
+METRICS = os.environ.get('ADAFRUIT_BLUEFRUITLE_METRICS', '1') != '0'
+
+# Handlers that block the main loop longer than this many seconds are logged
+# and counted, and the loop monitor checks the loop's lag every
+# LOOP_MONITOR_INTERVAL_SEC seconds (see loop_monitor.py).
+SLOW_HANDLER_SEC = 0.05
+LOOP_MONITOR_INTERVAL_SEC = 0.1
+
+# Devices that haven't advertised for this many seconds are forgotten by the
+# providers' advertisement stores (see advertisements.py).
+ADVERTISEMENT_TTL_SEC = 300
+
+# Limits on the OS's cache of devices kept by Provider.purge_cache and the
+# background maintenance started by Provider.maintain_cache (see
+# cache_maintenance.py): devices that aren't connected or paired are evicted
+# when they haven't advertised for CACHE_MAX_AGE_SEC seconds, or when the
+# cache holds more than CACHE_MAX_DEVICES devices.
+CACHE_MAX_AGE_SEC = 3600
+CACHE_MAX_DEVICES = 1000
+CACHE_MAINTENANCE_INTERVAL_SEC = 600
+
+# Reconnecting of sessions (see session.py): the first retry after a failed
+# reconnect waits RECONNECT_DELAY_SEC seconds, doubling after each failure up
+# to RECONNECT_MAX_DELAY_SEC.  At most SESSION_MAX_PENDING_WRITES writes made
+# while the device is disconnected are kept to send once it reconnects.
+RECONNECT_DELAY_SEC = 1
+RECONNECT_MAX_DELAY_SEC = 30
+SESSION_MAX_PENDING_WRITES = 256
+
+# Seconds characteristic values are cached by the value cache (see
+# value_cache.py) when their UUID has no policy of its own.  Device information
+# service values are cached until the device disconnects.
+VALUE_CACHE_TTL_SEC = 5
+
+# File where Provider.connect_address remembers the devices it connected to
+# (see known_devices.py), set with the ADAFRUIT_BLUEFRUITLE_KNOWN_DEVICES
+# environment variable.  An empty value keeps the list in memory only.
+KNOWN_DEVICES_FILE = os.environ.get('ADAFRUIT_BLUEFRUITLE_KNOWN_DEVICES',
+                                    os.path.expanduser('~/.adafruit_bluefruitle_devices.json'))
@@ -28,8 +28,10 @@ import time
 import objc
 
 from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
 from ..interfaces import Adapter
 from ..platform import get_provider
+from .. import tracing
 
 
 # Load IOBluetooth functions for controlling bluetooth power state.
@@ -76,13 +78,15 @@ class CoreBluetoothAdapter(Adapter):
 
     def start_scan(self, timeout_sec=TIMEOUT_SEC):
         """Start scanning for BLE devices."""
-        get_provider()._central_manager.scanForPeripheralsWithServices_options_(None, None)
-        self._is_scanning = True
+        with tracing.span('scan.start'):
+            get_provider()._central_manager.scanForPeripheralsWithServices_options_(None, None)
+            self._is_scanning = True
 
     def stop_scan(self, timeout_sec=TIMEOUT_SEC):
         """Stop scanning for BLE devices."""
-        get_provider()._central_manager.stopScan()
-        self._is_scanning = False
+        with tracing.span('scan.stop'):
+            get_provider()._central_manager.stopScan()
+            self._is_scanning = False
 
     @property
     def is_scanning(self):
@@ -94,18 +98,20 @@ class CoreBluetoothAdapter(Adapter):
     def power_on(self, timeout_sec=TIMEOUT_SEC):
         """Power on Bluetooth."""
         # Turn on bluetooth and wait for powered on event to be set.
+        deadline = as_deadline(timeout_sec)
+        deadline.check_cancelled()
         self._powered_on.clear()
         IOBluetoothPreferenceSetControllerPowerState(1)
-        if not self._powered_on.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting for adapter to power on!')
+        deadline.wait(self._powered_on, 'Exceeded timeout waiting for adapter to power on!')
 
     def power_off(self, timeout_sec=TIMEOUT_SEC):
         """Power off Bluetooth."""
         # Turn off bluetooth.
+        deadline = as_deadline(timeout_sec)
+        deadline.check_cancelled()
         self._powered_off.clear()
         IOBluetoothPreferenceSetControllerPowerState(0)
-        if not self._powered_off.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting for adapter to power off!')
+        deadline.wait(self._powered_off, 'Exceeded timeout waiting for adapter to power off!')
 
     @property
     def is_powered(self):
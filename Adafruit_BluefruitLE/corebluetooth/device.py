@@ -20,15 +20,19 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from past.builtins import map
 import threading
 
 from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
+from ..gatt_snapshot import GattSnapshot, ServiceNode, CharacteristicNode, DescriptorNode
+from ..gatt_snapshot import flags_from_properties
 from ..interfaces import Device
+from ..operation_queue import OperationQueue
 from ..platform import get_provider
+from .. import metrics, tracing
 
-from .gatt import CoreBluetoothGattService
-from .objc_helpers import cbuuid_to_uuid, nsuuid_to_uuid
+from .gatt import CoreBluetoothGattService, _ADAPTER_ID
+from .objc_helpers import cbuuid_to_uuid, nsuuid_to_uuid, uuid_to_cbuuid
 from .provider import device_list, service_list, characteristic_list, descriptor_list
 
 
@@ -40,15 +44,27 @@ class CoreBluetoothDevice(Device):
         CBPeripheral instance.
         """
         self._peripheral = peripheral
-        self._advertised = []
+        self._id = nsuuid_to_uuid(peripheral.identifier())
         self._discovered_services = set()
+        # Whether every service and characteristic has been discovered since
+        # connecting, until then discovering nothing in particular can't be
+        # skipped.
+        self._full_discovery = False
+        # CBUUIDs of the characteristics being discovered, None for all.
+        self._char_filter = None
         self._char_on_changed = {}
         self._rssi = None
+        # Identifier of the device in traces.
+        self._trace_id = str(self._id)
         # Events to signify when an asyncronous request has finished.
         self._connected = threading.Event()
         self._disconnected = threading.Event()
         self._discovered = threading.Event()
         self._rssi_read = threading.Event()
+        # Queue to schedule GATT operations.  CoreBluetooth can only track one
+        # outstanding read per characteristic so operations on the same
+        # characteristic are serialized by the queue.
+        self._queue = OperationQueue(max_in_flight=4)
 
     @property
     def _central_manager(self):
@@ -59,9 +75,17 @@ class CoreBluetoothDevice(Device):
         """Connect to the device.  If not connected within the specified timeout
         then an exception is thrown.
         """
-        self._central_manager.connectPeripheral_options_(self._peripheral, None)
-        if not self._connected.wait(timeout_sec):
-            raise RuntimeError('Failed to connect to device within timeout period!')
+        with tracing.span('device.connect', self._trace_id), \
+             metrics.operation('connect', _ADAPTER_ID, self._trace_id):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            # A device is dropped from the device list when it disconnects, add
+            # it back so its connected event fires when reconnecting.
+            device_list().add(self._peripheral, self)
+            # Cancelling the connection aborts it while it's still being made.
+            with deadline.on_cancel(lambda: self._central_manager.cancelPeripheralConnection_(self._peripheral)):
+                self._central_manager.connectPeripheral_options_(self._peripheral, None)
+                deadline.wait(self._connected, 'Failed to connect to device within timeout period!')
 
     def disconnect(self, timeout_sec=TIMEOUT_SEC):
         """Disconnect from the device.  If not disconnected within the specified
@@ -77,9 +101,12 @@ class CoreBluetoothDevice(Device):
                 characteristic_list().remove(char)
             service_list().remove(service)
         # Now disconnect.
-        self._central_manager.cancelPeripheralConnection_(self._peripheral)
-        if not self._disconnected.wait(timeout_sec):
-            raise RuntimeError('Failed to disconnect to device within timeout period!')
+        with tracing.span('device.disconnect', self._trace_id), \
+             metrics.operation('disconnect', _ADAPTER_ID, self._trace_id):
+            deadline = as_deadline(timeout_sec)
+            deadline.check_cancelled()
+            self._central_manager.cancelPeripheralConnection_(self._peripheral)
+            deadline.wait(self._disconnected, 'Failed to disconnect to device within timeout period!')
 
     def _set_connected(self):
         """Set the connected event."""
@@ -90,13 +117,38 @@ class CoreBluetoothDevice(Device):
         """Set the connected event."""
         self._connected.clear()
         self._disconnected.set()
+        self._full_discovery = False
+        self._fire_disconnected()
 
-    def _update_advertised(self, advertised):
+    def _services_modified(self):
+        """Called when the device's services changed."""
+        self._full_discovery = False
+
+    def _update_advertised(self, advertised, rssi=None):
         """Called when advertisement data is received."""
-        # Advertisement data was received, pull out advertised service UUIDs and
-        # name from advertisement data.
+        # Advertisement data was received, pull out advertised service UUIDs,
+        # name, and manufacturer and service data and add them to the
+        # provider's advertisement store (which keeps each UUID once).
+        uuids = []
         if 'kCBAdvDataServiceUUIDs' in advertised:
-            self._advertised = self._advertised + map(cbuuid_to_uuid, advertised['kCBAdvDataServiceUUIDs'])
+            uuids = [cbuuid_to_uuid(x) for x in advertised['kCBAdvDataServiceUUIDs']]
+        name = None
+        if 'kCBAdvDataLocalName' in advertised:
+            name = str(advertised['kCBAdvDataLocalName'])
+        data = None
+        if 'kCBAdvDataManufacturerData' in advertised or 'kCBAdvDataServiceData' in advertised:
+            data = {}
+            if 'kCBAdvDataManufacturerData' in advertised:
+                # Manufacturer data starts with the little endian company id.
+                value = bytes(advertised['kCBAdvDataManufacturerData'])
+                if len(value) >= 2:
+                    data['manufacturer_data'] = {value[0] | (value[1] << 8): value[2:]}
+            if 'kCBAdvDataServiceData' in advertised:
+                service_data = advertised['kCBAdvDataServiceData']
+                data['service_data'] = dict([(cbuuid_to_uuid(x), bytes(service_data[x]))
+                                             for x in service_data.keys()])
+        get_provider().advertisements.update(self._id, uuids=uuids, name=name,
+            data=data, rssi=int(rssi) if rssi is not None else None)
 
     def _characteristics_discovered(self, service):
         """Called when GATT characteristics have been discovered."""
@@ -147,22 +199,79 @@ class CoreBluetoothDevice(Device):
         """
         return service_list().get_all(self._peripheral.services())
 
+    def gatt_snapshot(self):
+        """Return an immutable GattSnapshot of the services, characteristics,
+        and descriptors discovered for this device, read from the
+        CoreBluetooth objects OSX already has.  OSX doesn't tell us handles so
+        they're None.
+        """
+        return GattSnapshot(tuple(
+            ServiceNode(cbuuid_to_uuid(service.UUID()), None, bool(service.isPrimary()), tuple(
+                CharacteristicNode(cbuuid_to_uuid(char.UUID()), None,
+                                   flags_from_properties(char.properties()), tuple(
+                    DescriptorNode(cbuuid_to_uuid(desc.UUID()), None)
+                    for desc in (char.descriptors() or [])))
+                for char in (service.characteristics() or [])))
+            for service in (self._peripheral.services() or [])))
+
     def discover(self, service_uuids, char_uuids, timeout_sec=TIMEOUT_SEC):
-        """Wait up to timeout_sec for the specified services and characteristics
-        to be discovered on the device.  If the timeout is exceeded without
-        discovering the services and characteristics then an exception is thrown.
+        """Discover the specified services and characteristics on the device
+        and wait up to timeout_sec for them.  Only the listed UUIDs are
+        discovered, an empty list discovers every service or every
+        characteristic of the services.  If the timeout is exceeded without
+        discovering the services and characteristics then an exception is
+        thrown.  Returns True if they were all found, False if the device
+        doesn't have some of them.
         """
-        # Since OSX tells us when all services and characteristics are discovered
-        # this function can just wait for that full service discovery.
-        if not self._discovered.wait(timeout_sec):
-            raise RuntimeError('Failed to discover device services within timeout period!')
+        expected_services = set(service_uuids)
+        expected_chars = set(char_uuids)
+        with tracing.span('device.discover', self._trace_id,
+                          services=len(service_uuids), characteristics=len(char_uuids)) as span, \
+             metrics.operation('discover', _ADAPTER_ID, self._trace_id) as operation:
+            full = len(expected_services) == 0 and len(expected_chars) == 0
+            found = self._has_discovered(expected_services, expected_chars)
+            if not found:
+                # OSX tells us when the requested services and characteristics
+                # are discovered so just wait for that.
+                self._discovered.clear()
+                self._discovered_services = set()
+                self._char_filter = [uuid_to_cbuuid(x) for x in expected_chars] or None
+                self._peripheral.discoverServices_([uuid_to_cbuuid(x) for x in expected_services] or None)
+                as_deadline(timeout_sec).wait(self._discovered,
+                                              'Failed to discover device services within timeout period!')
+                if full:
+                    self._full_discovery = True
+                found = self._has_discovered(expected_services, expected_chars)
+            span.set('found', found)
+            if not found:
+                operation.fail()
+            return found
+
+    def _has_discovered(self, service_uuids, char_uuids):
+        # Return True if the services and characteristics were already
+        # discovered, like by an earlier call to discover.  Asking for nothing
+        # in particular means everything, which is only known after a full
+        # discovery (a filtered one finds just some of the services).
+        if len(service_uuids) == 0 and len(char_uuids) == 0 and not self._full_discovery:
+            return False
+        services = self.list_services()
+        actual_services = set([x.uuid for x in services])
+        actual_chars = set([x.uuid for service in services for x in service.list_characteristics()])
+        return len(services) > 0 and actual_services >= service_uuids and actual_chars >= char_uuids
+
+    def operation_stats(self):
+        """Return a dict of statistics for the queue that schedules GATT
+        operations with this device.
+        """
+        return self._queue.stats()
 
     @property
     def advertised(self):
         """Return a list of UUIDs for services that are advertised by this
         device.
         """
-        return self._advertised
+        record = get_provider().advertisements.get(self._id)
+        return list(record.uuids) if record is not None else []
 
     @property
     def id(self):
@@ -170,7 +279,7 @@ class CoreBluetoothDevice(Device):
         this will be the MAC address of the device, however on unsupported
         platforms (Mac OSX) it will be a unique ID like a UUID.
         """
-        return nsuuid_to_uuid(self._peripheral.identifier())
+        return self._id
 
     @property
     def name(self):
@@ -184,12 +293,21 @@ class CoreBluetoothDevice(Device):
         return self._connected.is_set()
 
     @property
-    def rssi(self, timeout_sec=TIMEOUT_SEC):
-        """Return the RSSI signal strength in decibels."""
+    def rssi(self):
+        """Return the RSSI signal strength in decibels, read from the device
+        with the default timeout (use read_rssi for a different one).
+        """
+        return self.read_rssi()
+
+    def read_rssi(self, timeout_sec=TIMEOUT_SEC):
+        """Read the RSSI signal strength in decibels from the device, waiting up
+        to timeout_sec for it.
+        """
+        deadline = as_deadline(timeout_sec)
+        deadline.check_cancelled()
         # Kick off query to get RSSI, then wait for it to return asyncronously
         # when the _rssi_changed() function is called.
         self._rssi_read.clear()
         self._peripheral.readRSSI()
-        if not self._rssi_read.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting for RSSI value!')
+        deadline.wait(self._rssi_read, 'Exceeded timeout waiting for RSSI value!')
         return self._rssi
@@ -25,7 +25,11 @@ import threading
 import objc
 
 from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
 from ..interfaces import GattService, GattCharacteristic, GattDescriptor
+from ..interfaces import WRITE_WITH_RESPONSE
+from ..operation_queue import PRIORITY_CONTROL, PRIORITY_NORMAL
+from .. import metrics, tracing
 
 from .objc_helpers import cbuuid_to_uuid
 from .provider import device_list, characteristic_list, descriptor_list
@@ -35,6 +39,10 @@ from .provider import device_list, characteristic_list, descriptor_list
 objc.loadBundle("CoreBluetooth", globals(),
     bundle_path=objc.pathForFramework(u'/System/Library/Frameworks/IOBluetooth.framework/Versions/A/Frameworks/CoreBluetooth.framework'))
 
+# CoreBluetooth has no concept of individual adapters, metrics are recorded for
+# this adapter name.
+_ADAPTER_ID = 'default'
+
 
 class CoreBluetoothGattService(GattService):
     """CoreBluetooth GATT service object."""
@@ -81,39 +89,72 @@ class CoreBluetoothGattCharacteristic(GattCharacteristic):
         """Return the UUID of this GATT characteristic."""
         return cbuuid_to_uuid(self._characteristic.UUID())
 
-    def read_value(self, timeout_sec=TIMEOUT_SEC):
-        """Read the value of this characteristic."""
-        # Kick off a query to read the value of the characteristic, then wait
-        # for the result to return asyncronously.
-        self._value_read.clear()
-        self._device._peripheral.readValueForCharacteristic_(self._characteristic)
-        if not self._value_read.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting to read characteristic value!')
-        return self._characteristic.value()
-
-    def write_value(self, value, write_type=0):
-        """Write the specified value to this characteristic."""
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this characteristic.  The read is scheduled on the
+        device's operation queue with the specified priority, and waits up to
+        timeout_sec for its turn and the value.
+        """
+        device = self._device
+        deadline = as_deadline(timeout_sec)
+        def read():
+            # Kick off a query to read the value of the characteristic, then
+            # wait for the result to return asyncronously.
+            self._value_read.clear()
+            device._peripheral.readValueForCharacteristic_(self._characteristic)
+            deadline.wait(self._value_read, 'Exceeded timeout waiting to read characteristic value!')
+            return self._characteristic.value()
+        with tracing.span('gatt.read', device._trace_id, uuid=self._characteristic.UUID()), \
+             metrics.operation('read', _ADAPTER_ID, device._trace_id):
+            value = device._queue.run(read, priority, self._characteristic, deadline)
+        metrics.received(_ADAPTER_ID, device._trace_id, len(value))
+        return value
+
+    def write_value(self, value, write_type=WRITE_WITH_RESPONSE,
+                    timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Write the specified value to this characteristic.  The write is
+        scheduled on the device's operation queue with the specified priority,
+        use PRIORITY_CONTROL to jump ahead of waiting reads, and waits up to
+        timeout_sec for its turn.
+        """
+        device = self._device
+        if write_type is None:
+            write_type = WRITE_WITH_RESPONSE
         data = NSData.dataWithBytes_length_(value, len(value))
-        self._device._peripheral.writeValue_forCharacteristic_type_(data,
-            self._characteristic,
-            write_type)
-
-    def start_notify(self, on_change):
+        with tracing.span('gatt.write', device._trace_id, uuid=self._characteristic.UUID(), size=len(value)), \
+             metrics.operation('write', _ADAPTER_ID, device._trace_id, len(value)):
+            device._queue.run(lambda: device._peripheral.writeValue_forCharacteristic_type_(data,
+                                  self._characteristic,
+                                  write_type),
+                              priority, self._characteristic, timeout_sec)
+
+    def start_notify(self, on_change, timeout_sec=TIMEOUT_SEC):
         """Enable notification of changes for this characteristic on the
         specified on_change callback.  on_change should be a function that takes
-        one parameter which is the value (as a string of bytes) of the changed
-        characteristic value.
+        one parameter which is the value (as bytes) of the changed
+        characteristic value.  Waits up to timeout_sec for its turn on the
+        device's operation queue.
         """
+        device = self._device
+        on_change = metrics.instrument_callback(on_change, _ADAPTER_ID, device._trace_id)
+        on_change = tracing.first_call(on_change, 'gatt.first_notification',
+                                       device._trace_id, uuid=self._characteristic.UUID())
         # Tell the device what callback to use for changes to this characteristic.
-        self._device._notify_characteristic(self._characteristic, on_change)
+        device._notify_characteristic(self._characteristic, on_change)
         # Turn on notifications of characteristic changes.
-        self._device._peripheral.setNotifyValue_forCharacteristic_(True,
-            self._characteristic)
-
-    def stop_notify(self):
-        """Disable notification of changes for this characteristic."""
-        self._device._peripheral.setNotifyValue_forCharacteristic_(False,
-            self._characteristic)
+        with tracing.span('gatt.subscribe', device._trace_id, uuid=self._characteristic.UUID()):
+            device._queue.run(lambda: device._peripheral.setNotifyValue_forCharacteristic_(True,
+                                  self._characteristic),
+                              PRIORITY_CONTROL, self._characteristic, timeout_sec)
+
+    def stop_notify(self, timeout_sec=TIMEOUT_SEC):
+        """Disable notification of changes for this characteristic, waiting up
+        to timeout_sec for its turn on the device's operation queue.
+        """
+        device = self._device
+        with tracing.span('gatt.unsubscribe', device._trace_id, uuid=self._characteristic.UUID()):
+            device._queue.run(lambda: device._peripheral.setNotifyValue_forCharacteristic_(False,
+                                  self._characteristic),
+                              PRIORITY_CONTROL, self._characteristic, timeout_sec)
 
     def list_descriptors(self):
         """Return list of GATT descriptors that have been discovered for this
@@ -146,13 +187,22 @@ class CoreBluetoothGattDescriptor(GattDescriptor):
         """Return the UUID of this GATT descriptor."""
         return cbuuid_to_uuid(self._descriptor.UUID())
 
-    def read_value(self):
-        """Read the value of this descriptor."""
-        pass
-        # Kick off a query to read the value of the descriptor, then wait
-        # for the result to return asyncronously.
-        self._value_read.clear()
-        self._device._peripheral.readValueForDescriptor(self._descriptor)
-        if not self._value_read.wait(timeout_sec):
-            raise RuntimeError('Exceeded timeout waiting to read characteristic value!')
-        return self._value
+    def read_value(self, timeout_sec=TIMEOUT_SEC, priority=PRIORITY_NORMAL):
+        """Read the value of this descriptor.  The read is scheduled on the
+        device's operation queue with the specified priority, and waits up to
+        timeout_sec for its turn and the value.
+        """
+        device = self._device
+        deadline = as_deadline(timeout_sec)
+        def read():
+            # Kick off a query to read the value of the descriptor, then wait
+            # for the result to return asyncronously.
+            self._value_read.clear()
+            device._peripheral.readValueForDescriptor_(self._descriptor)
+            deadline.wait(self._value_read, 'Exceeded timeout waiting to read descriptor value!')
+            return self._descriptor.value()
+        with tracing.span('gatt.read_descriptor', device._trace_id, uuid=self._descriptor.UUID()), \
+             metrics.operation('read', _ADAPTER_ID, device._trace_id):
+            value = device._queue.run(read, priority, self._descriptor, deadline)
+        metrics.received(_ADAPTER_ID, device._trace_id, len(value))
+        return value
@@ -56,8 +56,11 @@ class CoreBluetoothMetadata(object):
     def get_all(self, cbobjects):
         """Retrieve a list of metadata objects associated with the specified
         list of CoreBluetooth objects.  If an object cannot be found then an
-        exception is thrown.
+        exception is thrown.  CoreBluetooth returns None for lists that haven't
+        been discovered yet, which gives an empty list.
         """
+        if cbobjects is None:
+            return []
         try:
             with self._lock:
                 return [self._metadata[x] for x in cbobjects]
@@ -84,3 +87,31 @@ class CoreBluetoothMetadata(object):
         with self._lock:
             if cbobject in self._metadata:
                 del self._metadata[cbobject]
+
+
+class CoreBluetoothDeviceMetadata(CoreBluetoothMetadata):
+    """Metadata of CBPeripherals (the device objects) that can also be looked
+    up by the device's id, which is how the advertisement store knows them.
+    """
+
+    def __init__(self):
+        super(CoreBluetoothDeviceMetadata, self).__init__()
+        self._by_id = {}
+
+    def get_by_id(self, id):
+        """Retrieve the device with the specified id, or None if unknown."""
+        with self._lock:
+            return self._by_id.get(id, None)
+
+    def add(self, cbobject, metadata):
+        with self._lock:
+            if cbobject not in self._metadata:
+                self._metadata[cbobject] = metadata
+                self._by_id[metadata._id] = metadata
+            return self._metadata[cbobject]
+
+    def remove(self, cbobject):
+        with self._lock:
+            metadata = self._metadata.pop(cbobject, None)
+            if metadata is not None and self._by_id.get(metadata._id) is metadata:
+                del self._by_id[metadata._id]
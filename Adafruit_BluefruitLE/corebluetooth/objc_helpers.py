@@ -21,10 +21,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import uuid
-from binascii import hexlify
 
 import objc
 
+from ..uuids import intern_uuid_bytes
+
 
 # Load CoreBluetooth bundle.
 objc.loadBundle("CoreBluetooth", globals(),
@@ -33,11 +34,8 @@ objc.loadBundle("CoreBluetooth", globals(),
 
 def cbuuid_to_uuid(cbuuid):
     """Convert Objective-C CBUUID type to native Python UUID type."""
-    data = cbuuid.data().bytes()
-
-    template = '{:0>8}-0000-1000-8000-00805f9b34fb' if len(data) <= 4 else '{:0>32}'
-    value = template.format(hexlify(data.tobytes()[:16]).decode('ascii'))
-    return uuid.UUID(hex=value)
+    # Short 16-bit and 32-bit UUIDs expand to the Bluetooth SIG base UUID.
+    return intern_uuid_bytes(cbuuid.data().bytes().tobytes())
 
 
 def uuid_to_cbuuid(uuid):
@@ -23,7 +23,6 @@
 from future.utils import raise_
 import logging
 import os
-from past.builtins import map
 import sys
 import subprocess
 import threading
@@ -32,10 +31,16 @@ import time
 import objc
 from PyObjCTools import AppHelper
 
+from ..advertisements import AdvertisementStore
+from ..cache_maintenance import choose_evictions
+from ..config import TIMEOUT_SEC
+from ..deadline import DeadlineExceeded, as_deadline
 from ..interfaces import Provider
+from .. import metrics
 from ..platform import get_provider
+from ..value_cache import services_changed
 
-from .metadata import CoreBluetoothMetadata
+from .metadata import CoreBluetoothDeviceMetadata, CoreBluetoothMetadata
 from .objc_helpers import uuid_to_cbuuid
 
 
@@ -91,15 +96,14 @@ class CentralDelegate(object):
         device = device_list().get(peripheral)
         if device is None:
             device = device_list().add(peripheral, CoreBluetoothDevice(peripheral))
-        device._update_advertised(data)
+        device._update_advertised(data, rssi)
 
     def centralManager_didConnectPeripheral_(self, manager, peripheral):
         """Called when a device is connected."""
         logger.debug('centralManager_didConnectPeripheral called')
-        # Setup peripheral delegate and kick off service discovery.  For now just
-        # assume all services need to be discovered.
+        # Setup peripheral delegate.  Services are discovered when the device's
+        # discover function is called, limited to the UUIDs it needs.
         peripheral.setDelegate_(self)
-        peripheral.discoverServices_(None)
         # Fire connected event for device.
         device = device_list().get(peripheral)
         if device is not None:
@@ -129,12 +133,27 @@ class CentralDelegate(object):
         # NOTE: For some reason the services parameter is never set to a good
         # value, instead you must query peripheral.services() to enumerate the
         # discovered services.
-        for service in peripheral.services():
+        device = device_list().get(peripheral)
+        char_filter = device._char_filter if device is not None else None
+        services = peripheral.services() or []
+        for service in services:
             if service_list().get(service) is None:
                 service_list().add(service, CoreBluetoothGattService(service))
-            # Kick off characteristic discovery for this service.  Just discover
-            # all characteristics for now.
-            peripheral.discoverCharacteristics_forService_(None, service)
+            # Kick off characteristic discovery for this service, only for the
+            # characteristics the device's discover call asked for.
+            peripheral.discoverCharacteristics_forService_(char_filter, service)
+        if len(services) == 0 and device is not None:
+            # None of the requested services exist, nothing more to discover.
+            device._discovered.set()
+
+    def peripheral_didModifyServices_(self, peripheral, invalidated_services):
+        """Called when a device's services changed."""
+        logger.debug('peripheral_didModifyServices called')
+        # Values cached for the device might be from the old services.
+        device = device_list().get(peripheral)
+        if device is not None:
+            device._services_modified()
+            services_changed(device.id)
 
     def peripheral_didDiscoverCharacteristicsForService_error_(self, peripheral, service, error):
         """Called when characteristics are discovered for a service."""
@@ -226,10 +245,13 @@ class CoreBluetoothProvider(Provider):
         # descriptors that are known to the system.  Extra metadata can be stored
         # with each item, like callbacks and events to fire when asyncronous BLE
         # events occur.
-        self._devices = CoreBluetoothMetadata()
+        self._devices = CoreBluetoothDeviceMetadata()
         self._services = CoreBluetoothMetadata()
         self._characteristics = CoreBluetoothMetadata()
         self._descriptors = CoreBluetoothMetadata()
+        # What each device advertised and when it was last seen.  Devices that
+        # stop advertising are dropped from the device cache when they expire.
+        self._advertisements = AdvertisementStore(on_expire=self._advertisement_expired)
 
     def initialize(self):
         """Initialize the BLE provider.  Must be called once before any other
@@ -242,7 +264,7 @@ class CoreBluetoothProvider(Provider):
         # Add any connected devices to list of known devices.
 
 
-    def run_mainloop_with(self, target):
+    def run_mainloop_with(self, target, on_mainloop=False):
         """Start the OS's main loop to process asyncronous BLE events and then
         run the specified target function in a background thread.  Target
         function should be a function that takes no parameters and optionally
@@ -250,6 +272,14 @@ class CoreBluetoothProvider(Provider):
         executing or returns with value then the main loop will be stopped and
         the program will exit with the returned code.
 
+        If on_mainloop is True the target is instead called directly from the
+        main loop as soon as it starts, without a background thread.  In this
+        mode the target must not block (so it can't call functions that wait
+        for BLE events, like connect) and is meant for programs driven by
+        callbacks: if it returns None the main loop keeps running to process
+        events until interrupted, otherwise the program exits with the returned
+        code.
+
         Note that an OS main loop is required to process asyncronous BLE events
         and this function is provided as a convenience for writing simple tools
         and scripts that don't need to be full-blown GUI applications.  If you
@@ -257,11 +287,15 @@ class CoreBluetoothProvider(Provider):
         on Linux, or a Cocoa main loop on OSX) then you don't need to call this
         function.
         """
-        # Create background thread to run user code.
-        self._user_thread = threading.Thread(target=self._user_thread_main,
-                                             args=(target,))
-        self._user_thread.daemon = True
-        self._user_thread.start()
+        if on_mainloop:
+            # Call the target from the main loop once it's running.
+            AppHelper.callAfter(self._mainloop_target, target)
+        else:
+            # Create background thread to run user code.
+            self._user_thread = threading.Thread(target=self._user_thread_main,
+                                                 args=(target,))
+            self._user_thread.daemon = True
+            self._user_thread.start()
         # Run main loop.  This call will never return!
         try:
             AppHelper.runConsoleEventLoop(installInterrupt=True)
@@ -269,6 +303,19 @@ class CoreBluetoothProvider(Provider):
             AppHelper.stopEventLoop()
             sys.exit(0)
 
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Running the main loop on a background thread is not supported on
+        Mac OSX.  CoreBluetooth delivers its events to the Cocoa main run loop,
+        which can only be run by the process's main thread.
+        """
+        raise RuntimeError('Running the main loop in a background thread is not supported on Mac OSX!')
+
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Running the main loop on a background thread is not supported on
+        Mac OSX, see start.
+        """
+        raise RuntimeError('Running the main loop in a background thread is not supported on Mac OSX!')
+
     def _user_thread_main(self, target):
         """Main entry point for the thread that will run user's code."""
         try:
@@ -283,6 +330,15 @@ class CoreBluetoothProvider(Provider):
             # Something went wrong.  Raise the exception on the main thread to exit.
             AppHelper.callAfter(self._raise_error, sys.exc_info())
 
+    def _mainloop_target(self, target):
+        """Run the user's target on the main loop."""
+        try:
+            return_code = target()
+            if return_code is not None:
+                sys.exit(return_code)
+        except Exception as ex:
+            self._raise_error(sys.exc_info())
+
     def _raise_error(self, exec_info):
         """Raise an exception from the provided exception info.  Used to cause
         the main thread to stop with an error.
@@ -299,6 +355,18 @@ class CoreBluetoothProvider(Provider):
         """Return a list of BLE devices known to the system."""
         return self._devices.list()
 
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        # Mac OSX identifies devices by a UUID it assigns instead of their
+        # address, and can retrieve the peripheral of any it has seen before.
+        identifier = objc.lookUpClass('NSUUID').alloc().initWithUUIDString_(str(address))
+        if identifier is None:
+            raise RuntimeError('{0} is not a Mac OSX device identifier!'.format(address))
+        peripherals = self._central_manager.retrievePeripheralsWithIdentifiers_([identifier])
+        if peripherals is None or len(peripherals) == 0:
+            raise RuntimeError('Unknown device {0}!'.format(address))
+        peripheral = peripherals[0]
+        return device_list().add(peripheral, CoreBluetoothDevice(peripheral))
+
     def clear_cached_data(self):
         """Clear the internal bluetooth device cache.  This is useful if a device
         changes its state like name and it can't be detected with the new state
@@ -318,17 +386,71 @@ class CoreBluetoothProvider(Provider):
             subprocess.call('rm ~/Library/Preferences/ByHost/com.apple.Bluetooth.*.plist',
                             shell=True, stdout=devnull, stderr=subprocess.STDOUT)
 
-    def disconnect_devices(self, service_uuids):
+    def _purge_cache(self, max_age_sec, max_devices, timeout_sec):
+        """Evict devices that aren't connected from the device cache by when
+        they last advertised.  CoreBluetooth's own cache can't be changed while
+        it runs, so only the provider's cache is purged.  Returns a tuple of the
+        number of devices evicted and remaining.
+        """
+        devices = list(self._devices.list())
+        seen = self._advertisements.last_seen_times([x._id for x in devices])
+        candidates = []
+        for device in devices:
+            if device.is_connected:
+                continue
+            candidates.append((seen[device._id], device))
+        evict = choose_evictions(candidates, len(devices), max_age_sec, max_devices, time.time())
+        for device in evict:
+            self._devices.remove(device._peripheral)
+            self._advertisements.remove(device._id)
+        return len(evict), len(devices) - len(evict)
+
+    def _advertisement_expired(self, record):
+        """Called when a device hasn't advertised within the advertisement TTL.
+        Removes it from the device cache, unless it's connected.
+        """
+        device = self._devices.get_by_id(record.key)
+        if device is not None:
+            if device.is_connected:
+                return False
+            self._devices.remove(device._peripheral)
+
+    def _call_later(self, delay_sec, callback):
+        """Call the callback once from the Cocoa main loop after delay_sec
+        seconds.
+        """
+        AppHelper.callLater(delay_sec, callback)
+
+    def disconnect_devices(self, service_uuids, timeout_sec=TIMEOUT_SEC):
         """Disconnect any connected devices that have any of the specified
-        service UUIDs.
+        service UUIDs.  Every device is disconnected at once and they share the
+        timeout.  Returns a dict of each matching device's id to None if it
+        disconnected, or the exception it failed with.
         """
         # Get list of connected devices with specified services.
-        cbuuids = map(uuid_to_cbuuid, service_uuids)
-        for device in self._central_manager.retrieveConnectedPeripheralsWithServices_(cbuuids):
-            self._central_manager.cancelPeripheralConnection_(device)
+        cbuuids = [uuid_to_cbuuid(x) for x in service_uuids]
+        deadline = as_deadline(timeout_sec)
+        devices = []
+        for peripheral in self._central_manager.retrieveConnectedPeripheralsWithServices_(cbuuids):
+            device = self._devices.add(peripheral, CoreBluetoothDevice(peripheral))
+            device._disconnected.clear()
+            self._central_manager.cancelPeripheralConnection_(peripheral)
+            devices.append(device)
+        # Wait for all the disconnected events together.
+        results = {}
+        for device in devices:
+            try:
+                deadline.wait(device._disconnected, 'Exceeded timeout waiting to disconnect from device!')
+                results[device.id] = None
+            except DeadlineExceeded as ex:
+                results[device.id] = ex
+            with metrics.operation('disconnect', _ADAPTER_ID, device._trace_id) as operation:
+                if results[device.id] is not None:
+                    operation.fail()
+        return results
 
 
 # Stop circular references by importing after classes that use these types.
 from .adapter import CoreBluetoothAdapter
 from .device import CoreBluetoothDevice
-from .gatt import CoreBluetoothGattService, CoreBluetoothGattCharacteristic, CoreBluetoothGattDescriptor
+from .gatt import CoreBluetoothGattService, CoreBluetoothGattCharacteristic, CoreBluetoothGattDescriptor, _ADAPTER_ID
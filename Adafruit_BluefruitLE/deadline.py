@@ -0,0 +1,188 @@
+# Deadlines shared by a chain of blocking BLE calls, with cancellation from
+# another thread.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import concurrent.futures
+import threading
+import time
+
+
+# Longest a wait blocks without checking whether its deadline was cancelled.
+_POLL_SEC = 0.05
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a blocking call runs out of time."""
+    pass
+
+
+class Cancelled(RuntimeError):
+    """Raised when a blocking call's deadline is cancelled."""
+    pass
+
+
+class Deadline(object):
+    """Time budget shared by a chain of blocking calls, like finding,
+    connecting to, discovering, and reading from a device.  Pass it anywhere the
+    library takes a timeout_sec and each call uses whatever is left of the
+    budget.  Calling cancel (from any thread) makes every call waiting on the
+    deadline, or that is later made with it, abort its pending operation and
+    raise Cancelled.  A timeout_sec of None never expires.
+    """
+
+    def __init__(self, timeout_sec=None):
+        self._expires = time.time() + timeout_sec if timeout_sec is not None else None
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        """Return True if the deadline was cancelled."""
+        return self._cancelled
+
+    @property
+    def expired(self):
+        """Return True if the deadline has passed."""
+        return self._expires is not None and time.time() >= self._expires
+
+    def remaining(self, default=None):
+        """Return the seconds left until the deadline, or default when it never
+        expires.
+        """
+        if self._expires is None:
+            return default
+        return max(0.0, self._expires - time.time())
+
+    def cancel(self):
+        """Cancel the deadline and abort the operations waiting on it."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def check(self, message='Exceeded timeout!'):
+        """Raise Cancelled if the deadline was cancelled or DeadlineExceeded
+        with the message if it has passed.
+        """
+        if self._cancelled:
+            raise Cancelled('Operation was cancelled!')
+        if self.expired:
+            raise DeadlineExceeded(message)
+
+    def wait(self, event, message='Exceeded timeout!'):
+        """Wait for the threading.Event to be set, raising DeadlineExceeded
+        with the message if the deadline passes first or Cancelled if it's
+        cancelled.
+        """
+        while not event.is_set():
+            self.check(message)
+            event.wait(min(_POLL_SEC, self.remaining(_POLL_SEC)))
+        return True
+
+    def wait_for(self, condition, predicate, message='Exceeded timeout!'):
+        """Wait on the threading.Condition (which must be held) until the
+        predicate returns True, raising like wait.
+        """
+        while not predicate():
+            self.check(message)
+            condition.wait(min(_POLL_SEC, self.remaining(_POLL_SEC)))
+        return True
+
+    def wait_future(self, future, message='Exceeded timeout!'):
+        """Return the result of the concurrent.futures.Future, cancelling it
+        and raising like wait if the deadline passes or is cancelled first.
+        """
+        while True:
+            try:
+                return future.result(min(_POLL_SEC, self.remaining(_POLL_SEC)))
+            except concurrent.futures.TimeoutError:
+                try:
+                    self.check(message)
+                except RuntimeError:
+                    future.cancel()
+                    raise
+
+    def sleep(self, seconds):
+        """Sleep for seconds, or less if the deadline passes first, raising
+        Cancelled if it's cancelled.
+        """
+        end = time.time() + min(seconds, self.remaining(seconds))
+        while True:
+            self.check_cancelled()
+            left = end - time.time()
+            if left <= 0:
+                return
+            time.sleep(min(_POLL_SEC, left))
+
+    def check_cancelled(self):
+        """Raise Cancelled if the deadline was cancelled."""
+        if self._cancelled:
+            raise Cancelled('Operation was cancelled!')
+
+    def on_cancel(self, callback):
+        """Return a context manager that calls the callback if the deadline is
+        cancelled while inside it.  Used to abort a pending operation, like
+        connecting, from the thread that cancels.
+        """
+        return _CancelCallback(self, callback)
+
+
+class _CancelCallback(object):
+    # Context manager registering a deadline's cancel callback.
+
+    def __init__(self, deadline, callback):
+        self._deadline = deadline
+        self._callback = callback
+
+    def __enter__(self):
+        deadline = self._deadline
+        with deadline._lock:
+            cancelled = deadline._cancelled
+            if not cancelled:
+                deadline._callbacks.append(self._callback)
+        if cancelled:
+            raise Cancelled('Operation was cancelled!')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        deadline = self._deadline
+        with deadline._lock:
+            if self._callback in deadline._callbacks:
+                deadline._callbacks.remove(self._callback)
+        if exc_type is not None and deadline._cancelled and \
+           not issubclass(exc_type, Cancelled):
+            # The operation failed because the callback aborted it.
+            raise Cancelled('Operation was cancelled!')
+        return False
+
+
+def as_deadline(timeout_sec):
+    """Return the Deadline for a timeout_sec argument: a Deadline is used as
+    is and seconds (or None for no limit) start a new one.
+    """
+    if isinstance(timeout_sec, Deadline):
+        return timeout_sec
+    return Deadline(timeout_sec)
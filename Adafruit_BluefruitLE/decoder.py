@@ -0,0 +1,170 @@
+# Batched decoding of fixed layout binary records received from characteristic
+# notifications into NumPy structured arrays.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+
+import numpy as np
+
+
+class RecordDecoder(object):
+    """Decoder stage that can be attached to a characteristic subscription to
+    turn a stream of notification payloads into NumPy structured arrays.  Each
+    payload is copied into a preallocated buffer and once batch_size records
+    have accumulated the whole buffer is converted with a single call to
+    np.frombuffer and passed to the on_batch callback.
+
+    The layout of a record is given by dtype, which can be anything accepted by
+    np.dtype, for example [('timestamp', '<u4'), ('x', '<i2'), ('y', '<i2')].
+    Payloads don't need to be aligned to record boundaries, a record split
+    across two notifications is reassembled.
+
+    Memory use is bounded by a ring of num_buffers reusable buffers.  The array
+    passed to on_batch is a view into one of those buffers and is only valid
+    until the ring wraps around to that buffer again, so call .copy() on it if
+    it needs to be kept for longer.
+
+    Typical usage:
+        decoder = RecordDecoder(layout, batch_size=64, on_batch=handle_samples)
+        characteristic.start_notify(decoder.feed)
+    """
+
+    def __init__(self, dtype, batch_size, on_batch, num_buffers=4):
+        """Create a decoder for records with the specified dtype layout.  The
+        on_batch callback is called with a structured array of up to batch_size
+        records every time a buffer fills up (or flush is called).
+        """
+        if batch_size < 1:
+            raise ValueError('Batch size must be at least one record!')
+        if num_buffers < 1:
+            raise ValueError('Must use at least one buffer!')
+        self._dtype = np.dtype(dtype)
+        self._record_size = self._dtype.itemsize
+        self._batch_size = batch_size
+        self._on_batch = on_batch
+        # Preallocate the ring of buffers that payloads are accumulated in.
+        size = self._record_size * batch_size
+        self._buffers = [bytearray(size) for i in range(num_buffers)]
+        self._index = 0
+        self._offset = 0
+        self._records = 0
+        self._batches = 0
+        # Feed is called by the main loop thread while flush can be called by
+        # the user's thread, so serialize access to the buffer state.
+        self._lock = threading.Lock()
+
+    @property
+    def dtype(self):
+        """Return the NumPy dtype of decoded records."""
+        return self._dtype
+
+    @property
+    def records_decoded(self):
+        """Return the total number of records emitted so far."""
+        return self._records
+
+    @property
+    def batches_decoded(self):
+        """Return the total number of batches emitted so far."""
+        return self._batches
+
+    @property
+    def pending_bytes(self):
+        """Return the number of received bytes not yet emitted in a batch."""
+        return self._offset
+
+    def feed(self, data):
+        """Add a notification payload to the decoder.  Designed to be passed
+        directly as the on_change callback of a characteristic's start_notify.
+        """
+        # Backends pass the value as bytes, a str of latin-1 characters is
+        # also accepted.  Get a buffer of raw bytes without
+        # touching each byte in Python.
+        if isinstance(data, bytearray) or isinstance(data, bytes):
+            view = memoryview(data)
+        elif isinstance(data, memoryview):
+            view = data.cast('B') if data.format != 'B' else data
+        else:
+            view = memoryview(data.encode('latin-1'))
+        batches = []
+        with self._lock:
+            position = 0
+            remaining = len(view)
+            while remaining > 0:
+                buf = self._buffers[self._index]
+                count = min(remaining, len(buf) - self._offset)
+                buf[self._offset:self._offset+count] = view[position:position+count]
+                self._offset += count
+                position += count
+                remaining -= count
+                if self._offset == len(buf):
+                    # Buffer is full, convert it and move to the next buffer.
+                    batches.append(self._emit(self._batch_size))
+                    # A payload longer than the whole ring is about to refill
+                    # the buffer of a batch not yet passed to on_batch, so
+                    # hand out a copy of that batch instead.
+                    wrapped = len(batches) - len(self._buffers)
+                    if wrapped >= 0 and remaining > 0:
+                        batches[wrapped] = batches[wrapped].copy()
+        # Call the user's callback outside the lock so it's free to call flush.
+        for batch in batches:
+            self._on_batch(batch)
+
+    def flush(self):
+        """Emit any complete records that are waiting in the current buffer
+        as a (possibly short) batch.  A trailing partial record is kept until
+        the rest of it is received.  Returns the number of records emitted.
+        """
+        with self._lock:
+            count = self._offset // self._record_size
+            if count == 0:
+                return 0
+            # Move any partial record to the start of the next buffer so it
+            # can be completed by the next payload.
+            used = count * self._record_size
+            leftover = self._buffers[self._index][used:self._offset]
+            batch = self._emit(count)
+            if len(leftover) > 0 and len(self._buffers) == 1:
+                # The leftover goes back into the only buffer, which the batch
+                # is a view of.
+                batch = batch.copy()
+            if len(leftover) > 0:
+                self._buffers[self._index][0:len(leftover)] = leftover
+                self._offset = len(leftover)
+        self._on_batch(batch)
+        return count
+
+    def reset(self):
+        """Drop any partially accumulated data."""
+        with self._lock:
+            self._offset = 0
+
+    def _emit(self, count):
+        # Convert the first count records of the current buffer into a
+        # structured array view and advance to the next buffer in the ring.
+        # Must be called with the lock held.
+        batch = np.frombuffer(self._buffers[self._index], dtype=self._dtype,
+                              count=count)
+        self._index = (self._index + 1) % len(self._buffers)
+        self._offset = 0
+        self._records += count
+        self._batches += 1
+        return batch
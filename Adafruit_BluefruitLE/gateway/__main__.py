@@ -0,0 +1,48 @@
+# Run the gateway daemon: python -m Adafruit_BluefruitLE.gateway [--socket path]
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import argparse
+import logging
+
+from .. import config
+from ..platform import get_provider
+from .server import GatewayServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Share BLE devices with other processes over a Unix domain socket.')
+    parser.add_argument('--socket', default=config.GATEWAY_SOCKET,
+                        help='path of the socket to listen on (default: {0})'.format(config.GATEWAY_SOCKET))
+    parser.add_argument('--verbose', action='store_true', help='log every failed request')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    if config.PROVIDER == 'gateway':
+        raise RuntimeError('The gateway daemon needs the platform BLE provider, unset ADAFRUIT_BLUEFRUITLE_PROVIDER!')
+    # The daemon owns the platform's provider and serves clients from a
+    # background thread while the provider runs its main loop.
+    ble = get_provider()
+    ble.initialize()
+    server = GatewayServer(ble, args.socket)
+    ble.run_mainloop_with(server.serve_forever)
+
+
+if __name__ == '__main__':
+    main()
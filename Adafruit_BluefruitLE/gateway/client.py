@@ -0,0 +1,446 @@
+# Client of the gateway daemon that implements the library's provider, adapter,
+# device, and GATT interfaces on top of the daemon's socket protocol.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import itertools
+import logging
+import socket
+import sys
+import threading
+
+from ..config import GATEWAY_SOCKET, TIMEOUT_SEC
+from ..deadline import Cancelled, DeadlineExceeded, as_deadline
+from ..interfaces import Provider, Adapter, Device
+from ..interfaces import GattService, GattCharacteristic, GattDescriptor
+
+from . import protocol
+
+
+logger = logging.getLogger(__name__)
+
+# Extra time to wait for the daemon's reply beyond the timeout of the operation
+# itself.
+_REPLY_MARGIN_SEC = 5
+
+
+def _seconds(deadline):
+    # Seconds the daemon may spend on a request with the deadline.  A deadline
+    # without a limit still gets the default timeout on the daemon's side.
+    return deadline.remaining(TIMEOUT_SEC)
+
+
+class _Reply(object):
+    # Slot a request waits on for its response.
+    __slots__ = ('event', 'frame_type', 'payload')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.frame_type = None
+        self.payload = None
+
+
+class GatewayConnection(object):
+    """Connection to the gateway daemon.  Any number of threads can send
+    requests at once, each waits for its own response.  Notifications are
+    dispatched to their callbacks from the connection's reader thread.
+    """
+
+    def __init__(self, path=GATEWAY_SOCKET):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._callbacks = {}
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_main, name='Gateway client reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def request(self, frame_type, values=(), timeout_sec=TIMEOUT_SEC):
+        """Send a request with the specified values and return the list of
+        values in the response.  Raises a RuntimeError with the daemon's
+        message if the request failed.  The timeout can be a Deadline, if it's
+        cancelled the daemon finishes the request but its response is ignored.
+        """
+        deadline = as_deadline(timeout_sec)
+        request_format, response_format = protocol.REQUESTS[frame_type]
+        reply = _Reply()
+        with self._send_lock:
+            if self._closed:
+                raise RuntimeError('Gateway connection is closed!')
+            request_id = next(self._ids)
+            self._pending[request_id] = reply
+            self._socket.sendall(protocol.frame(frame_type, request_id,
+                                                protocol.pack(request_format, values)))
+        try:
+            deadline.wait(reply.event, 'Exceeded timeout waiting for the gateway!')
+        except DeadlineExceeded:
+            # Give the daemon a moment to report its own timeout.
+            if not reply.event.wait(_REPLY_MARGIN_SEC):
+                self._pending.pop(request_id, None)
+                raise
+        except Cancelled:
+            self._pending.pop(request_id, None)
+            raise
+        if reply.frame_type == protocol.ERROR:
+            raise RuntimeError(protocol.unpack(protocol.ERROR_FORMAT, reply.payload)[0])
+        if reply.frame_type is None:
+            raise RuntimeError('Gateway connection was closed!')
+        return protocol.unpack(response_format, reply.payload)
+
+    def set_callback(self, handle, on_change):
+        """Call on_change with the value of each notification for the handle, or
+        stop calling it if on_change is None.
+        """
+        if on_change is None:
+            self._callbacks.pop(handle, None)
+        else:
+            self._callbacks[handle] = on_change
+
+    def close(self):
+        """Close the connection.  The daemon releases everything this client
+        was holding.
+        """
+        with self._send_lock:
+            self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (OSError, IOError):
+            pass
+        self._socket.close()
+
+    def _read_main(self):
+        # Route responses to their waiting requests and notifications to their
+        # callbacks.
+        buffer = bytearray()
+        while True:
+            try:
+                received = protocol.recv_frame(self._socket, buffer)
+            except (OSError, IOError):
+                received = None
+            if received is None:
+                break
+            frame_type, request_id, payload = received
+            if frame_type == protocol.NOTIFY:
+                handle, value = protocol.unpack(protocol.NOTIFY_FORMAT, payload)
+                on_change = self._callbacks.get(handle)
+                if on_change is not None:
+                    try:
+                        on_change(value)
+                    except Exception:
+                        logger.exception('Error in notification callback')
+                continue
+            reply = self._pending.pop(request_id, None)
+            if reply is not None:
+                reply.frame_type = frame_type
+                reply.payload = payload
+                reply.event.set()
+        # Wake up every request still waiting, they fail as closed.
+        with self._send_lock:
+            self._closed = True
+        for reply in list(self._pending.values()):
+            reply.event.set()
+        self._pending.clear()
+
+
+class GatewayProvider(Provider):
+    """Provider that uses the BLE adapters, connections, and GATT caches of a
+    gateway daemon (see GatewayServer) instead of talking to the platform's BLE
+    stack, so many processes can share devices.  Each process's connections,
+    scans, and subscriptions are reference counted by the daemon and released
+    when the process disconnects from it.
+    """
+
+    def __init__(self, path=GATEWAY_SOCKET):
+        self._path = path
+        self._connection = None
+
+    def initialize(self):
+        """Connect to the gateway daemon.  Calling it again after it succeeded
+        does nothing.
+        """
+        if self._connection is None:
+            self._connection = GatewayConnection(self._path)
+
+    def run_mainloop_with(self, target, on_mainloop=False):
+        """Run the target function and exit the program with the code it
+        returns.  The daemon runs the main loop, so the target is simply called
+        from this thread.
+        """
+        return_code = target()
+        sys.exit(return_code if return_code is not None else 0)
+
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Connect to the gateway daemon, which runs the main loop."""
+        self.initialize()
+
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Disconnect from the gateway daemon."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def list_adapters(self):
+        """Return a list with the gateway's adapter."""
+        return [GatewayAdapter(self._connection)]
+
+    def list_devices(self):
+        """Return a list of BLE devices known to the gateway."""
+        devices = self._connection.request(protocol.LIST_DEVICES)[0]
+        return [GatewayDevice(self._connection, address, name, advertised)
+                for address, name, rssi, connected, advertised in devices]
+
+    def clear_cached_data(self):
+        """Does nothing, the daemon owns the cached device data and it is
+        shared with other clients.
+        """
+        pass
+
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        # The daemon connects to devices it hasn't seen by their address.
+        device = GatewayDevice(self._connection, str(address), '', [])
+        device.connect(deadline)
+        return device
+
+    def disconnect_devices(self, service_uuids=[], timeout_sec=TIMEOUT_SEC):
+        """Release this client's connections to devices that have the
+        specified list of service UUIDs.  The daemon only disconnects a device
+        when no other client is using it.  The devices share the timeout.
+        Returns a dict of each matching device's id to None if it was released,
+        or the exception it failed with.
+        """
+        service_uuids = set(service_uuids)
+        deadline = as_deadline(timeout_sec)
+        results = {}
+        for device in self.list_devices():
+            if not device.is_connected:
+                continue
+            if set(device.advertised) | set([x.uuid for x in device.list_services()]) >= service_uuids:
+                try:
+                    device.disconnect(deadline)
+                    results[device.id] = None
+                except Exception as ex:
+                    results[device.id] = ex
+        return results
+
+
+class GatewayAdapter(Adapter):
+    """The gateway daemon's BLE adapter.  Scans are reference counted, the
+    adapter keeps scanning until every client that started a scan stopped it.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    @property
+    def name(self):
+        """Return the name of this BLE network adapter."""
+        return 'gateway'
+
+    def start_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Start scanning for BLE devices."""
+        deadline = as_deadline(timeout_sec)
+        self._connection.request(protocol.START_SCAN, (_seconds(deadline),), deadline)
+
+    def stop_scan(self, timeout_sec=TIMEOUT_SEC):
+        """Stop this client's scan."""
+        deadline = as_deadline(timeout_sec)
+        self._connection.request(protocol.STOP_SCAN, (_seconds(deadline),), deadline)
+
+    @property
+    def is_scanning(self):
+        """Return True if the gateway's adapter is scanning for devices."""
+        return self._connection.request(protocol.IS_SCANNING)[0]
+
+    def power_on(self):
+        """Not supported, the daemon manages the adapter's power."""
+        raise RuntimeError('The gateway daemon manages adapter power!')
+
+    def power_off(self):
+        """Not supported, the daemon manages the adapter's power."""
+        raise RuntimeError('The gateway daemon manages adapter power!')
+
+    @property
+    def is_powered(self):
+        """Return True, the daemon keeps its adapter powered."""
+        return True
+
+
+class GatewayDevice(Device):
+    """BLE device shared through the gateway daemon."""
+
+    def __init__(self, connection, address, name, advertised):
+        self._connection = connection
+        self._address = address
+        self._name = name
+        self._advertised = advertised
+
+    def connect(self, timeout_sec=TIMEOUT_SEC):
+        """Connect to the device, or share the daemon's existing connection."""
+        deadline = as_deadline(timeout_sec)
+        self._connection.request(protocol.CONNECT, (self._address, _seconds(deadline)), deadline)
+
+    def disconnect(self, timeout_sec=TIMEOUT_SEC):
+        """Release this client's use of the device.  The daemon disconnects
+        from it when no other client is using it.
+        """
+        deadline = as_deadline(timeout_sec)
+        self._connection.request(protocol.DISCONNECT, (self._address, _seconds(deadline)), deadline)
+
+    def list_services(self):
+        """Return a list of GattService objects that have been discovered for
+        this device.
+        """
+        services = self._connection.request(protocol.SERVICES, (self._address,))[0]
+        return [GatewayGattService(self._connection, service_uuid, chars)
+                for service_uuid, chars in services]
+
+    def discover(self, service_uuids, char_uuids, timeout_sec=TIMEOUT_SEC):
+        """Wait up to timeout_sec for the specified services and characteristics
+        to be discovered on the device.
+        """
+        deadline = as_deadline(timeout_sec)
+        return self._connection.request(protocol.DISCOVER,
+            (self._address, list(service_uuids), list(char_uuids), _seconds(deadline)),
+            deadline)[0]
+
+    def add_disconnect_callback(self, callback):
+        """Not supported, the daemon doesn't report disconnects to clients."""
+        raise NotImplementedError('The gateway does not report disconnects!')
+
+    @property
+    def advertised(self):
+        """Return a list of UUIDs for services that are advertised by this
+        device.
+        """
+        return self._advertised
+
+    @property
+    def id(self):
+        """Return the device's address (or unique ID on Mac OSX)."""
+        return self._address
+
+    @property
+    def name(self):
+        """Return the name of this device."""
+        return self._name
+
+    @property
+    def is_connected(self):
+        """Return True if the daemon is connected to the device."""
+        return self._connection.request(protocol.DEVICE_INFO, (self._address,))[2]
+
+    @property
+    def rssi(self):
+        """Return the RSSI signal strength in decibels."""
+        rssi = self._connection.request(protocol.DEVICE_INFO, (self._address,))[1]
+        return rssi if rssi != protocol.NO_RSSI else None
+
+
+class GatewayGattService(GattService):
+    """GATT service of a device shared through the gateway daemon."""
+
+    def __init__(self, connection, service_uuid, chars):
+        self._connection = connection
+        self._uuid = service_uuid
+        self._chars = chars
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT service."""
+        return self._uuid
+
+    def list_characteristics(self):
+        """Return list of GATT characteristics of this service."""
+        return [GatewayGattCharacteristic(self._connection, handle, char_uuid, descriptors)
+                for handle, char_uuid, descriptors in self._chars]
+
+
+class GatewayGattCharacteristic(GattCharacteristic):
+    """GATT characteristic of a device shared through the gateway daemon."""
+
+    def __init__(self, connection, handle, char_uuid, descriptors):
+        self._connection = connection
+        self._handle = handle
+        self._uuid = char_uuid
+        self._descriptors = descriptors
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT characteristic."""
+        return self._uuid
+
+    def read_value(self, timeout_sec=TIMEOUT_SEC):
+        """Read the value of this characteristic and return it as bytes."""
+        return self._connection.request(protocol.READ, (self._handle,), timeout_sec)[0]
+
+    def write_value(self, value, write_type=None, timeout_sec=TIMEOUT_SEC):
+        """Write the specified value to this characteristic, with an optional
+        write type (WRITE_WITH_RESPONSE or WRITE_WITHOUT_RESPONSE).
+        """
+        if isinstance(value, str):
+            value = value.encode('latin-1')
+        if write_type is None:
+            write_type = protocol.NO_WRITE_TYPE
+        self._connection.request(protocol.WRITE, (self._handle, bytes(value), write_type),
+                                 timeout_sec)
+
+    def start_notify(self, on_change, timeout_sec=TIMEOUT_SEC):
+        """Call on_change with the value (as bytes) of each notification of
+        this characteristic.  The daemon enables notifications once and shares
+        them with every subscribed client.  The callback is called from the
+        connection's reader thread.
+        """
+        self._connection.set_callback(self._handle, on_change)
+        try:
+            self._connection.request(protocol.SUBSCRIBE, (self._handle,), timeout_sec)
+        except Exception:
+            self._connection.set_callback(self._handle, None)
+            raise
+
+    def stop_notify(self, timeout_sec=TIMEOUT_SEC):
+        """Stop this client's notifications of this characteristic."""
+        self._connection.request(protocol.UNSUBSCRIBE, (self._handle,), timeout_sec)
+        self._connection.set_callback(self._handle, None)
+
+    def list_descriptors(self):
+        """Return list of GATT descriptors of this characteristic."""
+        return [GatewayGattDescriptor(self._connection, handle, desc_uuid)
+                for handle, desc_uuid in self._descriptors]
+
+
+class GatewayGattDescriptor(GattDescriptor):
+    """GATT descriptor of a device shared through the gateway daemon."""
+
+    def __init__(self, connection, handle, desc_uuid):
+        self._connection = connection
+        self._handle = handle
+        self._uuid = desc_uuid
+
+    @property
+    def uuid(self):
+        """Return the UUID of this GATT descriptor."""
+        return self._uuid
+
+    def read_value(self, timeout_sec=TIMEOUT_SEC):
+        """Read the value of this descriptor and return it as bytes."""
+        return self._connection.request(protocol.READ, (self._handle,), timeout_sec)[0]
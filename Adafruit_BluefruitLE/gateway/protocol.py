@@ -0,0 +1,220 @@
+# Binary protocol spoken between the gateway daemon and its clients over a
+# Unix domain socket.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Every frame is a 9 byte header followed by a payload:
+#   - payload length (uint32)
+#   - frame type (uint8): a request, RESPONSE, ERROR, or NOTIFY
+#   - request id (uint32): chosen by the client and echoed in the response so
+#     requests can be pipelined, 0 for notifications
+#
+# Payloads are a sequence of values described by a format string of these
+# codes (all little endian):
+#   ?  bool (1 byte)          i  int32
+#   I  uint32                 d  float64
+#   s  utf-8 string (uint16 length prefix)
+#   y  bytes (uint32 length prefix)
+#   U  UUID (16 bytes)
+#   [...]  list of the enclosed values (uint16 count prefix)
+import struct
+
+from ..uuids import intern_uuid_bytes
+
+
+HEADER = struct.Struct('<IBI')
+
+# Request frame types.
+LIST_DEVICES = 1
+START_SCAN   = 2
+STOP_SCAN    = 3
+IS_SCANNING  = 4
+CONNECT      = 5
+DISCONNECT   = 6
+DEVICE_INFO  = 7
+DISCOVER     = 8
+SERVICES     = 9
+READ         = 10
+WRITE        = 11
+SUBSCRIBE    = 12
+UNSUBSCRIBE  = 13
+
+# Reply and event frame types.
+RESPONSE = 0x80
+ERROR    = 0x81
+NOTIFY   = 0x82
+
+# Payload formats of each request and its response.  Devices are identified by
+# their address (or id on Mac OSX) and GATT characteristics and descriptors by
+# handles the daemon assigns when listing services.
+REQUESTS = {
+    #              request    response
+    LIST_DEVICES: ('',        '[ssi?[U]]'),   # address, name, rssi, connected, advertised
+    START_SCAN:   ('d',       ''),            # timeout
+    STOP_SCAN:    ('d',       ''),            # timeout
+    IS_SCANNING:  ('',        '?'),
+    CONNECT:      ('sd',      ''),            # address, timeout
+    DISCONNECT:   ('sd',      ''),            # address, timeout
+    DEVICE_INFO:  ('s',       'si?'),         # address -> name, rssi, connected
+    DISCOVER:     ('s[U][U]d', '?'),          # address, services, characteristics, timeout
+    SERVICES:     ('s',       '[U[IU[IU]]]'), # address -> services with characteristics and descriptors
+    READ:         ('I',       'y'),           # handle -> value
+    WRITE:        ('IyB',     ''),            # handle, value, write type
+    SUBSCRIBE:    ('I',       ''),            # handle
+    UNSUBSCRIBE:  ('I',       '')             # handle
+}
+ERROR_FORMAT  = 's'
+NOTIFY_FORMAT = 'Iy'   # handle, value
+
+# Value sent for an unknown RSSI and for an unspecified write type.
+NO_RSSI = -128
+NO_WRITE_TYPE = 255
+
+_FIXED = {
+    '?': struct.Struct('<?'),
+    'B': struct.Struct('<B'),
+    'i': struct.Struct('<i'),
+    'I': struct.Struct('<I'),
+    'd': struct.Struct('<d')
+}
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+
+# Cache of format strings split into their values.
+_split_cache = {}
+
+
+def _split(fmt):
+    # Split a format string into a list of the codes of each value, with the
+    # codes of a list's elements kept together like '[IU]'.
+    codes = _split_cache.get(fmt)
+    if codes is None:
+        codes = []
+        i = 0
+        while i < len(fmt):
+            if fmt[i] == '[':
+                depth = 0
+                for j in range(i, len(fmt)):
+                    depth += {'[': 1, ']': -1}.get(fmt[j], 0)
+                    if depth == 0:
+                        break
+                codes.append(fmt[i:j+1])
+                i = j + 1
+            else:
+                codes.append(fmt[i])
+                i += 1
+        _split_cache[fmt] = codes
+    return codes
+
+
+def _pack_value(code, value, out):
+    if code in _FIXED:
+        out.append(_FIXED[code].pack(value))
+    elif code == 's':
+        data = value.encode('utf-8')
+        out.append(_UINT16.pack(len(data)))
+        out.append(data)
+    elif code == 'y':
+        out.append(_UINT32.pack(len(value)))
+        out.append(bytes(value))
+    elif code == 'U':
+        out.append(value.bytes)
+    elif code[0] == '[':
+        elements = _split(code[1:-1])
+        out.append(_UINT16.pack(len(value)))
+        for item in value:
+            if len(elements) == 1:
+                item = (item,)
+            for element, x in zip(elements, item):
+                _pack_value(element, x, out)
+    else:
+        raise ValueError('Unknown format code: {0}'.format(code))
+
+
+def pack(fmt, values):
+    """Return the payload bytes for the list of values described by fmt."""
+    out = []
+    for code, value in zip(_split(fmt), values):
+        _pack_value(code, value, out)
+    return b''.join(out)
+
+
+def _unpack_value(code, data, offset):
+    if code in _FIXED:
+        fixed = _FIXED[code]
+        return fixed.unpack_from(data, offset)[0], offset + fixed.size
+    elif code == 's':
+        length = _UINT16.unpack_from(data, offset)[0]
+        offset += 2
+        return bytes(data[offset:offset+length]).decode('utf-8'), offset + length
+    elif code == 'y':
+        length = _UINT32.unpack_from(data, offset)[0]
+        offset += 4
+        return bytes(data[offset:offset+length]), offset + length
+    elif code == 'U':
+        return intern_uuid_bytes(data[offset:offset+16]), offset + 16
+    elif code[0] == '[':
+        elements = _split(code[1:-1])
+        count = _UINT16.unpack_from(data, offset)[0]
+        offset += 2
+        result = []
+        for i in range(count):
+            item = []
+            for element in elements:
+                value, offset = _unpack_value(element, data, offset)
+                item.append(value)
+            result.append(item[0] if len(elements) == 1 else tuple(item))
+        return result, offset
+    raise ValueError('Unknown format code: {0}'.format(code))
+
+
+def unpack(fmt, data):
+    """Return the list of values described by fmt from the payload bytes."""
+    values = []
+    offset = 0
+    for code in _split(fmt):
+        value, offset = _unpack_value(code, data, offset)
+        values.append(value)
+    return values
+
+
+def frame(frame_type, request_id, payload=b''):
+    """Return the bytes of a frame with the specified payload."""
+    return HEADER.pack(len(payload), frame_type, request_id) + payload
+
+
+def recv_frame(sock, buffer):
+    """Read the next frame from the socket, using buffer (a bytearray) to hold
+    data received past the end of it.  Returns a tuple of frame type, request
+    id, and payload bytes, or None if the socket was closed.
+    """
+    while True:
+        if len(buffer) >= HEADER.size:
+            length, frame_type, request_id = HEADER.unpack_from(buffer)
+            end = HEADER.size + length
+            if len(buffer) >= end:
+                payload = bytes(buffer[HEADER.size:end])
+                del buffer[:end]
+                return frame_type, request_id, payload
+        data = sock.recv(65536)
+        if not data:
+            return None
+        buffer.extend(data)
@@ -0,0 +1,378 @@
+# Gateway daemon that owns the BLE provider and shares its adapters,
+# connections, and notification streams with client processes over a Unix
+# domain socket.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import os
+import queue
+import socketserver
+import threading
+
+from ..config import GATEWAY_SOCKET
+from ..platform import get_provider
+
+from . import protocol
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of frames waiting to be sent to a client.  Notifications for
+# a client that falls further behind are dropped instead of stalling the main
+# loop and every other client.
+_MAX_PENDING = 4096
+
+
+def _to_bytes(value):
+    # Convert a value from the provider (bytes, a string of bytes, or a list
+    # of ints like a dbus.Array) to bytes.
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('latin-1')
+    return bytes(bytearray(value))
+
+
+def _property(getter, default):
+    # Read a device property that might not be available.
+    try:
+        value = getter()
+    except Exception:
+        return default
+    return value if value is not None else default
+
+
+class _Session(object):
+    # State of one connected client.  Frames are sent by a writer thread so a
+    # slow client never blocks the thread that produced them.
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.connections = set()
+        self.subscriptions = set()
+        self.scanning = False
+        self.dropped = 0
+        self._outgoing = queue.Queue(_MAX_PENDING)
+        self._writer = threading.Thread(target=self._write_main, name='Gateway client writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def send(self, data, droppable=False):
+        if droppable:
+            try:
+                self._outgoing.put_nowait(data)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self._outgoing.put(data)
+
+    def close(self):
+        self._outgoing.put(None)
+
+    def _write_main(self):
+        while True:
+            data = self._outgoing.get()
+            if data is None:
+                break
+            try:
+                self.sock.sendall(data)
+            except (OSError, IOError):
+                break
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    # Reads request frames from one client and dispatches them to the gateway.
+
+    def setup(self):
+        self.session = _Session(self.request)
+
+    def handle(self):
+        buffer = bytearray()
+        while True:
+            received = protocol.recv_frame(self.request, buffer)
+            if received is None:
+                break
+            self.server.gateway._handle_frame(self.session, *received)
+
+    def finish(self):
+        self.server.gateway._release(self.session)
+        self.session.close()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class GatewayServer(object):
+    """Daemon that owns the BLE provider (the platform's provider by default)
+    and serves scan, connect, discovery, read, write, and subscribe requests
+    from any number of client processes on a Unix domain socket.  Connections,
+    scans, and notification subscriptions are reference counted across
+    clients: a device stays connected while any client uses it and a
+    notification is enabled once and sent to every subscribed client.  When a
+    client goes away everything it held is released.
+
+    The provider must already be initialized and have its main loop running
+    (see run_mainloop_with or start).
+    """
+
+    def __init__(self, provider=None, path=GATEWAY_SOCKET):
+        self._provider = provider if provider is not None else get_provider()
+        self._path = path
+        # Guards the bookkeeping below and is never held during a call to the
+        # provider, those are serialized by the scan, device, and handle locks
+        # instead so a slow device doesn't hold up every other client.
+        self._lock = threading.RLock()
+        self._devices = {}
+        self._device_locks = {}
+        self._connections = {}
+        self._scanners = set()
+        self._scan_lock = threading.Lock()
+        # GATT objects handed out to clients, by handle and by the key of
+        # device address and UUIDs that identifies them across listings.
+        self._handles = {}
+        self._handle_keys = {}
+        self._subscribers = {}
+        self._handle_locks = {}
+        self._server = None
+        self._requests = {
+            protocol.LIST_DEVICES: self._list_devices,
+            protocol.START_SCAN:   self._start_scan,
+            protocol.STOP_SCAN:    self._stop_scan,
+            protocol.IS_SCANNING:  self._is_scanning,
+            protocol.CONNECT:      self._connect,
+            protocol.DISCONNECT:   self._disconnect,
+            protocol.DEVICE_INFO:  self._device_info,
+            protocol.DISCOVER:     self._discover,
+            protocol.SERVICES:     self._services,
+            protocol.READ:         self._read,
+            protocol.WRITE:        self._write,
+            protocol.SUBSCRIBE:    self._subscribe,
+            protocol.UNSUBSCRIBE:  self._unsubscribe
+        }
+
+    def serve_forever(self):
+        """Listen on the socket and serve clients until shutdown is called."""
+        if os.path.exists(self._path):
+            # Remove the socket left behind by a previous daemon.
+            os.unlink(self._path)
+        self._server = _Server(self._path, _Handler)
+        self._server.gateway = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def shutdown(self):
+        """Stop serve_forever, from another thread."""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _handle_frame(self, session, frame_type, request_id, payload):
+        # Run a request and send back its response or error.
+        try:
+            request_format, response_format = protocol.REQUESTS[frame_type]
+            result = self._requests[frame_type](session, *protocol.unpack(request_format, payload))
+            reply = protocol.frame(protocol.RESPONSE, request_id,
+                                   protocol.pack(response_format, result or ()))
+        except Exception as ex:
+            logger.debug('Gateway request {0} failed: {1}'.format(frame_type, ex))
+            reply = protocol.frame(protocol.ERROR, request_id,
+                                   protocol.pack(protocol.ERROR_FORMAT, ('{0}'.format(ex),)))
+        session.send(reply)
+
+    def _release(self, session):
+        # Release everything a client that went away was holding.
+        for handle in list(session.subscriptions):
+            self._ignore_errors(self._unsubscribe, session, handle)
+        for address in list(session.connections):
+            self._ignore_errors(self._disconnect, session, address, 10)
+        if session.scanning:
+            self._ignore_errors(self._stop_scan, session, 10)
+
+    def _ignore_errors(self, function, *args):
+        try:
+            function(*args)
+        except Exception as ex:
+            logger.warning('Error releasing gateway client: {0}'.format(ex))
+
+    def _device(self, address):
+        # Return the provider's device object with the address.
+        with self._lock:
+            device = self._devices.get(address)
+        if device is not None:
+            return device
+        for x in self._provider.list_devices():
+            if str(x.id) == address:
+                device = x
+                break
+        if device is None:
+            raise RuntimeError('Unknown device {0}!'.format(address))
+        with self._lock:
+            self._device_locks.setdefault(address, threading.Lock())
+            return self._devices.setdefault(address, device)
+
+    def _handle(self, handle):
+        obj = self._handles.get(handle)
+        if obj is None:
+            raise RuntimeError('Unknown GATT handle {0}!'.format(handle))
+        return obj
+
+    def _handle_for(self, key, obj):
+        # Return the handle of a GATT object, assigning a new one the first time
+        # it's listed.
+        with self._lock:
+            handle = self._handle_keys.get(key)
+            if handle is None:
+                handle = len(self._handle_keys) + 1
+                self._handle_keys[key] = handle
+            if handle not in self._subscribers:
+                # Keep using the object notifications were enabled on.
+                self._handles[handle] = obj
+            return handle
+
+    def _list_devices(self, session):
+        devices = []
+        for device in self._provider.list_devices():
+            with self._lock:
+                self._devices.setdefault(str(device.id), device)
+                self._device_locks.setdefault(str(device.id), threading.Lock())
+            devices.append((str(device.id),
+                            _property(lambda: device.name, ''),
+                            _property(lambda: device.rssi, protocol.NO_RSSI),
+                            _property(lambda: device.is_connected, False),
+                            _property(lambda: device.advertised, [])))
+        return (devices,)
+
+    def _start_scan(self, session, timeout_sec):
+        with self._scan_lock:
+            if len(self._scanners) == 0:
+                self._provider.get_default_adapter().start_scan(timeout_sec)
+            with self._lock:
+                self._scanners.add(session)
+            session.scanning = True
+
+    def _stop_scan(self, session, timeout_sec):
+        with self._scan_lock:
+            with self._lock:
+                self._scanners.discard(session)
+                stop = len(self._scanners) == 0
+            session.scanning = False
+            if stop:
+                self._provider.get_default_adapter().stop_scan(timeout_sec)
+
+    def _is_scanning(self, session):
+        return (self._provider.get_default_adapter().is_scanning,)
+
+    def _connect(self, session, address, timeout_sec):
+        try:
+            device = self._device(address)
+        except RuntimeError:
+            # A device the daemon hasn't seen, connect straight to its address.
+            device = self._provider.connect_address(address, timeout_sec=timeout_sec)
+            with self._lock:
+                device = self._devices.setdefault(address, device)
+                self._device_locks.setdefault(address, threading.Lock())
+        with self._device_locks[address]:
+            if not device.is_connected:
+                device.connect(timeout_sec)
+            self._connections.setdefault(address, set()).add(session)
+            session.connections.add(address)
+
+    def _disconnect(self, session, address, timeout_sec):
+        device = self._device(address)
+        with self._device_locks[address]:
+            users = self._connections.get(address, set())
+            users.discard(session)
+            session.connections.discard(address)
+            # Only disconnect when no other client is using the device.
+            if len(users) == 0 and device.is_connected:
+                device.disconnect(timeout_sec)
+
+    def _device_info(self, session, address):
+        device = self._device(address)
+        return (_property(lambda: device.name, ''),
+                _property(lambda: device.rssi, protocol.NO_RSSI),
+                _property(lambda: device.is_connected, False))
+
+    def _discover(self, session, address, service_uuids, char_uuids, timeout_sec):
+        return (bool(self._device(address).discover(service_uuids, char_uuids, timeout_sec)),)
+
+    def _services(self, session, address):
+        services = []
+        for service in self._device(address).list_services():
+            chars = []
+            for char in service.list_characteristics():
+                key = (address, service.uuid, char.uuid)
+                descriptors = [(self._handle_for(key + (x.uuid,), x), x.uuid)
+                               for x in char.list_descriptors()]
+                chars.append((self._handle_for(key, char), char.uuid, descriptors))
+            services.append((service.uuid, chars))
+        return (services,)
+
+    def _read(self, session, handle):
+        return (_to_bytes(self._handle(handle).read_value()),)
+
+    def _write(self, session, handle, value, write_type):
+        char = self._handle(handle)
+        if write_type == protocol.NO_WRITE_TYPE:
+            char.write_value(value)
+        else:
+            char.write_value(value, write_type=write_type)
+
+    def _handle_lock(self, handle):
+        # Return the lock that serializes enabling and disabling notifications
+        # of a handle.
+        with self._lock:
+            return self._handle_locks.setdefault(handle, threading.Lock())
+
+    def _subscribe(self, session, handle):
+        char = self._handle(handle)
+        with self._handle_lock(handle):
+            if handle not in self._subscribers:
+                char.start_notify(lambda value: self._notify(handle, value))
+            with self._lock:
+                self._subscribers.setdefault(handle, set()).add(session)
+                session.subscriptions.add(handle)
+
+    def _unsubscribe(self, session, handle):
+        with self._handle_lock(handle):
+            with self._lock:
+                subscribers = self._subscribers.get(handle, set())
+                subscribers.discard(session)
+                session.subscriptions.discard(handle)
+                char = None
+                if len(subscribers) == 0 and handle in self._subscribers:
+                    # Grab the object notifications were enabled on before a
+                    # new listing can replace it.
+                    char = self._handle(handle)
+                    del self._subscribers[handle]
+            if char is not None:
+                char.stop_notify()
+
+    def _notify(self, handle, value):
+        # Encode the notification once and queue it for every subscriber.
+        data = protocol.frame(protocol.NOTIFY, 0,
+                              protocol.pack(protocol.NOTIFY_FORMAT, (handle, _to_bytes(value))))
+        for session in list(self._subscribers.get(handle, ())):
+            session.send(data, droppable=True)
@@ -0,0 +1,206 @@
+# Immutable snapshot of a device's GATT table: its services, characteristics,
+# and descriptors as plain tuples that can be searched, serialized, cached,
+# and compared without talking to the device or the Bluetooth stack.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+
+from .uuids import intern_uuid
+
+
+# Names of the characteristic property bits, in bit order, as bluez reports
+# them in a characteristic's Flags.
+PROPERTY_FLAGS = ('broadcast', 'read', 'write-without-response', 'write',
+                  'notify', 'indicate', 'authenticated-signed-writes',
+                  'extended-properties')
+
+_SERVICE_INTERFACE        = 'org.bluez.GattService1'
+_CHARACTERISTIC_INTERFACE = 'org.bluez.GattCharacteristic1'
+_DESCRIPTOR_INTERFACE     = 'org.bluez.GattDescriptor1'
+
+
+DescriptorNode = collections.namedtuple('DescriptorNode', 'uuid handle')
+
+CharacteristicNode = collections.namedtuple('CharacteristicNode', 'uuid handle flags descriptors')
+
+ServiceNode = collections.namedtuple('ServiceNode', 'uuid handle primary characteristics')
+
+
+def flags_from_properties(properties):
+    """Return the tuple of flag names for a characteristic properties bit
+    mask (like CoreBluetooth's CBCharacteristicProperties).
+    """
+    return tuple(x for i, x in enumerate(PROPERTY_FLAGS) if properties & (1 << i))
+
+
+class GattSnapshot(collections.namedtuple('GattSnapshot', 'services')):
+    """GATT table of a device at one moment.  Services is a tuple of
+    ServiceNode, each with a tuple of CharacteristicNode, each with a tuple of
+    DescriptorNode.  Every node has its UUID and attribute handle (None when
+    the platform doesn't report handles), characteristics have a tuple of
+    flag names like 'read' and 'notify' (see PROPERTY_FLAGS), and services
+    have whether they're primary.  Nodes are sorted by handle when handles are
+    known.
+    """
+    __slots__ = ()
+
+    @property
+    def node_count(self):
+        """Return the number of services, characteristics, and descriptors."""
+        return sum(1 + len(x.characteristics) + sum(len(y.descriptors) for y in x.characteristics)
+                   for x in self.services)
+
+    def find_service(self, service_uuid):
+        """Return the first service with the UUID, or None if not found."""
+        for service in self.services:
+            if service.uuid == service_uuid:
+                return service
+        return None
+
+    def find_characteristic(self, char_uuid, service_uuid=None):
+        """Return the first characteristic with the UUID, only looking in
+        services with service_uuid if it's specified.  Returns None if not found.
+        """
+        for service in self.services:
+            if service_uuid is not None and service.uuid != service_uuid:
+                continue
+            for char in service.characteristics:
+                if char.uuid == char_uuid:
+                    return char
+        return None
+
+    def uuids(self):
+        """Return a tuple of the set of service UUIDs and the set of
+        characteristic UUIDs in the snapshot.
+        """
+        return (set(x.uuid for x in self.services),
+                set(y.uuid for x in self.services for y in x.characteristics))
+
+    def to_list(self):
+        """Return the snapshot as nested lists of strings, ints, and bools that
+        can be written with json or similar.  from_list turns it back into a
+        snapshot.
+        """
+        return [[str(service.uuid), service.handle, service.primary,
+                 [[str(char.uuid), char.handle, list(char.flags),
+                   [[str(desc.uuid), desc.handle] for desc in char.descriptors]]
+                  for char in service.characteristics]]
+                for service in self.services]
+
+    @classmethod
+    def from_list(cls, data):
+        """Return the snapshot saved by to_list."""
+        return cls(tuple(
+            ServiceNode(intern_uuid(service[0]), service[1], service[2], tuple(
+                CharacteristicNode(intern_uuid(char[0]), char[1], tuple(char[2]), tuple(
+                    DescriptorNode(intern_uuid(desc[0]), desc[1]) for desc in char[3]))
+                for char in service[3]))
+            for service in data))
+
+    def diff(self, other):
+        """Compare with a newer snapshot.  Returns a tuple of lists of the keys
+        of the nodes added, removed, and changed (a different handle, flags, or
+        primary) in other.  A node's key is the tuple of UUIDs from its service
+        down to it, like (service UUID, characteristic UUID).
+        """
+        before = self._nodes()
+        after = other._nodes()
+        added = [x for x in after if x not in before]
+        removed = [x for x in before if x not in after]
+        changed = [x for x in after if x in before and after[x] != before[x]]
+        return added, removed, changed
+
+    def _nodes(self):
+        # Return an ordered dict of node key to the node's attributes other
+        # than its UUID and children.
+        nodes = collections.OrderedDict()
+        for service in self.services:
+            key = (service.uuid,)
+            nodes.setdefault(key, (service.handle, service.primary))
+            for char in service.characteristics:
+                char_key = key + (char.uuid,)
+                nodes.setdefault(char_key, (char.handle, char.flags))
+                for desc in char.descriptors:
+                    nodes.setdefault(char_key + (desc.uuid,), (desc.handle,))
+        return nodes
+
+
+def from_device(device):
+    """Build a snapshot by walking a device's live GATT objects.  This is the
+    fallback for platforms without a cheaper way to read the whole table, it
+    has no handles or flags.
+    """
+    return GattSnapshot(tuple(
+        ServiceNode(service.uuid, None, True, tuple(
+            CharacteristicNode(char.uuid, None, (), tuple(
+                DescriptorNode(desc.uuid, None) for desc in char.list_descriptors()))
+            for char in service.list_characteristics()))
+        for service in device.list_services()))
+
+
+def _handle(path, props):
+    # Bluez reports the attribute handle as a property in newer versions,
+    # otherwise it's the hex number that ends the object's path (like
+    # .../service0010/char0011).
+    handle = props.get('Handle')
+    if handle:
+        return int(handle)
+    try:
+        return int(path[-4:], 16)
+    except ValueError:
+        return None
+
+
+def from_bluez_objects(device_path, objects):
+    """Build the snapshot of the device at device_path from the dict of path
+    to interfaces to properties returned by bluez's GetManagedObjects.
+    """
+    prefix = device_path + '/'
+    services = {}
+    chars = {}
+    descs = {}
+    for path, interfaces in objects.items():
+        path = str(path)
+        if not path.startswith(prefix):
+            continue
+        if _SERVICE_INTERFACE in interfaces:
+            services[path] = interfaces[_SERVICE_INTERFACE]
+        elif _CHARACTERISTIC_INTERFACE in interfaces:
+            chars[path] = interfaces[_CHARACTERISTIC_INTERFACE]
+        elif _DESCRIPTOR_INTERFACE in interfaces:
+            descs[path] = interfaces[_DESCRIPTOR_INTERFACE]
+    # Group children under the path of their parent, in handle order.
+    children = {}
+    for path in sorted(descs):
+        props = descs[path]
+        children.setdefault(path.rsplit('/', 1)[0], []).append(
+            DescriptorNode(intern_uuid(props['UUID']), _handle(path, props)))
+    for path in sorted(chars):
+        props = chars[path]
+        children.setdefault(path.rsplit('/', 1)[0], []).append(
+            CharacteristicNode(intern_uuid(props['UUID']), _handle(path, props),
+                               tuple(str(x) for x in props.get('Flags', [])),
+                               tuple(children.get(path, ()))))
+    return GattSnapshot(tuple(
+        ServiceNode(intern_uuid(services[path]['UUID']), _handle(path, services[path]),
+                    bool(services[path].get('Primary', True)), tuple(children.get(path, ())))
+        for path in sorted(services)))
@@ -2,3 +2,4 @@ from .provider import Provider
 from .adapter import Adapter
 from .device import Device
 from .gatt import GattService, GattCharacteristic, GattDescriptor
+from .gatt import WRITE_WITH_RESPONSE, WRITE_WITHOUT_RESPONSE
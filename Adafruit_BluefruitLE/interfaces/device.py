@@ -23,6 +23,8 @@
 # SOFTWARE.
 import abc
 
+from ..config import TIMEOUT_SEC
+
 
 class Device(object):
     """Base class for a BLE device."""
@@ -50,6 +52,8 @@ class Device(object):
         """Wait up to timeout_sec for the specified services and characteristics
         to be discovered on the device.  If the timeout is exceeded without
         discovering the services and characteristics then an exception is thrown.
+        Providers that can limit discovery only discover the listed UUIDs, an
+        empty list means every service or characteristic.
         """
         raise NotImplementedError
 
@@ -84,6 +88,59 @@ class Device(object):
         """Return the RSSI signal strength in decibels."""
         raise NotImplementedError
 
+    def read_rssi(self, timeout_sec=TIMEOUT_SEC):
+        """Return the RSSI signal strength in decibels, waiting up to
+        timeout_sec for platforms that have to read it from the device.
+        """
+        return self.rssi
+
+    def gatt_snapshot(self):
+        """Return an immutable GattSnapshot of the services, characteristics,
+        and descriptors discovered for this device (see gatt_snapshot.py).
+        Providers that can read the whole GATT table at once build it in one
+        call, otherwise it walks the device's GATT objects.
+        """
+        from ..gatt_snapshot import from_device
+        return from_device(self)
+
+    def bind(self, *service_classes, **kwargs):
+        """Discover everything the service classes (ServiceBase subclasses)
+        need in one pass and return a list with an instance of each, like
+        uart, info = device.bind(UART, DeviceInformation).  With no classes
+        every registered service the device has is bound.  Takes an optional
+        timeout_sec keyword argument (TIMEOUT_SEC by default).
+        """
+        from ..services.servicebase import bind_services
+        return bind_services(self, service_classes, kwargs.pop('timeout_sec', TIMEOUT_SEC))
+
+    def add_disconnect_callback(self, callback):
+        """Call callback (with no arguments) whenever the connection to the
+        device is closed or lost.  Callbacks are called from the provider's
+        main loop so they must return quickly.
+        """
+        self._disconnect_callbacks().append(callback)
+
+    def remove_disconnect_callback(self, callback):
+        """Stop calling a callback added with add_disconnect_callback."""
+        callbacks = self._disconnect_callbacks()
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _disconnect_callbacks(self):
+        # List of disconnect callbacks, created the first time it's used.
+        # Providers that create a new device object for each lookup keep the
+        # list somewhere that outlives the object.
+        callbacks = self.__dict__.get('_disconnect_callback_list')
+        if callbacks is None:
+            callbacks = self.__dict__.setdefault('_disconnect_callback_list', [])
+        return callbacks
+
+    def _fire_disconnected(self):
+        # Call the disconnect callbacks, called by providers when the device
+        # disconnects.
+        for callback in list(self._disconnect_callbacks()):
+            callback()
+
     def find_service(self, uuid):
         """Return the first child service found that has the specified
         UUID.  Will return None if no service that matches is found.
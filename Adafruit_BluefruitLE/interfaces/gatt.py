@@ -24,6 +24,14 @@
 # SOFTWARE.
 import abc
 
+from ..config import TIMEOUT_SEC
+
+
+# Types of characteristic writes.  A write with response waits for the device to
+# acknowledge it, a write without response (a write command) doesn't.
+WRITE_WITH_RESPONSE    = 0
+WRITE_WITHOUT_RESPONSE = 1
+
 
 class GattService(object):
     """Base class for a BLE GATT service."""
@@ -61,29 +69,57 @@ class GattCharacteristic(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def read_value(self):
-        """Read the value of this characteristic."""
+    def read_value(self, timeout_sec=TIMEOUT_SEC):
+        """Read the value of this characteristic, waiting up to timeout_sec.
+        Providers that schedule GATT operations take a priority after it.
+        """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def write_value(self, value):
-        """Write the specified value to this characteristic."""
+    def write_value(self, value, write_type=None, timeout_sec=TIMEOUT_SEC):
+        """Write the specified value to this characteristic with write_type
+        (WRITE_WITH_RESPONSE, WRITE_WITHOUT_RESPONSE, or None for the
+        provider's default), waiting up to timeout_sec.  Providers that schedule GATT operations take a priority
+        after it.
+        """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def start_notify(self, on_change):
+    def start_notify(self, on_change, timeout_sec=TIMEOUT_SEC):
         """Enable notification of changes for this characteristic on the
         specified on_change callback.  on_change should be a function that takes
-        one parameter which is the value (as a string of bytes) of the changed
-        characteristic value.
+        one parameter which is the value (as bytes) of the changed
+        characteristic value.  Waits up to timeout_sec for notifications to be
+        enabled.
         """
         raise NotImplementedError
 
     @abc.abstractmethod
-    def stop_notify(self):
-        """Disable notification of changes for this characteristic."""
+    def stop_notify(self, timeout_sec=TIMEOUT_SEC):
+        """Disable notification of changes for this characteristic, waiting up
+        to timeout_sec.
+        """
         raise NotImplementedError
 
+    def stream_write_type(self, timeout_sec=TIMEOUT_SEC):
+        """Return the write type to stream data to this characteristic with,
+        for services like the UART that send a lot of small writes.  The
+        default is None, the provider's usual write type.  Providers with a
+        faster path for writes without response (like bluez's acquired write
+        socket) return WRITE_WITHOUT_RESPONSE when it's available.
+        """
+        return None
+
+    def release_notify(self):
+        """Forget the notification callback of this characteristic without
+        talking to the device, for when the link was lost (which already
+        stopped notifications).  Call it before subscribing again on a new
+        characteristic object after reconnecting.  Providers that keep one
+        callback per characteristic replace it on the next start_notify, so by
+        default this does nothing.
+        """
+        pass
+
     @abc.abstractmethod
     def list_descriptors(self):
         """Return list of GATT descriptors that have been discovered for this
@@ -111,6 +147,6 @@ class GattDescriptor(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def read_value(self):
-        """Read the value of this descriptor."""
+    def read_value(self, timeout_sec=TIMEOUT_SEC):
+        """Read the value of this descriptor, waiting up to timeout_sec."""
         raise NotImplementedError
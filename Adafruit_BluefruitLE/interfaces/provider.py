@@ -31,6 +31,8 @@ import abc
 import time
 
 from ..config import TIMEOUT_SEC
+from ..deadline import Cancelled, as_deadline
+from .. import tracing
 
 
 class Provider(object):
@@ -45,7 +47,7 @@ class Provider(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def run_mainloop_with(self, target):
+    def run_mainloop_with(self, target, on_mainloop=False):
         """Start the OS's main loop to process asyncronous BLE events and then
         run the specified target function in a background thread.  Target
         function should be a function that takes no parameters and optionally
@@ -53,6 +55,12 @@ class Provider(object):
         executing or returns with value then the main loop will be stopped and
         the program will exit with the returned code.
 
+        If on_mainloop is True the target is instead called directly from the
+        main loop as soon as it starts, without a background thread.  In this
+        mode the target must not block and is meant for programs driven by
+        callbacks: if it returns None the main loop keeps running to process
+        events, otherwise the program exits with the returned code.
+
         Note that an OS main loop is required to process asyncronous BLE events
         and this function is provided as a convenience for writing simple tools
         and scripts that don't need to be full-blown GUI applications.  If you
@@ -62,6 +70,25 @@ class Provider(object):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def start(self, timeout_sec=TIMEOUT_SEC):
+        """Start running the OS's main loop on a background thread that is
+        managed by the provider, as an alternative to run_mainloop_with for
+        applications that need to keep their main thread (like servers with
+        their own event loop).  Can be called by several independent clients in
+        the same process, the main loop keeps running until each call to start
+        has been matched by a call to stop.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stop(self, timeout_sec=TIMEOUT_SEC):
+        """Release a main loop started with start.  When the last client
+        releases it the main loop is stopped and its thread is joined before
+        returning.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def list_adapters(self):
         """Return a list of BLE adapter objects connected to the system."""
@@ -80,9 +107,139 @@ class Provider(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def disconnect_devices(self, service_uuids):
+    def disconnect_devices(self, service_uuids, timeout_sec=TIMEOUT_SEC):
         """Disconnect any connected devices that have any of the specified
-        service UUIDs.
+        service UUIDs, waiting up to timeout_sec for all of them.  Returns a
+        dict of each matching device's id to None if it disconnected, or the
+        exception it failed with.
+        """
+        raise NotImplementedError
+
+    def monitor_loop(self, interval_sec=None, threshold_sec=None):
+        """Start measuring the lag of the provider's main loop with a timer
+        that fires every interval_sec seconds, logging lags over threshold_sec
+        (by default the LOOP_MONITOR_INTERVAL_SEC and SLOW_HANDLER_SEC config
+        values).  Returns the running LoopMonitor, call its stop function to
+        stop measuring.  The main loop must be running.
+        """
+        from ..loop_monitor import LoopMonitor
+        from ..config import LOOP_MONITOR_INTERVAL_SEC, SLOW_HANDLER_SEC
+        monitor = LoopMonitor(self._call_later,
+                              interval_sec if interval_sec is not None else LOOP_MONITOR_INTERVAL_SEC,
+                              threshold_sec if threshold_sec is not None else SLOW_HANDLER_SEC)
+        monitor.start()
+        return monitor
+
+    def purge_cache(self, max_age_sec=None, max_devices=None, timeout_sec=TIMEOUT_SEC):
+        """Remove devices that aren't connected or paired from the OS's device
+        cache when they haven't advertised for max_age_sec seconds, and then
+        the least recently seen until at most max_devices are cached (by
+        default the CACHE_MAX_AGE_SEC and CACHE_MAX_DEVICES config values).
+        Unlike clear_cached_data recently seen and paired devices are kept.
+        Returns a dict with the number of devices evicted and remaining and the
+        seconds it took.
+        """
+        from ..config import CACHE_MAX_AGE_SEC, CACHE_MAX_DEVICES
+        start = time.time()
+        evicted, remaining = self._purge_cache(
+            max_age_sec if max_age_sec is not None else CACHE_MAX_AGE_SEC,
+            max_devices if max_devices is not None else CACHE_MAX_DEVICES,
+            timeout_sec)
+        return {'evicted': evicted, 'remaining': remaining, 'seconds': time.time() - start}
+
+    def maintain_cache(self, interval_sec=None, max_age_sec=None, max_devices=None):
+        """Start purging the device cache (see purge_cache) every interval_sec
+        seconds on a background thread (by default the
+        CACHE_MAINTENANCE_INTERVAL_SEC config value).  Returns the running
+        CacheMaintenance, call its stop function to stop purging and its stats
+        function for how many devices were evicted.  The main loop must be
+        running.
+        """
+        from ..cache_maintenance import CacheMaintenance
+        from ..config import CACHE_MAINTENANCE_INTERVAL_SEC
+        maintenance = CacheMaintenance(lambda: self.purge_cache(max_age_sec, max_devices),
+            interval_sec if interval_sec is not None else CACHE_MAINTENANCE_INTERVAL_SEC)
+        maintenance.start()
+        return maintenance
+
+    def _purge_cache(self, max_age_sec, max_devices, timeout_sec):
+        """Evict devices from the cache for purge_cache and return a tuple of
+        the number of devices evicted and remaining.  Providers without a
+        device cache don't support it.
+        """
+        raise NotImplementedError
+
+    def _call_later(self, delay_sec, callback):
+        """Call the callback once from the main loop after delay_sec seconds.
+        Providers without a main loop don't support it.
+        """
+        raise NotImplementedError
+
+    @property
+    def advertisements(self):
+        """Return the AdvertisementStore with what was seen in the
+        advertisements of each device, keyed by device id.  Devices that
+        haven't advertised for ADVERTISEMENT_TTL_SEC seconds are forgotten.
+        """
+        if getattr(self, '_advertisements', None) is None:
+            from ..advertisements import AdvertisementStore
+            self._advertisements = AdvertisementStore()
+        return self._advertisements
+
+    @property
+    def known_devices(self):
+        """Return the KnownDevices list of devices connected to with
+        connect_address, saved in the KNOWN_DEVICES_FILE config file.
+        """
+        if getattr(self, '_known_devices', None) is None:
+            from ..config import KNOWN_DEVICES_FILE
+            from ..known_devices import KnownDevices
+            self._known_devices = KnownDevices(KNOWN_DEVICES_FILE)
+        return self._known_devices
+
+    def connect_address(self, address, adapter=None, timeout_sec=TIMEOUT_SEC, address_type=None):
+        """Connect to the device with the specified address (or id on Mac OSX)
+        without scanning for it first, and return its connected device object.
+        Uses the specified adapter, or the default adapter.  The address type
+        ('public' or 'random') of a device the OS hasn't seen is taken from the
+        known devices list when it isn't specified.  The device is added to the
+        known devices list.
+        """
+        with tracing.span('device.connect_address', str(address)):
+            deadline = as_deadline(timeout_sec)
+            known = self.known_devices.get(address)
+            if address_type is None and known is not None:
+                address_type = known.address_type
+            device = self._device_for_address(address, adapter, address_type, deadline)
+            if not device.is_connected:
+                device.connect(deadline)
+            self.known_devices.add(address, getattr(device, 'address_type', address_type),
+                                   device.name, getattr(device, '_adapter_id', None))
+            return device
+
+    def connect_known_devices(self, addresses=None, timeout_sec=TIMEOUT_SEC):
+        """Connect with connect_address to each device in the list of addresses,
+        or every known device, one after another and sharing the timeout.
+        Returns a dict of each address to its connected device object, or the
+        exception it failed with.
+        """
+        deadline = as_deadline(timeout_sec)
+        if addresses is None:
+            addresses = [x.address for x in self.known_devices.list()]
+        results = {}
+        for address in addresses:
+            try:
+                results[address] = self.connect_address(address, timeout_sec=deadline)
+            except Cancelled:
+                raise
+            except Exception as ex:
+                results[address] = ex
+        return results
+
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        """Return the device object for an address for connect_address, which
+        connects it if it isn't already.  Providers that can't reach devices by
+        address don't support it.
         """
         raise NotImplementedError
 
@@ -128,16 +285,28 @@ class Provider(object):
         to be found, and if the timeout is zero then it will not wait at all and
         immediately return a result.  When no device is found a value of None is
         returned.
+
+        Timeout_sec here, and everywhere else the library takes one, can also be
+        a Deadline shared by a chain of calls (see deadline.py).  Each call then
+        waits for what's left of it and raises Cancelled if it's cancelled.
         """
-        start = time.time()
+        with tracing.span('scan.find_device', services=len(service_uuids), device_name=name) as span:
+            device = self._find_device(service_uuids, name, timeout_sec)
+            if device is not None:
+                span.set('found', device.id)
+            return device
+
+    def _find_device(self, service_uuids, name, timeout_sec):
+        deadline = as_deadline(timeout_sec)
         while True:
+            deadline.check_cancelled()
             # Call find_devices and grab the first result if any are found.
             found = self.find_devices(service_uuids, name)
             if len(found) > 0:
                 return found[0]
             # No device was found.  Check if the timeout is exceeded and wait to
             # try again.
-            if time.time()-start >= timeout_sec:
+            if deadline.expired:
                 # Failed to find a device within the timeout.
                 return None
-            time.sleep(1)
+            deadline.sleep(1)
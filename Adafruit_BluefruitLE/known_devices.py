@@ -0,0 +1,129 @@
+# Persistent list of devices the program has connected to, so they can be
+# connected to again by address without scanning.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class KnownDevice(object):
+    """A device in the known devices list: its address (or id on Mac OSX),
+    address type ('public' or 'random', None when unknown), name, the id of the
+    adapter it was connected with, and the time it was last connected.
+    """
+    __slots__ = ('address', 'address_type', 'name', 'adapter', 'last_connected')
+
+    def __init__(self, address, address_type=None, name=None, adapter=None,
+                 last_connected=None):
+        self.address = address
+        self.address_type = address_type
+        self.name = name
+        self.adapter = adapter
+        self.last_connected = last_connected
+
+    def _to_dict(self):
+        return dict((x, getattr(self, x)) for x in self.__slots__)
+
+
+class KnownDevices(object):
+    """Devices remembered across runs in a JSON file at path (kept in memory
+    only when path is None or empty).  Every change is saved right away by
+    writing a new file and renaming it over the old one, so the file is never
+    left half written.  Use Provider.known_devices rather than creating one.
+    """
+
+    def __init__(self, path=None):
+        self._path = path or None
+        self._lock = threading.Lock()
+        self._devices = {}
+        if self._path is not None and os.path.exists(self._path):
+            self._load()
+
+    def add(self, address, address_type=None, name=None, adapter=None):
+        """Remember a device that was just connected, keeping what's already
+        known about it when an argument is None.  Returns its KnownDevice.
+        """
+        address = str(address)
+        with self._lock:
+            device = self._devices.get(address)
+            if device is None:
+                device = self._devices[address] = KnownDevice(address)
+            if address_type is not None:
+                device.address_type = address_type
+            if name is not None:
+                device.name = name
+            if adapter is not None:
+                device.adapter = adapter
+            device.last_connected = time.time()
+            self._save()
+            return device
+
+    def remove(self, address):
+        """Forget a device."""
+        with self._lock:
+            if self._devices.pop(str(address), None) is not None:
+                self._save()
+
+    def get(self, address):
+        """Return the KnownDevice with the address, or None if it isn't known."""
+        with self._lock:
+            return self._devices.get(str(address))
+
+    def list(self):
+        """Return a list of the known devices, most recently connected first."""
+        with self._lock:
+            return sorted(self._devices.values(), key=lambda x: x.last_connected or 0,
+                          reverse=True)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, address):
+        return str(address) in self._devices
+
+    def _load(self):
+        try:
+            with open(self._path, 'r') as infile:
+                entries = json.load(infile)
+            for entry in entries:
+                device = KnownDevice(**entry)
+                self._devices[device.address] = device
+        except (IOError, OSError, ValueError, TypeError) as ex:
+            logger.warning('Ignoring unreadable known devices file {0}: {1}'.format(self._path, ex))
+
+    def _save(self):
+        # Called with the lock held.  A list that can't be saved still works
+        # for the rest of the run.
+        if self._path is None:
+            return
+        temp_path = '{0}.{1}.tmp'.format(self._path, os.getpid())
+        try:
+            with open(temp_path, 'w') as outfile:
+                json.dump([x._to_dict() for x in self._devices.values()], outfile, indent=1)
+            os.rename(temp_path, self._path)
+        except (IOError, OSError) as ex:
+            logger.warning('Failed to save known devices to {0}: {1}'.format(self._path, ex))
@@ -0,0 +1,142 @@
+# Watchdog for the provider's main loop: measures how late periodic timers
+# fire and times the handlers the library dispatches on the loop.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import bisect
+import logging
+import threading
+import time
+
+from . import metrics
+from .config import LOOP_MONITOR_INTERVAL_SEC, SLOW_HANDLER_SEC
+
+
+logger = logging.getLogger(__name__)
+
+
+def slow_handler(name, elapsed, device=None):
+    """Report a handler that blocked the main loop for elapsed seconds,
+    optionally for the specified device.
+    """
+    logger.warning('{0} handler{1} blocked the main loop for {2:.1f} ms'.format(
+        name, ' for {0}'.format(device) if device is not None else '', elapsed*1000.0))
+    if metrics.METRICS:
+        metrics.SLOW_HANDLERS.labels(name).inc()
+
+
+def timed(handler, name):
+    """Return the handler wrapped to time each call, recording the duration
+    and reporting calls that take longer than SLOW_HANDLER_SEC.  Used for the
+    handlers the library dispatches on the main loop, like DBus signal
+    callbacks, so the wrapper must always be called from the same thread.
+    """
+    clock = time.time
+    durations = metrics.HANDLER_SECONDS.labels(name) if metrics.METRICS else None
+    bounds = metrics.HANDLER_SECONDS.buckets
+    shards = []
+    def timed_handler(*args, **kwargs):
+        start = clock()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            if durations is not None:
+                # Handlers run on the main loop thread, so its shard of the
+                # histogram is updated without locking.
+                if not shards:
+                    shards.append(durations.shard())
+                shard = shards[0]
+                shard[bisect.bisect_left(bounds, elapsed)] += 1
+                shard[-1] += elapsed
+            if elapsed > SLOW_HANDLER_SEC:
+                slow_handler(name, elapsed)
+    return timed_handler
+
+
+class LoopMonitor(object):
+    """Measures main loop lag: a timer is scheduled every interval_sec with
+    the provider's call_later function and the lag is how late it fires.  Lag
+    is recorded in the loop lag histogram and lags over threshold_sec are
+    logged, since they mean something blocked the loop (and delayed every
+    notification waiting behind it).  Use Provider.monitor_loop to create one
+    for the provider's main loop.
+    """
+
+    def __init__(self, call_later, interval_sec=LOOP_MONITOR_INTERVAL_SEC,
+                 threshold_sec=SLOW_HANDLER_SEC):
+        self._call_later = call_later
+        self._interval_sec = interval_sec
+        self._threshold_sec = threshold_sec
+        self._lock = threading.Lock()
+        self._running = False
+        self._expected = None
+        self._ticks = 0
+        self._stalls = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._total_lag = 0.0
+
+    def start(self):
+        """Start measuring."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._schedule()
+
+    def stop(self):
+        """Stop measuring after the timer that's already scheduled fires."""
+        with self._lock:
+            self._running = False
+
+    def stats(self):
+        """Return a dict of lag statistics in seconds."""
+        with self._lock:
+            return {
+                'ticks':        self._ticks,
+                'stalls':       self._stalls,
+                'last_lag_sec': self._last_lag,
+                'max_lag_sec':  self._max_lag,
+                'avg_lag_sec':  self._total_lag / self._ticks if self._ticks > 0 else 0.0
+            }
+
+    def _schedule(self):
+        self._expected = time.time() + self._interval_sec
+        self._call_later(self._interval_sec, self._tick)
+
+    def _tick(self):
+        # Called on the main loop by the timer.
+        lag = max(0.0, time.time() - self._expected)
+        with self._lock:
+            self._ticks += 1
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+            self._total_lag += lag
+            if lag > self._threshold_sec:
+                self._stalls += 1
+            running = self._running
+        if metrics.METRICS:
+            metrics.LOOP_LAG_SECONDS.labels().observe(lag)
+        if lag > self._threshold_sec:
+            logger.warning('Main loop lagged {0:.1f} ms behind its timer'.format(lag*1000.0))
+        if running:
+            self._schedule()
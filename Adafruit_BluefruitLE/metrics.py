@@ -0,0 +1,526 @@
+# Counters, gauges, and histograms of BLE activity with a Prometheus text
+# exporter.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Budget: with metrics enabled each notification costs well under a
+# microsecond on top of the user's callback (a notification and byte count plus
+# a histogram observation of the callback's duration, all kept in lock free
+# per-thread shards), see benchmarks/metrics_overhead.py which fails if it
+# exceeds NOTIFY_BUDGET_SEC.
+import bisect
+import collections
+import threading
+import time
+
+from .config import METRICS, SLOW_HANDLER_SEC
+
+
+# Overhead allowed per notification for the metrics recorded around the user's
+# callback.
+NOTIFY_BUDGET_SEC = 1e-6
+
+# Default histogram buckets in seconds, from a fast GATT read to a slow
+# connection.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# A metric as returned by Registry.collect: its name, type ('counter', 'gauge',
+# or 'histogram'), help text, and a list of (name suffix, labels dict, value)
+# samples.
+MetricFamily = collections.namedtuple('MetricFamily', 'name type help samples')
+
+
+class _CounterChild(object):
+    # Value of a counter for one set of label values.  Besides the locked
+    # value, each thread can get a shard to add to without locking.
+    __slots__ = ('_value', '_shards', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the counter by amount."""
+        with self._lock:
+            self._value += amount
+
+    def shard(self):
+        """Return this thread's shard of the counter, a one element list the
+        thread can add to without locking on hot paths.  Only the calling
+        thread may update it.
+        """
+        thread = threading.current_thread().ident
+        shard = self._shards.get(thread)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(thread, [0])
+        return shard
+
+    @property
+    def value(self):
+        return self._value + sum(x[0] for x in list(self._shards.values()))
+
+
+class _GaugeChild(object):
+    # Value of a gauge for one set of label values.
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """Set the gauge to value."""
+        self.value = value
+
+    def inc(self, amount=1):
+        """Increase the gauge by amount."""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge by amount."""
+        with self._lock:
+            self.value -= amount
+
+
+class _HistogramChild(object):
+    # Bucket counts and sum of a histogram for one set of label values, kept
+    # in a list with the sum last.  Like counters each thread can get a shard
+    # to update without locking.
+    __slots__ = ('bounds', '_counts', '_shards', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self._counts = [0] * (len(bounds) + 2)
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record an observation, like the duration of an operation."""
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._counts[-1] += value
+
+    def shard(self):
+        """Return this thread's shard of the histogram, a list of the count of
+        each bucket followed by the sum of observations.  Only the calling
+        thread may update it.
+        """
+        thread = threading.current_thread().ident
+        shard = self._shards.get(thread)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(thread, [0] * (len(self.bounds) + 2))
+        return shard
+
+    def totals(self):
+        """Return a list of the count of each bucket followed by the sum of
+        observations, over every shard.
+        """
+        with self._lock:
+            totals = list(self._counts)
+        for shard in list(self._shards.values()):
+            for i, value in enumerate(list(shard)):
+                totals[i] += value
+        return totals
+
+
+class _Metric(object):
+    # Base of the metric types: a family of values, one for each combination
+    # of label values.
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the value of this metric for the specified label values, in
+        the order of the label names.  Keep the returned object to update it
+        without looking it up again on hot paths.
+        """
+        values = tuple(str(x) for x in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('Expected {0} label values for {1}!'.format(len(self.labelnames), self.name))
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        # Return a list of (labels dict, child) pairs.
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.labelnames, values)), child) for values, child in children]
+
+
+class Counter(_Metric):
+    """Value that only increases, like a count of connections."""
+
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def samples(self):
+        return [('_total', labels, child.value) for labels, child in self._items()]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, like the depth of a queue."""
+
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def samples(self):
+        return [('', labels, child.value) for labels, child in self._items()]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, like operation latencies, counted in
+    buckets with the specified upper bounds.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def samples(self):
+        samples = []
+        for labels, child in self._items():
+            totals = child.totals()
+            counts = totals[:-1]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = dict(labels)
+                bucket_labels['le'] = _format_value(bound)
+                samples.append(('_bucket', bucket_labels, cumulative))
+            samples.append(('_sum', labels, totals[-1]))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class Registry(object):
+    """Collection of metrics.  Creating a metric with the name of one that's
+    already registered returns the existing metric.
+    """
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        """Return the counter with the specified name, creating it if needed."""
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        """Return the gauge with the specified name, creating it if needed."""
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Return the histogram with the specified name, creating it if
+        needed.
+        """
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def collect(self):
+        """Return a list of MetricFamily tuples with the current value of every
+        metric.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [MetricFamily(x.name, x.type, x.help, x.samples()) for x in metrics]
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('Metric {0} is already registered as a {1}!'.format(name, metric.type))
+            return metric
+
+
+class Exporter(object):
+    """Base class for exporters, which turn the metrics of a registry into a
+    format a monitoring system reads.  Implement export to support another
+    system.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else REGISTRY
+
+    def export(self):
+        """Return the current metrics in the exporter's format."""
+        raise NotImplementedError
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class PrometheusExporter(Exporter):
+    """Exporter of the Prometheus text exposition format.  The text can be
+    served over HTTP for Prometheus to scrape, or written to a file for the
+    node_exporter textfile collector.
+    """
+
+    def export(self):
+        """Return the current metrics as Prometheus text."""
+        lines = []
+        for family in self.registry.collect():
+            lines.append('# HELP {0} {1}'.format(family.name, family.help.replace('\n', ' ')))
+            lines.append('# TYPE {0} {1}'.format(family.name, family.type))
+            for suffix, labels, value in family.samples:
+                if labels:
+                    label_text = '{' + ','.join('{0}="{1}"'.format(k, _escape(v))
+                                                for k, v in sorted(labels.items())) + '}'
+                else:
+                    label_text = ''
+                lines.append('{0}{1}{2} {3}'.format(family.name, suffix, label_text,
+                                                    _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to a file, replacing it atomically so a collector
+        never reads a partial file.
+        """
+        import os
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as output:
+            output.write(self.export())
+        os.rename(temp_path, path)
+
+    def serve(self, port, address=''):
+        """Serve the metrics over HTTP on the specified port from a background
+        thread.  Returns the HTTP server, call its shutdown function to stop
+        it.
+        """
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        exporter = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.export().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass
+        server = HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name='Metrics exporter')
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+# Registry of the library's metrics.
+REGISTRY = Registry()
+
+CONNECTS = REGISTRY.counter('bluefruitle_connects',
+    'Successful device connections.', ('adapter', 'device'))
+DISCONNECTS = REGISTRY.counter('bluefruitle_disconnects',
+    'Device disconnections requested by the program.', ('adapter', 'device'))
+FAILURES = REGISTRY.counter('bluefruitle_failures',
+    'Operations that raised an error or timed out.', ('adapter', 'device', 'operation'))
+DISCOVERY_SECONDS = REGISTRY.histogram('bluefruitle_discovery_seconds',
+    'Time to discover the expected services and characteristics of a device.', ('adapter', 'device'))
+CONNECT_SECONDS = REGISTRY.histogram('bluefruitle_connect_seconds',
+    'Time to connect to a device.', ('adapter', 'device'))
+READ_SECONDS = REGISTRY.histogram('bluefruitle_read_seconds',
+    'Latency of characteristic and descriptor reads.', ('adapter', 'device'))
+WRITE_SECONDS = REGISTRY.histogram('bluefruitle_write_seconds',
+    'Latency of characteristic writes.', ('adapter', 'device'))
+NOTIFICATIONS = REGISTRY.counter('bluefruitle_notifications',
+    'Notifications received, use rate() for notifications per second.', ('adapter', 'device'))
+BYTES_RECEIVED = REGISTRY.counter('bluefruitle_received_bytes',
+    'Bytes received from reads and notifications.', ('adapter', 'device'))
+BYTES_SENT = REGISTRY.counter('bluefruitle_sent_bytes',
+    'Bytes sent by writes.', ('adapter', 'device'))
+CALLBACK_SECONDS = REGISTRY.histogram('bluefruitle_callback_seconds',
+    'Time spent in notification callbacks.', ('adapter', 'device'),
+    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0))
+UART_QUEUE_DEPTH = REGISTRY.gauge('bluefruitle_uart_queue_depth',
+    'Received UART data waiting to be read.', ('device',))
+LOOP_LAG_SECONDS = REGISTRY.histogram('bluefruitle_loop_lag_seconds',
+    'How late the loop monitor timer fired on the main loop.',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+HANDLER_SECONDS = REGISTRY.histogram('bluefruitle_handler_seconds',
+    'Time spent in handlers the library dispatches on the main loop.', ('handler',),
+    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0))
+SLOW_HANDLERS = REGISTRY.counter('bluefruitle_slow_handlers',
+    'Handlers and notification callbacks that blocked the main loop too long.', ('handler',))
+CACHE_EVICTIONS = REGISTRY.counter('bluefruitle_cache_evictions',
+    'Devices evicted from the OS device cache by cache maintenance.')
+RECONNECTS = REGISTRY.counter('bluefruitle_reconnects',
+    'Sessions restored after their device disconnected.', ('device',))
+RECONNECT_SECONDS = REGISTRY.histogram('bluefruitle_reconnect_seconds',
+    'Time for the successful attempt to reconnect, rediscover and resubscribe a session.', ('device',))
+OUTAGE_SECONDS = REGISTRY.histogram('bluefruitle_outage_seconds',
+    'Time from losing a session\'s device until the session was restored.', ('device',),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0))
+VALUE_CACHE_HITS = REGISTRY.counter('bluefruitle_value_cache_hits',
+    'Characteristic reads answered from the value cache.')
+VALUE_CACHE_MISSES = REGISTRY.counter('bluefruitle_value_cache_misses',
+    'Characteristic reads the value cache had to make over the air.')
+
+# Histogram recording the duration of each timed operation.
+_OPERATION_SECONDS = {
+    'connect':  CONNECT_SECONDS,
+    'discover': DISCOVERY_SECONDS,
+    'read':     READ_SECONDS,
+    'write':    WRITE_SECONDS
+}
+
+
+class _NullOperation(object):
+    # Operation returned while metrics are disabled, does nothing.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def fail(self):
+        pass
+
+
+_NULL_OPERATION = _NullOperation()
+
+
+class _Operation(object):
+    # Context manager that times an operation and counts its outcome.
+
+    def __init__(self, name, adapter, device, size):
+        self._name = name
+        self._adapter = adapter
+        self._device = device
+        self._size = size
+        self._start = None
+        self._failed = False
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self._start
+        labels = (self._adapter, self._device)
+        if exc_type is not None or self._failed:
+            FAILURES.labels(self._adapter, self._device, self._name).inc()
+            return False
+        histogram = _OPERATION_SECONDS.get(self._name)
+        if histogram is not None:
+            histogram.labels(*labels).observe(duration)
+        if self._name == 'connect':
+            CONNECTS.labels(*labels).inc()
+        elif self._name == 'disconnect':
+            DISCONNECTS.labels(*labels).inc()
+        elif self._name == 'write' and self._size:
+            BYTES_SENT.labels(*labels).inc(self._size)
+        return False
+
+    def fail(self):
+        """Count the operation as failed even though it didn't raise, like a
+        discovery that timed out.
+        """
+        self._failed = True
+
+
+def operation(name, adapter, device, size=0):
+    """Return a context manager that records an operation ('connect',
+    'disconnect', 'discover', 'read', or 'write') with a device: its duration,
+    the bytes sent by a write, or a failure if it raises.
+    """
+    if not METRICS:
+        return _NULL_OPERATION
+    return _Operation(name, adapter, device, size)
+
+
+def received(adapter, device, size):
+    """Count bytes received from a device by a read."""
+    if METRICS:
+        BYTES_RECEIVED.labels(adapter, device).inc(size)
+
+
+def instrument_callback(on_change, adapter, device):
+    """Return the notification callback wrapped to count notifications and
+    bytes received and time the callback.  Returns the callback unchanged when
+    metrics are disabled.  The wrapper must always be called from the same
+    thread, like a provider's main loop.
+    """
+    if not METRICS:
+        return on_change
+    notifications = NOTIFICATIONS.labels(adapter, device)
+    received_bytes = BYTES_RECEIVED.labels(adapter, device)
+    callback_seconds = CALLBACK_SECONDS.labels(adapter, device)
+    bounds = callback_seconds.bounds
+    clock = time.time
+    shards = []
+    def counted(value):
+        # Update shards of the thread that delivers the notifications, they're
+        # looked up on the first notification.
+        if not shards:
+            shards.extend((notifications.shard(), received_bytes.shard(),
+                           callback_seconds.shard()))
+        count, size, duration = shards
+        count[0] += 1
+        size[0] += len(value)
+        start = clock()
+        try:
+            return on_change(value)
+        finally:
+            elapsed = clock() - start
+            duration[bisect.bisect_left(bounds, elapsed)] += 1
+            duration[-1] += elapsed
+            if elapsed > SLOW_HANDLER_SEC:
+                from .loop_monitor import slow_handler
+                slow_handler('notification', elapsed, device)
+    return counted
@@ -0,0 +1,182 @@
+# Per-device queue that schedules GATT operations (reads, writes, notification
+# changes, etc.) so threads sharing a device don't race each other.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import itertools
+import threading
+import time
+
+from .deadline import as_deadline
+
+
+# Operation priorities, lower values run first.  Control operations (like
+# writing a command or changing notification state) jump ahead of normal and
+# bulk operations that are waiting in the queue.
+PRIORITY_CONTROL = 0
+PRIORITY_NORMAL  = 1
+PRIORITY_BULK    = 2
+
+
+class OperationQueue(object):
+    """Queue that serializes GATT operations for a single device.  Operations
+    run in the calling thread, but only once it is their turn: waiting
+    operations are ordered by priority and then by submission order.  Up to
+    max_in_flight operations can run at once, however operations with the same
+    key (typically the characteristic they act on) never overlap.
+
+    Operations that fail with an error the is_transient function recognizes
+    (like bluez's org.bluez.Error.InProgress) are retried up to retries times
+    with an exponential backoff starting at backoff_sec.
+    """
+
+    def __init__(self, max_in_flight=1, retries=3, backoff_sec=0.05,
+                 max_backoff_sec=1.0, is_transient=None):
+        self._max_in_flight = max_in_flight
+        self._retries = retries
+        self._backoff_sec = backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._is_transient = is_transient
+        self._condition = threading.Condition()
+        self._counter = itertools.count()
+        # Waiting operations as a sorted list of (priority, sequence, key)
+        # tickets, and the keys of operations that are currently running.
+        self._waiting = []
+        self._active_keys = {}
+        self._in_flight = 0
+        # Statistics.
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+        self._by_priority = {}
+
+    def run(self, operation, priority=PRIORITY_NORMAL, key=None,
+            timeout_sec=None):
+        """Run the operation function once it's this call's turn and return
+        its result.  Blocks for up to timeout_sec seconds (forever if None, or
+        what's left of a Deadline) waiting for the turn, and raises an exception
+        if the timeout elapses or the deadline is cancelled first.  Any
+        exception raised by the operation is rethrown after transient errors
+        have been retried, for as long as the deadline allows.
+        """
+        start = time.time()
+        deadline = as_deadline(timeout_sec)
+        deadline.check_cancelled()
+        ticket = (priority, next(self._counter), key)
+        with self._condition:
+            self._insert(ticket)
+            self._submitted += 1
+            self._max_depth = max(self._max_depth,
+                                  len(self._waiting) + self._in_flight)
+            try:
+                deadline.wait_for(self._condition, lambda: self._next_ready() is ticket,
+                                  'Exceeded timeout waiting for queued GATT operation!')
+            except RuntimeError:
+                self._waiting.remove(ticket)
+                self._failed += 1
+                self._condition.notify_all()
+                raise
+            self._waiting.remove(ticket)
+            self._in_flight += 1
+            self._active_keys[key] = self._active_keys.get(key, 0) + 1
+            waited = time.time() - start
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            # Other operations might also be able to run when pipelining.
+            self._condition.notify_all()
+        began = time.time()
+        succeeded = False
+        try:
+            result = self._run_with_retry(operation, deadline)
+            succeeded = True
+            return result
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._active_keys[key] -= 1
+                if self._active_keys[key] == 0:
+                    del self._active_keys[key]
+                self._total_run += time.time() - began
+                if succeeded:
+                    self._completed += 1
+                    self._by_priority[priority] = self._by_priority.get(priority, 0) + 1
+                else:
+                    self._failed += 1
+                self._condition.notify_all()
+
+    def stats(self):
+        """Return a dict of throughput and fairness statistics for the queue."""
+        with self._condition:
+            finished = self._completed + self._failed
+            return {
+                'submitted':      self._submitted,
+                'completed':      self._completed,
+                'failed':         self._failed,
+                'retried':        self._retried,
+                'waiting':        len(self._waiting),
+                'in_flight':      self._in_flight,
+                'max_depth':      self._max_depth,
+                'avg_wait_sec':   self._total_wait / finished if finished > 0 else 0.0,
+                'max_wait_sec':   self._max_wait,
+                'avg_run_sec':    self._total_run / finished if finished > 0 else 0.0,
+                'completed_by_priority': dict(self._by_priority)
+            }
+
+    def _insert(self, ticket):
+        # Keep the waiting list sorted by priority then submission order.  The
+        # list is short so a linear insert is cheaper than a heap here.
+        for i, waiting in enumerate(self._waiting):
+            if ticket[:2] < waiting[:2]:
+                self._waiting.insert(i, ticket)
+                return
+        self._waiting.append(ticket)
+
+    def _next_ready(self):
+        # Return the first waiting ticket that is allowed to run now, or None if
+        # nothing can run.  Must be called with the condition lock held.
+        if self._in_flight >= self._max_in_flight:
+            return None
+        for ticket in self._waiting:
+            if ticket[2] is None or ticket[2] not in self._active_keys:
+                return ticket
+        return None
+
+    def _run_with_retry(self, operation, deadline):
+        # Call the operation and retry transient failures with backoff, until
+        # the deadline passes.
+        attempt = 0
+        delay = self._backoff_sec
+        while True:
+            try:
+                return operation()
+            except Exception as ex:
+                if attempt >= self._retries or self._is_transient is None or \
+                   not self._is_transient(ex) or deadline.remaining(delay) < delay:
+                    raise
+            attempt += 1
+            with self._condition:
+                self._retried += 1
+            deadline.sleep(delay)
+            delay = min(delay*2, self._max_backoff_sec)
@@ -33,10 +33,24 @@ def get_provider():
     global _provider
     # Set the provider based on the current platform.
     if _provider is None:
-        if sys.platform.startswith('linux'):
-            # Linux platform
-            from .bluez_dbus.provider import BluezProvider
-            _provider = BluezProvider()
+        from .config import PROVIDER
+        if PROVIDER == 'gateway':
+            # Use the BLE devices of a gateway daemon on any platform.
+            from .gateway.client import GatewayProvider
+            _provider = GatewayProvider()
+        elif PROVIDER is not None:
+            raise RuntimeError('Unknown BLE provider: {0}'.format(PROVIDER))
+        elif sys.platform.startswith('linux'):
+            # Linux platform, pick the configured provider.
+            from .config import LINUX_PROVIDER
+            if LINUX_PROVIDER == 'bluez_asyncio':
+                from .bluez_asyncio.provider import AsyncioBluezProvider
+                _provider = AsyncioBluezProvider()
+            elif LINUX_PROVIDER == 'bluez_dbus':
+                from .bluez_dbus.provider import BluezProvider
+                _provider = BluezProvider()
+            else:
+                raise RuntimeError('Unknown Linux BLE provider: {0}'.format(LINUX_PROVIDER))
         elif sys.platform == 'darwin':
             # Mac OSX platform
             from .corebluetooth.provider import CoreBluetoothProvider
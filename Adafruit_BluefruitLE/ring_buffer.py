@@ -0,0 +1,204 @@
+# Single producer, single consumer ring buffer of variable length records in
+# shared memory, for passing data between processes without pickling it.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import struct
+import threading
+
+from multiprocessing import shared_memory
+
+
+# Layout of the header at the start of the shared memory: the write position,
+# the read position, the count of dropped records, and the capacity of the data
+# area.  Positions only ever increase, the offset into the data area is the
+# position modulo the capacity.
+_HEADER = struct.Struct('<QQQQ')
+_HEADER_SIZE = 64
+_HEAD_OFFSET    = 0
+_TAIL_OFFSET    = 8
+_DROPPED_OFFSET = 16
+
+# Every record starts with its length and is padded to a multiple of 8 bytes.
+# A record never wraps around the end of the data area, instead a padding
+# marker fills the rest of the area and the record starts over at the front.
+_LENGTH = struct.Struct('<I')
+_PADDING = 0xFFFFFFFF
+_ALIGN = 8
+
+_POSITION = struct.Struct('<Q')
+
+
+def _attach(name):
+    # Open existing shared memory without tracking it in this process, so only
+    # the creating process unlinks it.  Python before 3.13 always registers it
+    # with the resource tracker, which is harmless for processes started by the
+    # creator since they share its tracker.
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+class SharedRingBuffer(object):
+    """Ring buffer of variable length records in shared memory with exactly
+    one producer process and one consumer process.  The creating process owns
+    the memory and calls unlink when both sides are done, the other process
+    opens it with SharedRingBuffer.attach(name).
+
+    Put copies a record straight into the shared memory and never blocks: if
+    the consumer has fallen behind and there isn't room the record is dropped
+    and counted.  Read passes each record to a callback as a memoryview of the
+    shared memory itself, so reading doesn't copy anything.
+
+    Note positions are published with plain stores after the record is
+    written, which relies on CPython's memory operations not being reordered
+    between the two (true on x86 and in practice on ARM with the amount of
+    interpreter work in between).
+    """
+
+    def __init__(self, capacity=1 << 20, name=None, _memory=None):
+        """Create a ring buffer with the specified data capacity in bytes (a
+        multiple of 8) in new shared memory, with an optional name.
+        """
+        if _memory is None:
+            if capacity % _ALIGN != 0 or capacity <= 0:
+                raise ValueError('Capacity must be a positive multiple of {0}!'.format(_ALIGN))
+            _memory = shared_memory.SharedMemory(name, create=True, size=_HEADER_SIZE + capacity)
+            _HEADER.pack_into(_memory.buf, 0, 0, 0, 0, capacity)
+            self._owner = True
+        else:
+            self._owner = False
+        self._memory = _memory
+        self._buf = _memory.buf
+        self._capacity = _HEADER.unpack_from(self._buf, 0)[3]
+        # Lock for producers in different threads of the same process, like
+        # callbacks from the main loop and the user's thread.
+        self._put_lock = threading.Lock()
+
+    @classmethod
+    def attach(cls, name):
+        """Open the ring buffer with the specified name created by another
+        process.
+        """
+        return cls(_memory=_attach(name))
+
+    @property
+    def name(self):
+        """Return the name of the shared memory, to pass to attach."""
+        return self._memory.name
+
+    @property
+    def capacity(self):
+        """Return the size of the data area in bytes."""
+        return self._capacity
+
+    @property
+    def dropped(self):
+        """Return the number of records dropped because the buffer was full."""
+        return _POSITION.unpack_from(self._buf, _DROPPED_OFFSET)[0]
+
+    @property
+    def used(self):
+        """Return the number of bytes waiting to be read."""
+        head = _POSITION.unpack_from(self._buf, _HEAD_OFFSET)[0]
+        tail = _POSITION.unpack_from(self._buf, _TAIL_OFFSET)[0]
+        return head - tail
+
+    def put(self, *parts):
+        """Append one record made of the concatenation of the parts (bytes-like
+        objects, including contiguous NumPy arrays) to the buffer.  Returns
+        True if it was written, or False if it was dropped because there wasn't
+        room.
+        """
+        # Size the parts in bytes, len of an array is its number of items.
+        parts = [memoryview(x).cast('B') for x in parts]
+        length = sum([x.nbytes for x in parts])
+        size = _LENGTH.size + length
+        size += -size % _ALIGN
+        if size > self._capacity:
+            raise ValueError('Record of {0} bytes is larger than the ring buffer!'.format(length))
+        buf = self._buf
+        capacity = self._capacity
+        with self._put_lock:
+            head = _POSITION.unpack_from(buf, _HEAD_OFFSET)[0]
+            tail = _POSITION.unpack_from(buf, _TAIL_OFFSET)[0]
+            offset = head % capacity
+            # Skip to the front if the record doesn't fit before the end.
+            skip = capacity - offset if offset + size > capacity else 0
+            if capacity - (head - tail) < skip + size:
+                dropped = _POSITION.unpack_from(buf, _DROPPED_OFFSET)[0]
+                _POSITION.pack_into(buf, _DROPPED_OFFSET, dropped + 1)
+                return False
+            if skip:
+                _LENGTH.pack_into(buf, _HEADER_SIZE + offset, _PADDING)
+                offset = 0
+            position = _HEADER_SIZE + offset
+            _LENGTH.pack_into(buf, position, length)
+            position += _LENGTH.size
+            for part in parts:
+                buf[position:position+part.nbytes] = part
+                position += part.nbytes
+            # Publish the record.
+            _POSITION.pack_into(buf, _HEAD_OFFSET, head + skip + size)
+        return True
+
+    def read(self, callback, max_records=None):
+        """Call callback with a memoryview of each record waiting in the
+        buffer, oldest first, and return the number of records read.  The
+        memoryview points into the shared memory and is only valid until the
+        callback returns, copy it to keep the data.
+        """
+        buf = self._buf
+        capacity = self._capacity
+        head = _POSITION.unpack_from(buf, _HEAD_OFFSET)[0]
+        tail = _POSITION.unpack_from(buf, _TAIL_OFFSET)[0]
+        count = 0
+        try:
+            while tail < head and (max_records is None or count < max_records):
+                offset = tail % capacity
+                length = _LENGTH.unpack_from(buf, _HEADER_SIZE + offset)[0]
+                if length == _PADDING:
+                    tail += capacity - offset
+                    continue
+                start = _HEADER_SIZE + offset + _LENGTH.size
+                size = _LENGTH.size + length
+                tail += size + (-size % _ALIGN)
+                count += 1
+                record = buf[start:start+length]
+                try:
+                    callback(record)
+                finally:
+                    record.release()
+        finally:
+            # Free the space that was read.
+            _POSITION.pack_into(buf, _TAIL_OFFSET, tail)
+        return count
+
+    def close(self):
+        """Close this process's view of the shared memory."""
+        self._buf = None
+        self._memory.close()
+
+    def unlink(self):
+        """Destroy the shared memory, called by the creating process once both
+        sides have closed it.
+        """
+        self._memory.unlink()
@@ -1,3 +1,31 @@
-from .uart import UART
-from .device_information import DeviceInformation
-from .colorific import Colorific
+import sys
+
+
+# Service classes are imported the first time they're accessed so importing
+# one service doesn't pay for importing all of them.
+_SERVICES = {
+    'UART':              'uart',
+    'DeviceInformation': 'device_information',
+    'Colorific':         'colorific'
+}
+
+__all__ = list(_SERVICES.keys())
+
+
+def __getattr__(name):
+    """Import and return the service class with the specified name."""
+    if name not in _SERVICES:
+        raise AttributeError('module {0} has no attribute {1}'.format(__name__, name))
+    import importlib
+    module = importlib.import_module('.' + _SERVICES[name], __name__)
+    service = getattr(module, name)
+    globals()[name] = service
+    return service
+
+
+# Python before 3.7 doesn't support module level __getattr__, so just import
+# everything up front.
+if sys.version_info < (3, 7):
+    from .uart import UART
+    from .device_information import DeviceInformation
+    from .colorific import Colorific
@@ -23,6 +23,7 @@
 # SOFTWARE.
 import uuid
 
+from ..value_cache import VALUE_CACHE
 from .servicebase import ServiceBase
 
 
@@ -51,8 +52,13 @@ class DeviceInformation(ServiceBase):
     SERVICES = [DIS_SERVICE_UUID]
     CHARACTERISTICS = []
 
-    def __init__(self, device):
-        """Initialize device information from provided bluez device."""
+    def __init__(self, device, cache=VALUE_CACHE):
+        """Initialize device information from provided bluez device.  Values
+        are read once and kept in the value cache (see value_cache.py) until
+        the device disconnects, pass cache=None to read them every time.
+        """
+        self._device = device
+        self._cache = cache
         # Find the DIS service and characteristics associated with the device.
         self._dis = device.find_service(DIS_SERVICE_UUID)
         self._manufacturer = self._dis.find_characteristic(MANUFACTURER_CHAR_UUID)
@@ -65,57 +71,51 @@ class DeviceInformation(ServiceBase):
         self._reg_cert = self._dis.find_characteristic(REG_CERT_CHAR_UUID)
         self._pnp_id = self._dis.find_characteristic(PNP_ID_CHAR_UUID)
 
+    def rebind(self, device):
+        """Find the characteristics again on the device, keeping the cache."""
+        self.__init__(device, self._cache)
+
+    def _read(self, characteristic, char_uuid):
+        # Read a characteristic the device might not have, through the cache.
+        if characteristic is None:
+            return None
+        if self._cache is None:
+            return characteristic.read_value()
+        return self._cache.read(self._device, characteristic, char_uuid)
+
     # Expose all the DIS properties as easy to read python object properties.
     @property
     def manufacturer(self):
-        if self._manufacturer is not None:
-            return self._manufacturer.read_value()
-        return None
+        return self._read(self._manufacturer, MANUFACTURER_CHAR_UUID)
 
     @property
     def model(self):
-        if self._model is not None:
-            return self._model.read_value()
-        return None
+        return self._read(self._model, MODEL_CHAR_UUID)
 
     @property
     def serial(self):
-        if self._serial is not None:
-            return self._serial.read_value()
-        return None
+        return self._read(self._serial, SERIAL_CHAR_UUID)
 
     @property
     def hw_revision(self):
-        if self._hw_revision is not None:
-            return self._hw_revision.read_value()
-        return None
+        return self._read(self._hw_revision, HW_REVISION_CHAR_UUID)
 
     @property
     def sw_revision(self):
-        if self._sw_revision is not None:
-            return self._sw_revision.read_value()
-        return None
+        return self._read(self._sw_revision, SW_REVISION_CHAR_UUID)
 
     @property
     def fw_revision(self):
-        if self._fw_revision is not None:
-            return self._fw_revision.read_value()
-        return None
+        return self._read(self._fw_revision, FW_REVISION_CHAR_UUID)
 
     @property
     def system_id(self):
-        if self._sys_id is not None:
-            return self._sys_id.read_value()
-        return None
+        return self._read(self._sys_id, SYS_ID_CHAR_UUID)
 
     @property
     def regulatory_cert(self):
-        if self._reg_cert is not None:
-            return self._reg_cert.read_value()
-        return None
+        return self._read(self._reg_cert, REG_CERT_CHAR_UUID)
 
     @property
     def pnp_id(self):
-        if self._pnp_id is not None:
-            return self._pnp_id.read_value()
-        return None
+        return self._read(self._pnp_id, PNP_ID_CHAR_UUID)
@@ -22,6 +22,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 from ..config import TIMEOUT_SEC
+from ..deadline import as_deadline
+from ..interfaces import GattService
 from ..platform import get_provider
 
 
@@ -38,10 +40,23 @@ class ServiceBase(object):
     def find_device(cls, timeout_sec=TIMEOUT_SEC):
         """Find the first available device that supports this service and return
         it, or None if no device is found.  Will wait for up to timeout_sec
-        seconds to find the device.
+        seconds (or until the Deadline passes) to find the device.
         """
         return get_provider().find_device(service_uuids=cls.ADVERTISED, timeout_sec=timeout_sec)
 
+    @classmethod
+    def connect_address(cls, address, adapter=None, timeout_sec=TIMEOUT_SEC):
+        """Connect to the device with the specified address (or id on Mac OSX)
+        without scanning, discover this service on it and return the device.
+        Raises a RuntimeError if the service isn't discovered within
+        timeout_sec.
+        """
+        deadline = as_deadline(timeout_sec)
+        device = get_provider().connect_address(address, adapter, deadline)
+        if not cls.discover(device, deadline):
+            raise RuntimeError('Failed to discover the {0} service on {1}!'.format(cls.__name__, address))
+        return device
+
     @classmethod
     def find_devices(cls):
         """Find all the available devices that support this service and
@@ -50,17 +65,139 @@ class ServiceBase(object):
         return get_provider().find_devices(cls.ADVERTISED)
 
     @classmethod
-    def disconnect_devices(cls):
+    def disconnect_devices(cls, timeout_sec=TIMEOUT_SEC):
         """Disconnect any currently connected devices that implement this
         service.
         """
-        return get_provider().disconnect_devices(service_uuids=cls.ADVERTISED)
+        return get_provider().disconnect_devices(service_uuids=cls.ADVERTISED,
+                                                 timeout_sec=timeout_sec)
 
     @classmethod
     def discover(cls, device, timeout_sec=TIMEOUT_SEC):
         """Wait until the specified device has discovered the expected services
         and characteristics for this service.  Should be called once before other
         calls are made on the service.  Returns true if the service has been
-        discovered in the specified timeout, or false if not discovered.
+        discovered in the specified timeout, or false if not discovered.  Only
+        the SERVICES and CHARACTERISTICS are discovered where the platform
+        allows it.
         """
-        device.discover(cls.SERVICES, cls.CHARACTERISTICS, timeout_sec)
+        return device.discover(cls.SERVICES, cls.CHARACTERISTICS, timeout_sec)
+
+    def rebind(self, device):
+        """Find this service's characteristics on the device again and restore
+        its notifications, called by a Session after the device reconnected.
+        The default runs __init__ again, services that keep state across
+        connections (like received data) should override it.
+        """
+        self.__init__(device)
+
+
+def registered_services():
+    """Return the registry of service classes: every subclass of ServiceBase
+    (and their subclasses) imported so far.  The services in this package are
+    imported the first time they're used, so import a service's module to
+    register it.
+    """
+    found = []
+    pending = list(ServiceBase.__subclasses__())
+    while len(pending) > 0:
+        service_class = pending.pop(0)
+        if service_class not in found:
+            found.append(service_class)
+            pending.extend(service_class.__subclasses__())
+    return found
+
+
+def bind_services(device, service_classes=(), timeout_sec=TIMEOUT_SEC):
+    """Discover the services and characteristics every one of the service
+    classes needs in one pass, then create each service from one listing of
+    the device's GATT table.  Returns the list of service objects in the same
+    order.  With no service classes everything is discovered and every
+    registered service the device has is created.  Raises a RuntimeError if
+    the services aren't discovered within timeout_sec.
+    """
+    deadline = as_deadline(timeout_sec)
+    service_uuids = set()
+    char_uuids = set()
+    for service_class in service_classes:
+        service_uuids.update(service_class.SERVICES)
+        char_uuids.update(service_class.CHARACTERISTICS)
+    if not device.discover(service_uuids, char_uuids, deadline):
+        raise RuntimeError('Failed to discover the services of {0}!'.format(device.id))
+    listing = _GattListing(device)
+    try:
+        if len(service_classes) == 0:
+            service_classes = [x for x in registered_services()
+                               if len(x.SERVICES) > 0 and listing._has(x.SERVICES, x.CHARACTERISTICS)]
+        return [x(listing) for x in service_classes]
+    finally:
+        listing._release()
+
+
+class _GattListing(object):
+    # Stand-in for a device handed to service constructors while binding.  The
+    # device's services, characteristics and their UUIDs are listed once and
+    # shared by every service instead of each find_service and
+    # find_characteristic listing them again.  Anything else goes to the
+    # device, and once released the listing passes everything through so
+    # services that keep it never see stale objects.
+
+    def __init__(self, device):
+        self._device = device
+        self._services = [_ListedService(x, self) for x in device.list_services()]
+        self._released = False
+
+    def list_services(self):
+        if self._released:
+            return self._device.list_services()
+        return list(self._services)
+
+    def find_service(self, uuid):
+        if self._released:
+            return self._device.find_service(uuid)
+        for service in self._services:
+            if service.uuid == uuid:
+                return service
+        return None
+
+    def _has(self, service_uuids, char_uuids):
+        services = set([x.uuid for x in self._services])
+        chars = set([uuid for x in self._services for uuid, char in x._chars])
+        return services >= set(service_uuids) and chars >= set(char_uuids)
+
+    def _release(self):
+        self._released = True
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+
+class _ListedService(GattService):
+    # Service whose characteristics and UUIDs were listed once by a
+    # _GattListing, until the listing is released.
+
+    def __init__(self, service, listing):
+        self._service = service
+        self._listing = listing
+        self._uuid = service.uuid
+        self._chars = [(x.uuid, x) for x in service.list_characteristics()]
+
+    @property
+    def uuid(self):
+        return self._uuid
+
+    def list_characteristics(self):
+        if self._listing._released:
+            return self._service.list_characteristics()
+        return [x[1] for x in self._chars]
+
+    def find_characteristic(self, uuid):
+        if self._listing._released:
+            return self._service.find_characteristic(uuid)
+        for char_uuid, char in self._chars:
+            if char_uuid == uuid:
+                return char
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self._service, name)
@@ -24,6 +24,7 @@
 import queue
 import uuid
 
+from .. import metrics
 from .servicebase import ServiceBase
 
 
@@ -40,9 +41,35 @@ class UART(ServiceBase):
     ADVERTISED = [UART_SERVICE_UUID]
     SERVICES = [UART_SERVICE_UUID]
     CHARACTERISTICS = [TX_CHAR_UUID, RX_CHAR_UUID]
+    # Write type of data sent to the TX characteristic.  None uses the TX
+    # characteristic's stream_write_type: the provider's usual write type,
+    # except that bluez sends writes without response through an acquired
+    # socket when it hands one out.  Set to WRITE_WITH_RESPONSE or
+    # WRITE_WITHOUT_RESPONSE (on the class or an instance) to force one.
+    WRITE_TYPE = None
 
     def __init__(self, device):
         """Initialize UART from provided bluez device."""
+        # Use a queue to pass data received from the RX property change back to
+        # the main thread in a thread-safe way.
+        self._queue = queue.Queue()
+        # Gauge of the data waiting in the queue, for spotting a reader that
+        # can't keep up.
+        self._queue_depth = None
+        if metrics.METRICS:
+            self._queue_depth = metrics.UART_QUEUE_DEPTH.labels(device.id)
+        self._rx = None
+        self.rebind(device)
+
+    def rebind(self, device):
+        """Find the UART service and characteristics on the device and
+        subscribe to received data.  Called again by a Session after the device
+        reconnected, data received before then stays queued.
+        """
+        # Drop the subscription of the RX characteristic of the lost link so
+        # data isn't received twice.
+        if self._rx is not None:
+            self._rx.release_notify()
         # Find the UART service and characteristics associated with the device.
         self._uart = device.find_service(UART_SERVICE_UUID)
         if self._uart is None:
@@ -51,9 +78,6 @@ class UART(ServiceBase):
         self._rx = self._uart.find_characteristic(RX_CHAR_UUID)
         if self._tx is None or self._rx is None:
             raise RuntimeError('Failed to find expected UART RX and TX characteristics!')
-        # Use a queue to pass data received from the RX property change back to
-        # the main thread in a thread-safe way.
-        self._queue = queue.Queue()
         # Subscribe to RX characteristic changes to receive data.
         self._rx.start_notify(self._rx_received)
 
@@ -62,10 +86,18 @@ class UART(ServiceBase):
         # Just throw the new data in the queue so the read function can access
         # it on the main thread.
         self._queue.put(data)
+        if self._queue_depth is not None:
+            self._queue_depth.set(self._queue.qsize())
 
     def write(self, data):
         """Write a string of data to the UART device."""
-        self._tx.write_value(data)
+        write_type = self.WRITE_TYPE
+        if write_type is None:
+            write_type = self._tx.stream_write_type()
+        if write_type is None:
+            self._tx.write_value(data)
+        else:
+            self._tx.write_value(data, write_type=write_type)
 
     def read(self, timeout_sec=None):
         """Block until data is available to read from the UART.  Will return a
@@ -75,7 +107,10 @@ class UART(ServiceBase):
         None is returned.
         """
         try:
-            return self._queue.get(timeout=timeout_sec)
+            data = self._queue.get(timeout=timeout_sec)
         except queue.Empty:
             # Timeout exceeded, return None to signify no data received.
             return None
+        if self._queue_depth is not None:
+            self._queue_depth.set(self._queue.qsize())
+        return data
@@ -0,0 +1,357 @@
+# Supervised connection to a device that reconnects when the link is lost and
+# restores its services, notification subscriptions and buffered writes.
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+import logging
+import threading
+import time
+
+from . import metrics
+from .config import TIMEOUT_SEC, RECONNECT_DELAY_SEC, RECONNECT_MAX_DELAY_SEC
+from .config import SESSION_MAX_PENDING_WRITES
+from .deadline import Cancelled, Deadline, as_deadline
+from .platform import get_provider
+from .services.servicebase import _GattListing
+
+
+logger = logging.getLogger(__name__)
+
+
+class Session(object):
+    """Keeps a device connected and the services on it usable.  open connects
+    to the device (unless it already is), discovers it and creates an instance
+    of each of the service classes.  When the link is lost a background thread
+    reconnects directly to the same device without scanning, waiting longer
+    after each failed attempt, then calls rebind on each service instance,
+    restarts every subscription made with start_notify and sends the writes
+    made with write while the device was disconnected.  Link loss is noticed
+    from the device's disconnect callbacks, or by polling is_connected on
+    providers that don't report disconnects.
+
+    Every attempt to reconnect waits up to timeout_sec.  Close the session (or
+    use it in a with statement) to stop reconnecting and disconnect.
+    """
+
+    def __init__(self, device, service_classes=(), timeout_sec=TIMEOUT_SEC,
+                 retry_sec=RECONNECT_DELAY_SEC, max_retry_sec=RECONNECT_MAX_DELAY_SEC,
+                 max_pending_writes=SESSION_MAX_PENDING_WRITES):
+        self._device = device
+        # The id is kept since the device object can stop working once the OS
+        # forgets the device.
+        self._device_id = device.id
+        self._service_classes = list(service_classes)
+        self._timeout_sec = timeout_sec
+        self._retry_sec = retry_sec
+        self._max_retry_sec = max_retry_sec
+        self._services = {}
+        # Notification callbacks by (service UUID, characteristic UUID).
+        self._subscriptions = {}
+        # Characteristic objects by (service UUID, characteristic UUID), found
+        # again after every reconnect.
+        self._characteristics = {}
+        # Writes waiting for the device to reconnect, sent in order.  The write
+        # lock keeps new writes behind them.
+        self._pending = collections.deque()
+        self._max_pending_writes = max_pending_writes
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._lost = threading.Event()
+        self._closed = threading.Event()
+        self._connected = False
+        self._events = True
+        self._lost_time = None
+        self._attempt = None
+        self._thread = None
+        self._reconnects = 0
+        self._failures = 0
+        self._dropped_writes = 0
+        self._outage_sec = 0.0
+        self._last_outage_sec = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def device(self):
+        """Return the session's device."""
+        return self._device
+
+    @property
+    def is_connected(self):
+        """Return True if the device is connected and the session restored."""
+        return self._connected
+
+    def open(self, timeout_sec=TIMEOUT_SEC):
+        """Connect to and discover the device, create the service instances
+        and start watching the connection.  Returns the session.
+        """
+        try:
+            self._device.add_disconnect_callback(self._link_lost)
+        except NotImplementedError:
+            self._events = False
+        self._closed.clear()
+        try:
+            self._restore(as_deadline(timeout_sec))
+        except Exception:
+            if self._events:
+                self._device.remove_disconnect_callback(self._link_lost)
+            raise
+        self._thread = threading.Thread(target=self._run,
+                                        name='BLE session {0}'.format(self._device_id))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, timeout_sec=TIMEOUT_SEC):
+        """Stop reconnecting, dropping any writes still waiting, and disconnect
+        from the device.
+        """
+        self._closed.set()
+        self._lost.set()
+        attempt = self._attempt
+        if attempt is not None:
+            attempt.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout_sec)
+            self._thread = None
+        if self._events:
+            self._device.remove_disconnect_callback(self._link_lost)
+        with self._lock:
+            self._pending.clear()
+        if self._connected:
+            self._connected = False
+            self._device.disconnect(timeout_sec)
+
+    def service(self, service_class):
+        """Return the session's instance of a service class.  It stays the same
+        object across reconnects.
+        """
+        return self._services[service_class]
+
+    def start_notify(self, service_uuid, char_uuid, on_change):
+        """Call on_change with each notification of the characteristic, and
+        subscribe again every time the device reconnects.
+        """
+        with self._lock:
+            self._subscriptions[(service_uuid, char_uuid)] = on_change
+        if self._connected:
+            self._characteristic(service_uuid, char_uuid).start_notify(on_change)
+
+    def stop_notify(self, service_uuid, char_uuid):
+        """Stop the notifications of a characteristic started with
+        start_notify.
+        """
+        with self._lock:
+            on_change = self._subscriptions.pop((service_uuid, char_uuid), None)
+        if on_change is not None and self._connected:
+            self._characteristic(service_uuid, char_uuid).stop_notify()
+
+    def write(self, service_uuid, char_uuid, value, write_type=None):
+        """Write the value to the characteristic if the device is connected,
+        otherwise keep it to write once the device reconnects.  When too many
+        writes are waiting the oldest is dropped.  Returns True if the value
+        was written now.
+        """
+        with self._write_lock:
+            if self._connected:
+                try:
+                    self._write(service_uuid, char_uuid, value, write_type)
+                    return True
+                except Exception:
+                    # Keep the write if it failed because the link was lost.
+                    if self._connected:
+                        raise
+            with self._lock:
+                if len(self._pending) >= self._max_pending_writes:
+                    self._pending.popleft()
+                    self._dropped_writes += 1
+                self._pending.append((service_uuid, char_uuid, value, write_type))
+            return False
+
+    def stats(self):
+        """Return a dict of whether the session is connected, the number of
+        reconnects and failed attempts, the total and last outage in seconds,
+        and the writes waiting to be sent and dropped.
+        """
+        with self._lock:
+            return {
+                'connected':       self._connected,
+                'reconnects':      self._reconnects,
+                'failures':        self._failures,
+                'outage_sec':      self._outage_sec,
+                'last_outage_sec': self._last_outage_sec,
+                'pending_writes':  len(self._pending),
+                'dropped_writes':  self._dropped_writes
+            }
+
+    def _link_lost(self):
+        # Disconnect callback, called on the provider's main loop so it only
+        # flags the loss for the session's thread.
+        if self._closed.is_set():
+            return
+        self._connected = False
+        if self._lost_time is None:
+            self._lost_time = time.time()
+        self._lost.set()
+
+    def _run(self):
+        while True:
+            self._lost.wait(None if self._events else self._retry_sec)
+            if self._closed.is_set():
+                return
+            if not self._lost.is_set():
+                # Without disconnect callbacks, poll the connection.
+                try:
+                    if self._device.is_connected:
+                        continue
+                except Exception:
+                    pass
+                self._link_lost()
+            self._lost.clear()
+            logger.info('Lost connection to {0}, reconnecting'.format(self._device_id))
+            self._reconnect()
+
+    def _reconnect(self):
+        # Try to restore the session until it works or the session is closed.
+        delay = self._retry_sec
+        while not self._closed.is_set():
+            start = time.time()
+            self._attempt = Deadline(self._timeout_sec)
+            try:
+                self._restore(self._attempt)
+            except Cancelled:
+                return
+            except Exception as ex:
+                logger.warning('Failed to reconnect to {0}: {1}'.format(self._device_id, ex))
+                with self._lock:
+                    self._failures += 1
+                self._closed.wait(delay)
+                delay = min(delay*2, self._max_retry_sec)
+                continue
+            finally:
+                self._attempt = None
+            now = time.time()
+            outage = now - self._lost_time
+            self._lost_time = None
+            with self._lock:
+                self._reconnects += 1
+                self._outage_sec += outage
+                self._last_outage_sec = outage
+            if metrics.METRICS:
+                device_id = str(self._device_id)
+                metrics.RECONNECTS.labels(device_id).inc()
+                metrics.RECONNECT_SECONDS.labels(device_id).observe(now - start)
+                metrics.OUTAGE_SECONDS.labels(device_id).observe(outage)
+            logger.info('Reconnected to {0} after {1:.1f} seconds'.format(self._device_id, outage))
+            return
+
+    def _restore(self, deadline):
+        # Connect, discover and rebind services and subscriptions, then send
+        # the writes made while disconnected.  The characteristics of the lost
+        # link drop their notification callbacks first, some providers would
+        # deliver every notification to them as well.
+        with self._lock:
+            characteristics = list(self._characteristics.values())
+            self._characteristics = {}
+        for char in characteristics:
+            char.release_notify()
+        if not self._device.is_connected:
+            self._connect(deadline)
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        service_uuids = set(x[0][0] for x in subscriptions)
+        char_uuids = set(x[0][1] for x in subscriptions)
+        for service_class in self._service_classes:
+            service_uuids.update(service_class.SERVICES)
+            char_uuids.update(service_class.CHARACTERISTICS)
+        if not self._device.discover(service_uuids, char_uuids, deadline):
+            raise RuntimeError('Failed to discover the services of {0}!'.format(self._device_id))
+        # Bind every service from one listing of the device's GATT table.
+        listing = _GattListing(self._device)
+        try:
+            for service_class in self._service_classes:
+                service = self._services.get(service_class)
+                if service is None:
+                    self._services[service_class] = service_class(listing)
+                else:
+                    service.rebind(listing)
+        finally:
+            listing._release()
+        for (service_uuid, char_uuid), on_change in subscriptions:
+            self._characteristic(service_uuid, char_uuid).start_notify(on_change)
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    if len(self._pending) == 0:
+                        break
+                    write = self._pending[0]
+                self._write(*write)
+                with self._lock:
+                    self._pending.popleft()
+            # Not connected if the link was lost again while restoring, the
+            # session's thread tries again.
+            self._connected = not self._lost.is_set()
+
+    def _connect(self, deadline):
+        # Connect straight to the device the session already knows.  If the OS
+        # forgot that device object, connect by address instead, which gives a
+        # new device object.
+        try:
+            self._device.connect(deadline)
+            return
+        except Cancelled:
+            raise
+        except Exception as ex:
+            logger.debug('Failed to connect to {0}, connecting by address: {1}'.format(
+                self._device_id, ex))
+        device = get_provider().connect_address(self._device_id, timeout_sec=deadline)
+        if self._events:
+            self._device.remove_disconnect_callback(self._link_lost)
+            device.add_disconnect_callback(self._link_lost)
+        self._device = device
+
+    def _characteristic(self, service_uuid, char_uuid):
+        # Return the characteristic, finding it on the device the first time
+        # since the last restore.
+        key = (service_uuid, char_uuid)
+        with self._lock:
+            char = self._characteristics.get(key)
+        if char is not None:
+            return char
+        service = self._device.find_service(service_uuid)
+        char = service.find_characteristic(char_uuid) if service is not None else None
+        if char is None:
+            raise RuntimeError('Failed to find characteristic {0} of service {1}!'.format(
+                char_uuid, service_uuid))
+        with self._lock:
+            return self._characteristics.setdefault(key, char)
+
+    def _write(self, service_uuid, char_uuid, value, write_type):
+        char = self._characteristic(service_uuid, char_uuid)
+        if write_type is None:
+            char.write_value(value)
+        else:
+            char.write_value(value, write_type=write_type)
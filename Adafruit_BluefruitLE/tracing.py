@@ -0,0 +1,239 @@
+# Span based tracing of BLE operations, kept in an in-memory ring buffer and
+# exportable as Chrome trace event JSON.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import collections
+import itertools
+import os
+import threading
+import time
+
+from .config import TRACE, TRACE_CAPACITY
+
+
+# A finished span or instant event: name, device, start time and duration in
+# seconds (duration is None for instant events), the name of the thread that
+# recorded it, the id of the enclosing span on that thread (or None), and a
+# dict of extra arguments.
+TraceEvent = collections.namedtuple('TraceEvent',
+    'name device start duration thread parent args')
+
+
+class _NullSpan(object):
+    # Span returned while tracing is disabled, does nothing.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """A timed operation, use as a context manager.  Spans opened inside
+    another span on the same thread inherit its device and record it as their
+    parent.  Extra arguments can be added with set while the span is open.
+    """
+
+    def __init__(self, tracer, name, device, args):
+        self._tracer = tracer
+        self._name = name
+        self._device = device
+        self._args = args
+        self._id = None
+        self._parent = None
+        self._start = None
+
+    def __enter__(self):
+        stack = self._tracer._stack()
+        if stack:
+            parent = stack[-1]
+            self._parent = parent._id
+            if self._device is None:
+                self._device = parent._device
+        self._id = next(self._tracer._ids)
+        stack.append(self)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self._start
+        self._tracer._stack().pop()
+        if exc_type is not None:
+            self._args['error'] = '{0}: {1}'.format(exc_type.__name__, exc_value)
+        self._tracer._record(TraceEvent(self._name, self._device, self._start,
+                                        duration, threading.current_thread().name,
+                                        self._parent, self._args))
+        return False
+
+    def set(self, key, value):
+        """Add an argument to the span, like the size of a value."""
+        self._args[key] = value
+
+
+class Tracer(object):
+    """Records spans of BLE operations (scans, connects, discovery, reads,
+    writes, notifications) in a ring buffer of the most recent capacity events.
+    Each event is tagged with the device it was for so a device's timeline can
+    be followed from finding it to its first notification.  Tracing is
+    disabled until enable is called, and while disabled a span costs one
+    attribute check.
+    """
+
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.enabled = False
+        self._events = collections.deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def enable(self, capacity=None):
+        """Start recording events, optionally changing the number of events
+        kept (which clears the buffer).
+        """
+        if capacity is not None and capacity != self._events.maxlen:
+            self._events = collections.deque(maxlen=capacity)
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording events.  Events already recorded are kept."""
+        self.enabled = False
+
+    def clear(self):
+        """Remove every recorded event."""
+        self._events.clear()
+
+    def span(self, name, device=None, **args):
+        """Return a context manager that records how long the enclosed code
+        takes as an event with the specified name, device (its address or id),
+        and extra arguments.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, device, args)
+
+    def instant(self, name, device=None, **args):
+        """Record an event that happened at this moment, like a notification
+        arriving.
+        """
+        if not self.enabled:
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if device is None and parent is not None:
+            device = parent._device
+        self._record(TraceEvent(name, device, time.time(), None,
+                                threading.current_thread().name,
+                                parent._id if parent is not None else None,
+                                args))
+
+    def events(self, device=None):
+        """Return a list of the recorded events, oldest first, optionally only
+        the ones for the specified device.
+        """
+        events = list(self._events)
+        if device is not None:
+            device = str(device)
+            events = [x for x in events if x.device is not None and str(x.device) == device]
+        return events
+
+    def to_chrome(self):
+        """Return the recorded events as a Chrome trace event dict that
+        chrome://tracing and Perfetto can load.  Each device gets its own
+        track, events without a device go on a track named 'provider'.
+        """
+        pid = os.getpid()
+        tracks = collections.OrderedDict()
+        tracks['provider'] = 0
+        trace_events = []
+        for event in list(self._events):
+            track = 'provider' if event.device is None else str(event.device)
+            if track not in tracks:
+                tracks[track] = len(tracks)
+            args = dict(event.args)
+            args['thread'] = event.thread
+            record = {
+                'name': event.name,
+                'cat':  event.name.split('.', 1)[0],
+                'pid':  pid,
+                'tid':  tracks[track],
+                'ts':   event.start * 1e6,
+                'args': dict((k, v if isinstance(v, (int, float, bool)) else str(v))
+                             for k, v in args.items())
+            }
+            if event.duration is None:
+                record['ph'] = 'i'
+                record['s'] = 't'
+            else:
+                record['ph'] = 'X'
+                record['dur'] = event.duration * 1e6
+            trace_events.append(record)
+        for track, tid in tracks.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                                 'tid': tid, 'args': {'name': track}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome(self, path):
+        """Write the recorded events to a Chrome trace event JSON file."""
+        import json
+        with open(path, 'w') as output:
+            json.dump(self.to_chrome(), output)
+
+    def first_call(self, callback, name, device=None, **args):
+        """Return the callback wrapped to record an instant event the first
+        time it's called, like the first notification after subscribing.
+        Returns the callback unchanged while tracing is disabled.
+        """
+        if not self.enabled:
+            return callback
+        subscribed = time.time()
+        called = []
+        def wrapper(*values):
+            if not called:
+                called.append(True)
+                self.instant(name, device, since_subscribe_ms=(time.time() - subscribed)*1000.0, **args)
+            return callback(*values)
+        return wrapper
+
+    def _stack(self):
+        # Stack of the spans open on this thread.
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, event):
+        self._events.append(event)
+
+
+# Tracer used by the library's providers.
+tracer = Tracer()
+if TRACE:
+    tracer.enable()
+span = tracer.span
+instant = tracer.instant
+first_call = tracer.first_call
@@ -0,0 +1,98 @@
+# Shared table of canonical UUID objects, so the providers don't parse and
+# create a new uuid.UUID every time they read a UUID from the Bluetooth stack,
+# and conversions between UUIDs and the short 16-bit and 32-bit form of
+# Bluetooth SIG UUIDs.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from binascii import hexlify
+import uuid
+
+
+# Bluetooth SIG base UUID, a 16-bit or 32-bit UUID is its value shifted into
+# the first 32 bits of the base.
+BASE_UUID = uuid.UUID('00000000-0000-1000-8000-00805F9B34FB')
+
+# The table is emptied when it grows past this many keys, so a long scan
+# seeing random UUIDs can't grow it forever.
+_MAX_INTERNED = 10000
+
+_BASE_INT = BASE_UUID.int
+_LOW_MASK = (1 << 96) - 1
+
+# Dict of raw UUID (a string in any format bluez or the user gives, or the
+# bytes of a UUID) to the canonical uuid.UUID.
+_interned = {}
+
+
+def _intern(key, make):
+    # Return the UUID interned for the key, making it the first time.  Every
+    # key for the same UUID maps to the same object.
+    result = _interned.get(key)
+    if result is None:
+        if len(_interned) >= _MAX_INTERNED:
+            _interned.clear()
+        result = make()
+        result = _interned.setdefault(result.bytes, result)
+        _interned[key] = result
+    return result
+
+
+def intern_uuid(value):
+    """Return the canonical uuid.UUID for a UUID string (like a bluez UUID
+    property) or UUID object, parsing each string only the first time it's
+    seen.
+    """
+    # Look up strings seen before without another function call, this is the
+    # hot path.
+    result = _interned.get(value)
+    if result is not None:
+        return result
+    if isinstance(value, uuid.UUID):
+        return _intern(value.bytes, lambda: value)
+    return _intern(value, lambda: uuid.UUID(str(value)))
+
+
+def intern_uuid_bytes(data):
+    """Return the canonical uuid.UUID for the bytes of a UUID: 16 bytes for a
+    full UUID, or 2 or 4 bytes (big endian) for a Bluetooth SIG UUID, like
+    the data of a CoreBluetooth CBUUID.
+    """
+    data = bytes(data)
+    if len(data) <= 4:
+        return _intern(data, lambda: sig_uuid(int(hexlify(data), 16)))
+    return _intern(data, lambda: uuid.UUID(bytes=data[:16]))
+
+
+def sig_uuid(short):
+    """Return the canonical uuid.UUID of a 16-bit or 32-bit Bluetooth SIG
+    UUID, like 0x180A for the device information service.
+    """
+    return _intern(short, lambda: uuid.UUID(int=_BASE_INT | (short << 96)))
+
+
+def short_uuid(value):
+    """Return the 16-bit or 32-bit integer form of a Bluetooth SIG UUID, or
+    None if the UUID isn't based on the SIG base UUID.
+    """
+    if value.int & _LOW_MASK != _BASE_INT:
+        return None
+    return value.int >> 96
@@ -0,0 +1,168 @@
+# Cache of characteristic values read from devices, so values that rarely or
+# never change (like the device information service's) aren't read over the
+# air again every time they're used.
+#
+#
+# Copyright (c) 2015 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import logging
+import threading
+import time
+
+from . import metrics
+from .config import TIMEOUT_SEC, VALUE_CACHE_TTL_SEC
+from .uuids import sig_uuid
+
+
+logger = logging.getLogger(__name__)
+
+# Policy for values that are kept until the device disconnects or its services
+# change.
+FOREVER = None
+
+
+# Characteristics of the device information service, which don't change while
+# a device is connected: system ID, model, serial, firmware, hardware and
+# software revisions, manufacturer, regulatory certification, and PnP ID.
+DIS_CHAR_UUIDS = [sig_uuid(x) for x in range(0x2A23, 0x2A2B)] + [sig_uuid(0x2A50)]
+
+
+def _device_key(device):
+    # Return the key of a device's values.  Bluez devices know their address
+    # from their object path, so avoid a round trip to read their id.
+    return str(getattr(device, '_address', None) or device.id)
+
+
+class ValueCache(object):
+    """Cache of characteristic values by device and characteristic UUID.  How
+    long a value is kept is set by the policy of its UUID: FOREVER keeps it
+    until the device disconnects or its services change, a number of seconds
+    keeps it that long, and 0 doesn't cache it.  UUIDs without a policy use
+    default_ttl_sec (VALUE_CACHE_TTL_SEC by default).  Device information
+    service characteristics are cached forever.
+    """
+
+    def __init__(self, default_ttl_sec=VALUE_CACHE_TTL_SEC):
+        self._default_ttl_sec = default_ttl_sec
+        self._policies = dict((x, FOREVER) for x in DIS_CHAR_UUIDS)
+        self._lock = threading.Lock()
+        # Dict of device key to dict of characteristic UUID to a tuple of
+        # value and expiry time (None for never).
+        self._values = {}
+        # Disconnect callback of each device key.
+        self._callbacks = {}
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def set_policy(self, char_uuid, ttl_sec):
+        """Set how long values of the characteristic UUID are cached: FOREVER,
+        a number of seconds, or 0 to not cache them.
+        """
+        with self._lock:
+            self._policies[char_uuid] = ttl_sec
+
+    def policy(self, char_uuid):
+        """Return how long values of the characteristic UUID are cached."""
+        return self._policies.get(char_uuid, self._default_ttl_sec)
+
+    def read(self, device, characteristic, char_uuid=None, timeout_sec=TIMEOUT_SEC):
+        """Return the value of a characteristic of the device, from the cache
+        if it holds a current value, otherwise read from the device (waiting up
+        to timeout_sec) and cached according to the UUID's policy.  Pass the
+        characteristic's UUID as char_uuid if it's known to save looking it up.
+        """
+        if char_uuid is None:
+            char_uuid = characteristic.uuid
+        ttl_sec = self.policy(char_uuid)
+        if ttl_sec == 0:
+            return characteristic.read_value(timeout_sec=timeout_sec)
+        key = _device_key(device)
+        with self._lock:
+            entry = self._values.get(key, {}).get(char_uuid)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                self._hits += 1
+                if metrics.METRICS:
+                    metrics.VALUE_CACHE_HITS.labels().inc()
+                return entry[0]
+            self._misses += 1
+        if metrics.METRICS:
+            metrics.VALUE_CACHE_MISSES.labels().inc()
+        self._watch(device, key)
+        value = characteristic.read_value(timeout_sec=timeout_sec)
+        expires = time.time() + ttl_sec if ttl_sec is not FOREVER else None
+        with self._lock:
+            self._values.setdefault(key, {})[char_uuid] = (value, expires)
+        return value
+
+    def invalidate(self, device_id=None, char_uuid=None):
+        """Forget cached values: of the device with the id if specified, of
+        the characteristic UUID if specified, or everything.
+        """
+        with self._lock:
+            for key in list(self._values):
+                if device_id is not None and key != str(device_id):
+                    continue
+                values = self._values[key]
+                if char_uuid is None:
+                    self._invalidations += len(values)
+                    del self._values[key]
+                elif values.pop(char_uuid, None) is not None:
+                    self._invalidations += 1
+
+    def stats(self):
+        """Return a dict with the number of hits, misses, cached values, and
+        values invalidated.
+        """
+        with self._lock:
+            return {
+                'hits':          self._hits,
+                'misses':        self._misses,
+                'entries':       sum(len(x) for x in self._values.values()),
+                'invalidations': self._invalidations
+            }
+
+    def _watch(self, device, key):
+        # Forget the device's values when it disconnects.  Some providers
+        # create a device object for each lookup but share their callbacks, so
+        # use one callback per device and replace it instead of adding another.
+        with self._lock:
+            callback = self._callbacks.get(key)
+            if callback is None:
+                callback = lambda: self.invalidate(key)
+                self._callbacks[key] = callback
+        try:
+            device.remove_disconnect_callback(callback)
+            device.add_disconnect_callback(callback)
+        except NotImplementedError:
+            # The gateway can't tell us about disconnects, values expire by
+            # their policy or are forgotten when the services change.
+            logger.debug('Device {0} does not report disconnects.'.format(key))
+
+
+# Cache used by the services in this library.
+VALUE_CACHE = ValueCache()
+
+
+def services_changed(device_id):
+    """Forget the cached values of a device whose services changed, called by
+    the providers.
+    """
+    VALUE_CACHE.invalidate(device_id)
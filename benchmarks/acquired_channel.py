@@ -0,0 +1,109 @@
+# Benchmark of the socket bluez hands out for AcquireWrite and AcquireNotify,
+# with a SOCK_SEQPACKET socket pair standing in for bluez's end.  Checks that
+# writes are split into MTU sized packets and arrive intact, that
+# notifications are read one packet per value, and that a hang up is
+# noticed, then measures write and notification throughput through
+# AcquiredChannel.  Needs Linux (for SOCK_SEQPACKET) but no Bluetooth stack.
+#
+# Usage: python acquired_channel.py [values] [mtu]
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.bluez_dbus.channel import AcquiredChannel
+
+
+def drain(sock, mtu, expected, packets):
+    # Read packets from bluez's end of the pair until expected bytes arrived.
+    received = 0
+    while received < expected:
+        packet = sock.recv(mtu + 64)
+        packets.append(packet)
+        received += len(packet)
+
+
+def check_framing(mtu):
+    # Write values of several sizes and check the packets bluez would see.
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    channel = AcquiredChannel(ours, mtu)
+    for size in (1, mtu - 1, mtu, mtu + 1, 3*mtu + 5):
+        value = bytes(bytearray(i % 256 for i in range(size)))
+        channel.write(value)
+        packets = []
+        drain(theirs, mtu, size, packets)
+        assert all(len(x) <= mtu for x in packets), 'Packet larger than the MTU!'
+        assert len(packets) == -(-size // mtu), 'Value split into the wrong number of packets!'
+        assert b''.join(packets) == value, 'Value changed in transit!'
+    # Each notification packet is passed on as one bytes value.
+    values = [b'\x01' * mtu, b'\x02', b'\x03\x04']
+    for value in values:
+        theirs.send(value)
+    received = []
+    assert channel.read_available(received.append), 'Channel closed too early!'
+    assert received == values and all(isinstance(x, bytes) for x in received)
+    # Bluez closing its end closes the channel.
+    theirs.close()
+    assert not channel.read_available(received.append) and channel.closed
+    print('MTU {0}: framing, notifications and hang up OK'.format(mtu))
+
+
+def write_rate(values, mtu):
+    # Return the values per second written through the channel while another
+    # thread reads them like bluez would.
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    channel = AcquiredChannel(ours, mtu)
+    value = b'\x5a' * mtu
+    packets = []
+    reader = threading.Thread(target=drain, args=(theirs, mtu, values*mtu, packets))
+    reader.start()
+    start = time.time()
+    for i in range(values):
+        channel.write(value)
+    reader.join()
+    elapsed = time.time() - start
+    channel.close()
+    theirs.close()
+    assert len(packets) == values
+    return values/elapsed
+
+
+def notify_rate(values, mtu):
+    # Return the values per second read from the channel, sent in bursts that
+    # fit the socket buffer like a main loop watch would see them.
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    channel = AcquiredChannel(ours, mtu)
+    value = b'\x5a' * mtu
+    received = [0]
+    def on_data(data):
+        received[0] += 1
+    start = time.time()
+    sent = 0
+    while sent < values:
+        burst = min(64, values - sent)
+        for i in range(burst):
+            theirs.send(value)
+        sent += burst
+        channel.read_available(on_data)
+    elapsed = time.time() - start
+    channel.close()
+    theirs.close()
+    assert received[0] == values
+    return values/elapsed
+
+
+def main():
+    values = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    mtu = int(sys.argv[2]) if len(sys.argv) > 2 else 244
+    for size in (20, mtu):
+        check_framing(size)
+    print('{0} writes of {1} bytes: {2:.0f} values per second'.format(
+        values, mtu, write_rate(values, mtu)))
+    print('{0} notifications of {1} bytes: {2:.0f} values per second'.format(
+        values, mtu, notify_rate(values, mtu)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Benchmark of the advertisement store under device churn: a simulated scan
+# where new devices keep appearing and old ones stop advertising.  Measures the
+# cost of each advertisement as the number of devices seen grows and checks the
+# store only holds the devices seen within its TTL.  Needs no Bluetooth stack.
+#
+# Usage: python advertisement_store.py [advertisements] [devices in range]
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.advertisements import AdvertisementStore
+
+
+TTL_SEC = 60
+# Simulated time between advertisements, and how long each device advertises
+# before it leaves range.
+INTERVAL_SEC = 0.001
+LIFETIME_SEC = 30
+UUIDS = [uuid.UUID('6E400001-B5A3-F393-E0A9-E50E24DCCA9E')]
+PAYLOAD = {'manufacturer_data': {0x0822: b'\x01\x02\x03\x04'}}
+
+
+def main():
+    advertisements = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    in_range = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    now = [0.0]
+    store = AdvertisementStore(ttl_sec=TTL_SEC, clock=lambda: now[0])
+    # Every device advertises for LIFETIME_SEC and is then replaced by a new
+    # one, so the number of devices ever seen keeps growing.
+    per_device = int(LIFETIME_SEC / INTERVAL_SEC / in_range)
+    expected = int((LIFETIME_SEC + TTL_SEC) / LIFETIME_SEC + 1) * in_range
+    chunk = advertisements // 4
+    print('{0} devices in range, each advertising for {1} s, {2} s TTL'.format(
+        in_range, LIFETIME_SEC, TTL_SEC))
+    peak = 0
+    for part in range(4):
+        start = time.time()
+        for i in range(part*chunk, (part + 1)*chunk):
+            now[0] += INTERVAL_SEC
+            device = (i % in_range) + in_range*(i // (in_range*per_device))
+            store.update(device, uuids=UUIDS, data=PAYLOAD, rssi=-60)
+            peak = max(peak, len(store))
+        elapsed = time.time() - start
+        print('{0:8d} devices seen: {1:.2f} us per advertisement, {2} stored, {3} expired'.format(
+            device + 1, elapsed/chunk*1e6, len(store), store.stats()['expired']))
+    print('Peak of {0} stored devices (at most {1} expected)'.format(peak, expected))
+    return 0 if peak <= expected else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
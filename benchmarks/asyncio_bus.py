@@ -0,0 +1,184 @@
+# Benchmark of the asyncio DBus provider (bluez_asyncio) against the dbus-python
+# provider (bluez_dbus) on a private stand-in bus.  Starts a dbus-daemon and a
+# fake bluez service that owns the org.bluez name, points the providers at it
+# with DBUS_SYSTEM_BUS_ADDRESS, and measures startup, listing devices,
+# characteristic reads and writes (sequential and from several threads at
+# once), and notification throughput.  Needs the dbus-daemon program but no
+# Bluetooth hardware.  The dbus-python provider is skipped when dbus-python
+# isn't installed.
+#
+# Usage: python asyncio_bus.py [operations]
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Adafruit_BluefruitLE.platform
+from Adafruit_BluefruitLE.bluez_asyncio.bus import MessageBus, DBusError
+from Adafruit_BluefruitLE.bluez_asyncio.message import Variant
+
+
+DEVICES = 100
+THREADS = 4
+NOTIFICATIONS = 2000
+SERVICE_UUID = '6e400001-b5a3-f393-e0a9-e50e24dcca9e'
+CHAR_UUIDS = ['6e40000{0}-b5a3-f393-e0a9-e50e24dcca9e'.format(x) for x in range(2, 2 + THREADS)]
+PAYLOAD = b'\x5a' * 20
+
+
+def stand_in_tree():
+    """Return the fake bluez object tree as a dict of path to a dict of
+    interface name to a dict of properties (as Variants).
+    """
+    tree = {'/org/bluez/hci0': {'org.bluez.Adapter1': {
+        'Name':        Variant('s', 'hci0'),
+        'Powered':     Variant('b', True),
+        'Discovering': Variant('b', False)}}}
+    for i in range(DEVICES):
+        path = '/org/bluez/hci0/dev_00_11_22_33_{0:02X}_{1:02X}'.format(i // 256, i % 256)
+        tree[path] = {'org.bluez.Device1': {
+            'Address':   Variant('s', path[-17:].replace('_', ':')),
+            'Name':      Variant('s', 'Device {0}'.format(i)),
+            'UUIDs':     Variant('as', [SERVICE_UUID]),
+            'Connected': Variant('b', i == 0),
+            'RSSI':      Variant('n', -60),
+            'Adapter':   Variant('o', '/org/bluez/hci0')}}
+    device = '/org/bluez/hci0/dev_00_11_22_33_00_00'
+    tree[device + '/service0001'] = {'org.bluez.GattService1': {
+        'UUID':    Variant('s', SERVICE_UUID),
+        'Device':  Variant('o', device),
+        'Primary': Variant('b', True)}}
+    for i, char_uuid in enumerate(CHAR_UUIDS):
+        tree[device + '/service0001/char{0:04x}'.format(i + 2)] = {'org.bluez.GattCharacteristic1': {
+            'UUID':    Variant('s', char_uuid),
+            'Service': Variant('o', device + '/service0001'),
+            'Value':   Variant('ay', b''),
+            'Flags':   Variant('as', ['read', 'write', 'notify'])}}
+    return tree
+
+
+async def stand_in_main(address):
+    # Serve the fake bluez objects on the bus at the specified address.
+    loop = asyncio.get_event_loop()
+    bus = MessageBus(loop)
+    await bus.connect(address)
+    await bus.request_name('org.bluez')
+    tree = stand_in_tree()
+    def handle(message):
+        if message.member == 'GetManagedObjects':
+            return 'a{oa{sa{sv}}}', (tree,)
+        if message.member == 'Introspect':
+            return 's', ('<node></node>',)
+        if message.member == 'Get':
+            return 'v', (tree[message.path][message.body[0]][message.body[1]],)
+        if message.member == 'ReadValue':
+            return 'ay', (PAYLOAD,)
+        if message.member == 'StartNotify':
+            # Send a burst of notifications right after replying.
+            loop.call_soon(notify_burst, message.path)
+            return '', ()
+        if message.member in ('WriteValue', 'StopNotify', 'Set', 'AddMatch'):
+            return '', ()
+        raise DBusError('org.freedesktop.DBus.Error.UnknownMethod', message.member)
+    def notify_burst(path):
+        for i in range(NOTIFICATIONS):
+            bus.emit(path, 'org.freedesktop.DBus.Properties', 'PropertiesChanged',
+                     'sa{sv}as', ('org.bluez.GattCharacteristic1',
+                                  {'Value': Variant('ay', PAYLOAD)}, []))
+    bus.export('/', handle)
+    for path in tree:
+        bus.export(path, handle)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    # Serve until the benchmark terminates this process.
+    await loop.create_future()
+
+
+def bench(name, provider, operations):
+    """Run every measurement against an uninitialized provider and print the
+    results.
+    """
+    Adafruit_BluefruitLE.platform._provider = provider
+    start = time.time()
+    provider.initialize()
+    provider.start()
+    print('{0:>14}: {1:>10.3f} ms  startup'.format(name, (time.time() - start)*1000.0))
+    try:
+        start = time.time()
+        for i in range(10):
+            names = [x.name for x in provider.list_devices()]
+        print('{0:>14}: {1:>10.3f} ms  list {2} devices and names'.format(
+            name, (time.time() - start)*1000.0/10, len(names)))
+        device = [x for x in provider.list_devices() if x.is_connected][0]
+        chars = device.list_services()[0].list_characteristics()
+        for label, action in (('read', lambda c: c.read_value()),
+                              ('write', lambda c: c.write_value(PAYLOAD))):
+            start = time.time()
+            for i in range(operations):
+                action(chars[0])
+            elapsed = time.time() - start
+            print('{0:>14}: {1:>10.1f} us  per sequential {2}'.format(
+                name, elapsed*1000000.0/operations, label))
+            # Each thread works on its own characteristic, so the operations
+            # can be in flight at the same time.
+            def worker(char):
+                for i in range(operations // THREADS):
+                    action(char)
+            threads = [threading.Thread(target=worker, args=(x,)) for x in chars]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+            print('{0:>14}: {1:>10.1f} us  per {2} from {3} threads'.format(
+                name, elapsed*1000000.0/operations, label, THREADS))
+        received = []
+        done = threading.Event()
+        def on_change(value):
+            received.append(value)
+            if len(received) == NOTIFICATIONS:
+                done.set()
+        start = time.time()
+        chars[0].start_notify(on_change)
+        if not done.wait(30):
+            print('{0:>14}: only received {1} notifications!'.format(name, len(received)))
+        else:
+            elapsed = time.time() - start
+            print('{0:>14}: {1:>10.0f}     notifications per second'.format(name, NOTIFICATIONS/elapsed))
+        chars[0].stop_notify()
+    finally:
+        provider.stop()
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address=1'],
+                              stdout=subprocess.PIPE)
+    address = daemon.stdout.readline().decode('ascii').strip()
+    stand_in = subprocess.Popen([sys.executable, __file__, '--stand-in', address],
+                                stdout=subprocess.PIPE)
+    try:
+        stand_in.stdout.readline()
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = address
+        from Adafruit_BluefruitLE.bluez_asyncio.provider import AsyncioBluezProvider
+        bench('bluez_asyncio', AsyncioBluezProvider(), operations)
+        try:
+            from Adafruit_BluefruitLE.bluez_dbus.provider import BluezProvider
+        except ImportError:
+            print('dbus-python is not installed, skipping the bluez_dbus provider.')
+        else:
+            bench('bluez_dbus', BluezProvider(), operations)
+    finally:
+        stand_in.terminate()
+        daemon.terminate()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--stand-in':
+        asyncio.run(stand_in_main(sys.argv[2]))
+    else:
+        main()
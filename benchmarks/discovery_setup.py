@@ -0,0 +1,54 @@
+# Benchmark of connection setup time against the size of a device's GATT
+# table: connecting to a fake device and discovering everything on it, as
+# discovery used to, compared with discovering only the service and
+# characteristics the UART service needs.  The fake device takes a fixed time
+# for each attribute it discovers to model the round trips of a real stack.
+# Needs no Bluetooth stack.
+#
+# Usage: python discovery_setup.py [ms per attribute] [characteristics per service]
+import sys
+import time
+import uuid
+
+from fake_provider import FakeDevice
+from Adafruit_BluefruitLE.services.uart import UART, UART_SERVICE_UUID, TX_CHAR_UUID, RX_CHAR_UUID
+
+
+def make_device(services, chars_per_service, attribute_sec):
+    # Return a fake device with the UART service and services-1 other services.
+    table = {UART_SERVICE_UUID: {TX_CHAR_UUID: b'', RX_CHAR_UUID: b''}}
+    for i in range(1, services):
+        service_uuid = uuid.UUID(int=(i << 96) | 0x1000)
+        table[service_uuid] = dict((uuid.UUID(int=(i << 96) | j), b'')
+                                   for j in range(chars_per_service))
+    return FakeDevice('00:11:22:33:44:55', 'Fake', [UART_SERVICE_UUID], table,
+                      attribute_sec=attribute_sec)
+
+
+def setup_time(device, discover):
+    # Return the seconds to connect and discover, and the attributes found.
+    start = time.time()
+    device.connect()
+    discover(device)
+    elapsed = time.time() - start
+    device.disconnect()
+    return elapsed, device.discovered_attributes
+
+
+def main():
+    attribute_sec = (float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)/1000.0
+    chars_per_service = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    print('{0:.1f} ms per attribute, {1} characteristics per service'.format(
+        attribute_sec*1000.0, chars_per_service))
+    print('{0:>9} {1:>12} {2:>10} {3:>12} {4:>10}'.format(
+        'services', 'full ms', 'attributes', 'UART only ms', 'attributes'))
+    for services in (1, 5, 10, 25, 50):
+        device = make_device(services, chars_per_service, attribute_sec)
+        full, full_count = setup_time(device, lambda x: x.discover([], []))
+        selective, selective_count = setup_time(device, UART.discover)
+        print('{0:>9} {1:>12.1f} {2:>10} {3:>12.1f} {4:>10}'.format(
+            services, full*1000.0, full_count, selective*1000.0, selective_count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# In-memory fake BLE provider used by the benchmarks.  Implements the library's
+# Provider, Adapter, Device, and GATT interfaces without any bluetooth stack so
+# library code can be measured on any machine.  Call install() to make it the
+# provider returned by Adafruit_BluefruitLE.get_provider().
+import os
+import sys
+import time
+import uuid
+
+# Run against the library in this repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Adafruit_BluefruitLE.platform
+from Adafruit_BluefruitLE.config import TIMEOUT_SEC
+from Adafruit_BluefruitLE.interfaces import Provider, Adapter, Device
+from Adafruit_BluefruitLE.interfaces import GattService, GattCharacteristic, GattDescriptor
+
+
+class FakeProvider(Provider):
+    """Provider with a fixed list of fake devices and one fake adapter."""
+
+    def __init__(self, devices=None):
+        self._adapter = FakeAdapter()
+        self._devices = list(devices) if devices is not None else []
+
+    def add_device(self, device):
+        self._devices.append(device)
+        return device
+
+    def initialize(self):
+        pass
+
+    def run_mainloop_with(self, target, on_mainloop=False):
+        # There are no asyncronous events so just run the target directly.
+        return_code = target()
+        sys.exit(return_code if return_code is not None else 0)
+
+    def start(self, timeout_sec=None):
+        pass
+
+    def stop(self, timeout_sec=None):
+        pass
+
+    def list_adapters(self):
+        return [self._adapter]
+
+    def list_devices(self):
+        return list(self._devices)
+
+    def _device_for_address(self, address, adapter, address_type, deadline):
+        for device in self._devices:
+            if device.id == address:
+                return device
+        raise RuntimeError('Unknown device {0}!'.format(address))
+
+    def clear_cached_data(self):
+        self._devices = [x for x in self._devices if x.is_connected]
+
+    def disconnect_devices(self, service_uuids=[], timeout_sec=TIMEOUT_SEC):
+        service_uuids = set(service_uuids)
+        results = {}
+        for device in self._devices:
+            if device.is_connected and set(device.advertised) >= service_uuids:
+                device.disconnect()
+                results[device.id] = None
+        return results
+
+
+class FakeAdapter(Adapter):
+    """Adapter that is always powered and scans instantly."""
+
+    def __init__(self):
+        self._scanning = False
+        self._powered = True
+
+    @property
+    def name(self):
+        return 'Fake Adapter'
+
+    def start_scan(self, timeout_sec=None):
+        self._scanning = True
+
+    def stop_scan(self, timeout_sec=None):
+        self._scanning = False
+
+    @property
+    def is_scanning(self):
+        return self._scanning
+
+    def power_on(self):
+        self._powered = True
+
+    def power_off(self):
+        self._powered = False
+
+    @property
+    def is_powered(self):
+        return self._powered
+
+
+class FakeDevice(Device):
+    """Device with a fixed GATT table.  Services is a dict of service UUID to a
+    dict of characteristic UUID to value.  Discovery takes attribute_sec for
+    each service, characteristic and descriptor it finds, to model the round
+    trips a real stack makes.
+    """
+
+    def __init__(self, address, name=None, advertised=None, services=None,
+                 rssi=-60, attribute_sec=0):
+        self._address = address
+        self._name = name
+        self._advertised = list(advertised) if advertised is not None else []
+        self._rssi = rssi
+        self._attribute_sec = attribute_sec
+        self._connected = False
+        # Attributes found by the last discovery.
+        self.discovered_attributes = 0
+        self._services = []
+        for service_uuid, chars in (services or {}).items():
+            self._services.append(FakeGattService(service_uuid, chars))
+
+    def connect(self, timeout_sec=None):
+        self._connected = True
+
+    def disconnect(self, timeout_sec=None):
+        self._connected = False
+        self._fire_disconnected()
+
+    def drop(self):
+        """Simulate the link to the device being lost."""
+        self._connected = False
+        self._fire_disconnected()
+
+    def list_services(self):
+        return list(self._services)
+
+    def discover(self, service_uuids, char_uuids, timeout_sec=None):
+        # Like a real stack only the requested UUIDs are discovered, an empty
+        # list discovers everything.
+        services = [x for x in self._services if not service_uuids or x.uuid in service_uuids]
+        chars = [x for service in services for x in service.list_characteristics()
+                 if not char_uuids or x.uuid in char_uuids]
+        self.discovered_attributes = len(services) + len(chars) + \
+            sum(len(x.list_descriptors()) for x in chars)
+        if self._attribute_sec:
+            time.sleep(self.discovered_attributes*self._attribute_sec)
+        return set([x.uuid for x in services]) >= set(service_uuids) and \
+               set([x.uuid for x in chars]) >= set(char_uuids)
+
+    @property
+    def advertised(self):
+        return self._advertised
+
+    @property
+    def id(self):
+        return self._address
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def rssi(self):
+        return self._rssi
+
+
+class FakeGattService(GattService):
+
+    def __init__(self, service_uuid, chars):
+        self._uuid = service_uuid
+        self._chars = [FakeGattCharacteristic(x, y) for x, y in chars.items()]
+
+    @property
+    def uuid(self):
+        return self._uuid
+
+    def list_characteristics(self):
+        # Like bluez every listing gives new objects for the same attributes.
+        return [x._copy() for x in self._chars]
+
+
+class FakeGattCharacteristic(GattCharacteristic):
+    """Characteristic whose value and notification receivers are shared by
+    every object for it.  Like a bluez signal receiver, the callback of each
+    object stays subscribed until stop_notify or release_notify.
+    """
+
+    def __init__(self, char_uuid, value=b'', _state=None):
+        self._uuid = char_uuid
+        self._state = _state if _state is not None else {'value': value, 'receivers': []}
+        self._on_change = None
+        # Every characteristic gets a client characteristic configuration
+        # descriptor like a real notify characteristic would.
+        self._descriptors = [FakeGattDescriptor(
+            uuid.UUID('00002902-0000-1000-8000-00805f9b34fb'), b'\x00\x00')]
+
+    def _copy(self):
+        return FakeGattCharacteristic(self._uuid, _state=self._state)
+
+    @property
+    def uuid(self):
+        return self._uuid
+
+    def read_value(self, timeout_sec=None):
+        return self._state['value']
+
+    def write_value(self, value, write_type=None, timeout_sec=None):
+        self._state['value'] = value
+
+    def start_notify(self, on_change, timeout_sec=None):
+        self.release_notify()
+        self._on_change = on_change
+        self._state['receivers'].append(on_change)
+
+    def stop_notify(self, timeout_sec=None):
+        self.release_notify()
+
+    def release_notify(self):
+        if self._on_change is not None:
+            self._state['receivers'].remove(self._on_change)
+            self._on_change = None
+
+    def notify(self, value):
+        """Simulate the device sending a notification."""
+        self._state['value'] = value
+        for on_change in list(self._state['receivers']):
+            on_change(value)
+
+    def list_descriptors(self):
+        return list(self._descriptors)
+
+
+class FakeGattDescriptor(GattDescriptor):
+
+    def __init__(self, desc_uuid, value=b''):
+        self._uuid = desc_uuid
+        self._value = value
+
+    @property
+    def uuid(self):
+        return self._uuid
+
+    def read_value(self, timeout_sec=None):
+        return self._value
+
+
+def install(provider=None):
+    """Make the provided fake provider (or a new empty one) the global provider
+    returned by get_provider().  Returns the installed provider.
+    """
+    if provider is None:
+        provider = FakeProvider()
+    Adafruit_BluefruitLE.platform._provider = provider
+    return provider
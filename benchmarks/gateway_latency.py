@@ -0,0 +1,112 @@
+# Benchmark of the gateway daemon: round trip latency of characteristic reads
+# made by a client process through the daemon, and the rate notifications are
+# fanned out to several client processes.  The daemon runs in this process
+# with the fake provider, so no Bluetooth stack is needed.
+#
+# Usage: python gateway_latency.py [reads] [notifications] [clients]
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from fake_provider import FakeProvider, FakeDevice
+from Adafruit_BluefruitLE.gateway import GatewayProvider, GatewayServer
+
+
+SERVICE_UUID = uuid.UUID('6E400001-B5A3-F393-E0A9-E50E24DCCA9E')
+CHAR_UUID    = uuid.UUID('6E400003-B5A3-F393-E0A9-E50E24DCCA9E')
+ADDRESS      = '00:11:22:33:44:55'
+PAYLOAD      = b'\x5a' * 20
+
+
+def find_char(ble):
+    # Connect to the fake device through the gateway and return its
+    # characteristic.
+    device = [x for x in ble.list_devices() if x.id == ADDRESS][0]
+    device.connect()
+    device.discover([SERVICE_UUID], [CHAR_UUID])
+    service = [x for x in device.list_services() if x.uuid == SERVICE_UUID][0]
+    return [x for x in service.list_characteristics() if x.uuid == CHAR_UUID][0]
+
+
+def reader(path, reads, results):
+    ble = GatewayProvider(path)
+    ble.initialize()
+    char = find_char(ble)
+    latencies = []
+    for i in range(reads):
+        start = time.time()
+        char.read_value()
+        latencies.append(time.time() - start)
+    ble.stop()
+    latencies.sort()
+    results.put((latencies[len(latencies)//2], latencies[int(len(latencies)*0.99)]))
+
+
+def subscriber(path, notifications, ready, results):
+    ble = GatewayProvider(path)
+    ble.initialize()
+    char = find_char(ble)
+    received = [0]
+    done = threading.Event()
+    def on_change(value):
+        received[0] += 1
+        if received[0] == notifications:
+            done.set()
+    char.start_notify(on_change)
+    ready.put(True)
+    done.wait(60)
+    results.put(received[0])
+    ble.stop()
+
+
+def main():
+    reads = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    notifications = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    device = FakeDevice(ADDRESS, 'Fake UART', [SERVICE_UUID],
+                        {SERVICE_UUID: {CHAR_UUID: PAYLOAD}})
+    provider = FakeProvider([device])
+    path = os.path.join(tempfile.mkdtemp(), 'gateway.sock')
+    server = GatewayServer(provider, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    context = multiprocessing.get_context('spawn')
+    # Read latency from one client.
+    results = context.Queue()
+    process = context.Process(target=reader, args=(path, reads, results))
+    process.start()
+    median, p99 = results.get()
+    process.join()
+    print('{0} reads: median {1:.0f} us, 99th percentile {2:.0f} us'.format(
+        reads, median*1e6, p99*1e6))
+    # Notification fan out to several clients.
+    ready = context.Queue()
+    processes = [context.Process(target=subscriber, args=(path, notifications, ready, results))
+                 for i in range(clients)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        ready.get()
+    char = device.list_services()[0].list_characteristics()[0]
+    start = time.time()
+    for i in range(notifications):
+        char.notify(PAYLOAD)
+    received = [results.get() for process in processes]
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+    print('{0} notifications to {1} clients: {2:.0f} notifications per second, {3} of {4} delivered'.format(
+        notifications, clients, notifications/elapsed, sum(received), notifications*clients))
+    server.shutdown()
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
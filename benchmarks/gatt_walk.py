@@ -0,0 +1,87 @@
+# Benchmark of reading a device's whole GATT table: walking the bluez_dbus
+# provider's live objects (list_services, list_characteristics,
+# list_descriptors, and each uuid is a DBus round trip) compared with
+# Device.gatt_snapshot, which builds the table from one GetManagedObjects
+# reply.  Builds snapshots from a stand-in GetManagedObjects reply for tables
+# of several sizes and reports the node count, the round trips each way, the
+# time at a modeled round trip latency, and the cost to build and serialize
+# the snapshot.  Needs no Bluetooth stack.
+#
+# Usage: python gatt_walk.py [ms per round trip] [characteristics per service]
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.gatt_snapshot import GattSnapshot, from_bluez_objects
+
+
+DEVICE_PATH = '/org/bluez/hci0/dev_00_11_22_33_44_55'
+
+
+def managed_objects(services, chars_per_service):
+    # Return a GetManagedObjects style dict with the services, each with the
+    # characteristics and a client characteristic configuration descriptor
+    # on each characteristic.
+    objects = {DEVICE_PATH: {'org.bluez.Device1': {'Address': '00:11:22:33:44:55'}}}
+    handle = 1
+    for i in range(services):
+        service_path = '{0}/service{1:04x}'.format(DEVICE_PATH, handle)
+        objects[service_path] = {'org.bluez.GattService1': {
+            'UUID': str(uuid.UUID(int=(i << 96) | 0x1000)), 'Primary': True}}
+        handle += 1
+        for j in range(chars_per_service):
+            char_path = '{0}/char{1:04x}'.format(service_path, handle)
+            objects[char_path] = {'org.bluez.GattCharacteristic1': {
+                'UUID': str(uuid.UUID(int=(i << 96) | j)), 'Flags': ['read', 'notify']}}
+            objects['{0}/desc{1:04x}'.format(char_path, handle + 2)] = {'org.bluez.GattDescriptor1': {
+                'UUID': '00002902-0000-1000-8000-00805f9b34fb'}}
+            handle += 3
+    return objects
+
+
+def walk_round_trips(snapshot):
+    # Round trips the bluez_dbus provider makes to walk its live objects: one
+    # GetManagedObjects for list_services, then a Get of the UUID and of the
+    # children for every service and characteristic and a Get of the UUID for
+    # every descriptor.
+    chars = [y for x in snapshot.services for y in x.characteristics]
+    return 1 + 2*len(snapshot.services) + 2*len(chars) + \
+        sum(len(x.descriptors) for x in chars)
+
+
+def timed(function, repeat):
+    # Return the best seconds for one call of the function, and its result.
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    rtt_sec = (float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)/1000.0
+    chars_per_service = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    print('{0:.2f} ms per round trip, {1} characteristics per service'.format(
+        rtt_sec*1000.0, chars_per_service))
+    print('{0:>9} {1:>6} {2:>12} {3:>8} {4:>16} {5:>11} {6:>11} {7:>11}'.format(
+        'services', 'nodes', 'walk trips', 'walk ms', 'snapshot trips', 'snapshot ms',
+        'json bytes', 'json ms'))
+    for services in (1, 5, 10, 25, 50):
+        objects = managed_objects(services, chars_per_service)
+        build, snapshot = timed(lambda: from_bluez_objects(DEVICE_PATH, objects), 20)
+        encoded = json.dumps(snapshot.to_list())
+        serialize, decoded = timed(lambda: GattSnapshot.from_list(json.loads(json.dumps(snapshot.to_list()))), 20)
+        assert decoded == snapshot
+        trips = walk_round_trips(snapshot)
+        print('{0:>9} {1:>6} {2:>12} {3:>8.1f} {4:>16} {5:>11.2f} {6:>11} {7:>11.2f}'.format(
+            services, snapshot.node_count, trips, trips*rtt_sec*1000.0, 1,
+            (build + rtt_sec)*1000.0, len(encoded), serialize*1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Benchmark of the time it takes to import the library, measured with Python's
+# -X importtime option (Python 3.7 or later).  Imports the package and the UART
+# service the way a short-lived command line tool would, against the fake
+# provider so no bluetooth stack is needed.  Prints the modules that cost the
+# most and checks the total against the import time budget.
+#
+# Usage: python import_time.py [runs]
+import os
+import subprocess
+import sys
+
+
+# Budget for importing the package and a service, in milliseconds.  Most of
+# this is the standard library modules the uuid module pulls in.
+BUDGET_MS = 35.0
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Code for the measured process.  Everything imported between the colorsys
+# marker and the fake provider is charged to the library, including standard
+# library modules it pulls in.  The fake provider is installed after the
+# library imports so its own import isn't part of the measurement.
+SCRIPT = '''
+import sys
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {here!r})
+import colorsys
+import Adafruit_BluefruitLE
+from Adafruit_BluefruitLE.services import UART
+import fake_provider
+fake_provider.install()
+Adafruit_BluefruitLE.get_provider().find_devices(UART.ADVERTISED)
+'''.format(root=os.path.join(HERE, '..'), here=HERE)
+
+
+def measure():
+    """Run the script in a new interpreter and return a tuple of the total
+    import time of the package in microseconds and a list of (self time,
+    module name) for every module it imported.
+    """
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', SCRIPT],
+                                     stderr=subprocess.STDOUT).decode('utf-8')
+    total = 0
+    modules = []
+    pending = []
+    measuring = False
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        self_us = int(fields[0])
+        cumulative_us = int(fields[1])
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        pending.append((self_us, name))
+        # Modules are listed after the modules they import, so a top level
+        # entry closes the group of modules it pulled in.
+        if depth == 0:
+            if name == 'fake_provider':
+                break
+            if measuring:
+                total += cumulative_us
+                modules.extend(pending)
+            elif name == 'colorsys':
+                measuring = True
+            pending = []
+    return total, modules
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 9
+    results = sorted([measure() for i in range(runs)], key=lambda x: x[0])
+    total, modules = results[len(results)//2]
+    print('Most expensive modules (median of {0} runs):'.format(runs))
+    for self_us, name in sorted(modules, reverse=True)[:10]:
+        print('  {0:>8.3f} ms  {1}'.format(self_us/1000.0, name))
+    total_ms = total/1000.0
+    print('Total library import time: {0:.3f} ms (budget {1:.1f} ms)'.format(total_ms, BUDGET_MS))
+    if total_ms > BUDGET_MS:
+        print('Over budget!')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# Benchmark of the cost metrics add to each notification: the time to deliver
+# notifications to a callback wrapped by metrics.instrument_callback compared
+# with calling the callback directly.  Checks the difference against the
+# library's per notification budget.  Needs no Bluetooth stack.
+#
+# Usage: python metrics_overhead.py [notifications]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE import metrics
+
+
+PAYLOAD = b'\x5a' * 20
+
+
+def on_change(value):
+    pass
+
+
+def deliver(callback, notifications):
+    # Return the seconds taken to deliver the notifications to the callback.
+    start = time.time()
+    for i in range(notifications):
+        callback(PAYLOAD)
+    return time.time() - start
+
+
+def main():
+    notifications = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    if not metrics.METRICS:
+        print('Metrics are disabled by ADAFRUIT_BLUEFRUITLE_METRICS.')
+        return 0
+    instrumented = metrics.instrument_callback(on_change, 'hci0', '00:11:22:33:44:55')
+    # Best of several runs to reduce noise.
+    direct = min(deliver(on_change, notifications) for i in range(3))
+    counted = min(deliver(instrumented, notifications) for i in range(3))
+    overhead = (counted - direct) / notifications
+    print('{0} notifications: {1:.3f} us direct, {2:.3f} us with metrics'.format(
+        notifications, direct/notifications*1e6, counted/notifications*1e6))
+    print('Metrics overhead: {0:.3f} us per notification (budget {1:.3f} us)'.format(
+        overhead*1e6, metrics.NOTIFY_BUDGET_SEC*1e6))
+    if overhead > metrics.NOTIFY_BUDGET_SEC:
+        print('Over budget!')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Benchmark of passing notification sized records from a worker process to the
+# parent, through the shared memory ring buffer the worker supervisor uses and
+# through a multiprocessing.Queue (which pickles every record).  Needs Python
+# 3.8 or later but no Bluetooth stack.  First checks that batches of records
+# decoded to NumPy structured arrays (the worker's dtype path) come back intact,
+# when NumPy is installed.
+#
+# Usage: python ring_buffer.py [records]
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.ring_buffer import SharedRingBuffer
+
+
+# Worker header (30 bytes) plus a 20 byte notification.
+HEADER = b'\x02' * 30
+PAYLOAD = b'\x5a' * 20
+
+
+def check_structured_arrays():
+    try:
+        import numpy as np
+    except ImportError:
+        print('NumPy is not installed, skipping the structured array check.')
+        return
+    dtype = np.dtype([('timestamp', '<u4'), ('value', '<i2')])
+    ring = SharedRingBuffer(4096)
+    try:
+        for count in (1, 4, 7):
+            batch = np.zeros(count, dtype)
+            batch['timestamp'] = np.arange(count)
+            batch['value'] = -np.arange(count)
+            assert ring.put(HEADER, batch), 'Batch dropped!'
+            received = []
+            ring.read(lambda record: received.append(bytes(record)))
+            assert len(received) == 1 and received[0][:len(HEADER)] == HEADER
+            assert len(received[0]) == len(HEADER) + batch.nbytes, 'Batch sized by its record count!'
+            decoded = np.frombuffer(received[0][len(HEADER):], dtype)
+            assert (decoded == batch).all(), 'Batch changed in transit!'
+    finally:
+        ring.close()
+        ring.unlink()
+    print('Structured arrays: round trip OK')
+
+
+def ring_producer(name, records):
+    ring = SharedRingBuffer.attach(name)
+    sent = 0
+    while sent < records:
+        if ring.put(HEADER, PAYLOAD):
+            sent += 1
+    ring.close()
+
+
+def queue_producer(queue, records):
+    for i in range(records):
+        queue.put(HEADER + PAYLOAD)
+
+
+def bench_ring(context, records):
+    ring = SharedRingBuffer(1 << 20)
+    received = [0]
+    def handle(record):
+        received[0] += 1
+    process = context.Process(target=ring_producer, args=(ring.name, records))
+    start = time.time()
+    process.start()
+    while received[0] < records:
+        if ring.read(handle) == 0:
+            time.sleep(0.0001)
+    elapsed = time.time() - start
+    process.join()
+    ring.close()
+    ring.unlink()
+    return elapsed
+
+
+def bench_queue(context, records):
+    queue = context.Queue()
+    process = context.Process(target=queue_producer, args=(queue, records))
+    start = time.time()
+    process.start()
+    for i in range(records):
+        queue.get()
+    elapsed = time.time() - start
+    process.join()
+    return elapsed
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    context = multiprocessing.get_context('spawn')
+    check_structured_arrays()
+    print('{0} records of {1} bytes, including process start up'.format(records, len(HEADER + PAYLOAD)))
+    for name, bench in (('ring buffer', bench_ring), ('queue', bench_queue)):
+        elapsed = bench(context, records)
+        print('{0:>12}: {1:>10.0f} records per second'.format(name, records/elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Benchmark of a Session restoring a device after the link is lost: the time
+# from the fake device dropping its link until the session has reconnected,
+# rebound its UART service, resubscribed and sent the writes buffered while
+# disconnected.  This is the library's own overhead on top of the time the OS
+# takes to reconnect.  Also checks every notification is still delivered
+# exactly once after each reconnect.  Needs no Bluetooth stack.
+#
+# Usage: python session_reconnect.py [outages] [writes per outage]
+import sys
+import time
+import uuid
+
+from fake_provider import FakeDevice, FakeProvider, install
+from Adafruit_BluefruitLE.services.uart import UART, UART_SERVICE_UUID, TX_CHAR_UUID, RX_CHAR_UUID
+from Adafruit_BluefruitLE.session import Session
+
+
+BATTERY_SERVICE_UUID = uuid.UUID('0000180F-0000-1000-8000-00805F9B34FB')
+BATTERY_CHAR_UUID    = uuid.UUID('00002A19-0000-1000-8000-00805F9B34FB')
+
+
+def main():
+    outages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    device = FakeDevice('00:11:22:33:44:55', 'Fake UART', [UART_SERVICE_UUID],
+                        {UART_SERVICE_UUID: {TX_CHAR_UUID: b'', RX_CHAR_UUID: b''},
+                         BATTERY_SERVICE_UUID: {BATTERY_CHAR_UUID: b'\x64'}})
+    install(FakeProvider([device]))
+    battery = []
+    rx = device.find_service(UART_SERVICE_UUID).find_characteristic(RX_CHAR_UUID)
+    level = device.find_service(BATTERY_SERVICE_UUID).find_characteristic(BATTERY_CHAR_UUID)
+    with Session(device, [UART], retry_sec=0.001) as session:
+        session.start_notify(BATTERY_SERVICE_UUID, BATTERY_CHAR_UUID, battery.append)
+        uart = session.service(UART)
+        durations = []
+        for i in range(outages):
+            start = time.time()
+            device.drop()
+            for j in range(writes):
+                session.write(UART_SERVICE_UUID, TX_CHAR_UUID, b'queued')
+            while not session.is_connected:
+                time.sleep(0)
+            durations.append(time.time() - start)
+            # The UART is subscribed again and still delivers data, once.
+            rx.notify(b'hello')
+            if uart.read(timeout_sec=1) != b'hello':
+                print('UART did not receive data after reconnecting!')
+                return 1
+            if uart.read(timeout_sec=0) is not None:
+                print('UART received data twice after {0} reconnects!'.format(i + 1))
+                return 1
+            level.notify(b'\x63')
+            if len(battery) != i + 1:
+                print('{0} battery notifications delivered after {1} reconnects, expected {1}!'.format(
+                    len(battery), i + 1))
+                return 1
+        stats = session.stats()
+    durations.sort()
+    print('{0} outages with {1} buffered writes: median {2:.0f} us, 99th percentile {3:.0f} us to restore'.format(
+        outages, writes, durations[len(durations)//2]*1e6, durations[int(len(durations)*0.99)]*1e6))
+    print('Session stats: {0}'.format(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
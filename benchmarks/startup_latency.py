@@ -0,0 +1,49 @@
+# Benchmark of the latency from calling the provider's initialize() until the
+# first instruction of the user's target function runs inside
+# run_mainloop_with.  Measures both the default mode (target runs in a
+# background thread once the main loop signals it's running) and the
+# on_mainloop mode (target is called directly from the main loop).  Each run
+# happens in a fresh process since run_mainloop_with exits when the target
+# returns.  Must be run on Linux with bluez, like the examples.
+#
+# Usage: python startup_latency.py [runs per mode]
+import os
+import subprocess
+import sys
+import time
+
+
+def child(on_mainloop):
+    # Time a single startup and print the latency in milliseconds.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import Adafruit_BluefruitLE
+    ble = Adafruit_BluefruitLE.get_provider()
+    start = time.time()
+    ble.initialize()
+    def target():
+        latency = time.time() - start
+        sys.stdout.write('{0:.6f}\n'.format(latency*1000.0))
+        sys.stdout.flush()
+        return 0
+    ble.run_mainloop_with(target, on_mainloop=on_mainloop)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print('{0} runs per mode'.format(runs))
+    print('{0:>12} {1:>10} {2:>10} {3:>10}'.format('mode', 'min ms', 'median ms', 'max ms'))
+    for mode in ('thread', 'mainloop'):
+        latencies = []
+        for i in range(runs):
+            output = subprocess.check_output([sys.executable, __file__, '--child', mode])
+            latencies.append(float(output.decode('ascii').strip()))
+        latencies.sort()
+        print('{0:>12} {1:>10.3f} {2:>10.3f} {3:>10.3f}'.format(mode, latencies[0],
+            latencies[len(latencies)//2], latencies[-1]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2] == 'mainloop')
+    else:
+        main()
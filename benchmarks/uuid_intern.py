@@ -0,0 +1,77 @@
+# Micro-benchmark of turning the UUIDs the Bluetooth stack reports into
+# uuid.UUID objects: parsing a new object every time, as the providers used
+# to, compared with the shared intern table in uuids.py.  Measures converting
+# bluez UUID strings, filtering devices by advertised service like
+# find_devices, and converting the short 2 byte form CoreBluetooth gives for
+# Bluetooth SIG UUIDs.  Needs no Bluetooth stack.
+#
+# Usage: python uuid_intern.py [devices]
+from binascii import hexlify
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.uuids import intern_uuid, intern_uuid_bytes
+
+
+UART_SERVICE = '6e400001-b5a3-f393-e0a9-e50e24dcca9e'
+# Advertised UUIDs of each device, like a bluez UUIDs property: the UART
+# service on every fourth device plus a few SIG services.
+SIG_SERVICES = ['0000180a-0000-1000-8000-00805f9b34fb', '0000180f-0000-1000-8000-00805f9b34fb',
+                '0000181a-0000-1000-8000-00805f9b34fb']
+
+
+def parse_cbuuid(data):
+    # How CBUUIDs were converted before the intern table.
+    template = '{:0>8}-0000-1000-8000-00805f9b34fb' if len(data) <= 4 else '{:0>32}'
+    return uuid.UUID(hex=template.format(hexlify(data[:16]).decode('ascii')))
+
+
+def best(function, repeat=5):
+    # Return the best seconds of several calls of the function.
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def find_devices(devices, expected, convert):
+    # Filter devices by advertised services like Provider.find_devices, with
+    # each device's UUIDs converted by the function.
+    return [x for x in devices if set([convert(y) for y in x]) >= expected]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    devices = [([UART_SERVICE] if i % 4 == 0 else []) + SIG_SERVICES for i in range(count)]
+    strings = [x for device in devices for x in device]
+    short = [b'\x18\x0a', b'\x18\x0f', b'\x2a\x29', b'\x2a\x24'] * (count // 4)
+    expected = set([uuid.UUID(UART_SERVICE)])
+    parse = lambda x: uuid.UUID(str(x))
+    results = [
+        ('bluez UUID strings', len(strings),
+         best(lambda: [parse(x) for x in strings]),
+         best(lambda: [intern_uuid(x) for x in strings])),
+        ('find_devices filter', count,
+         best(lambda: find_devices(devices, expected, parse)),
+         best(lambda: find_devices(devices, expected, intern_uuid))),
+        ('CBUUID short form', len(short),
+         best(lambda: [parse_cbuuid(x) for x in short]),
+         best(lambda: [intern_uuid_bytes(x) for x in short]))
+    ]
+    assert len(find_devices(devices, expected, intern_uuid)) == len(find_devices(devices, expected, parse))
+    print('{0:<20} {1:>8} {2:>12} {3:>14} {4:>8}'.format('', 'items', 'parse us', 'interned us', 'speedup'))
+    for name, items, parsed, interned in results:
+        print('{0:<20} {1:>8} {2:>12.3f} {3:>14.3f} {4:>7.1f}x'.format(
+            name, items, parsed/items*1e6, interned/items*1e6, parsed/interned))
+    print('Distinct UUID objects for {0} UUID strings: {1} parsed, {2} interned'.format(
+        len(strings), len(set(id(x) for x in [parse(y) for y in strings])),
+        len(set(id(intern_uuid(x)) for x in strings))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Benchmark of the cost to marshal a characteristic write for bluez's
+# WriteValue DBus method.  Compares the old behavior of passing a list of values
+# (which dbus-python boxes into one dbus.Byte per element) with passing a single
+# dbus.ByteArray, for 20 byte (default ATT MTU) and 512 byte (maximum attribute
+# length) payloads.  No bluetooth hardware or running bus is needed, messages
+# are only built and not sent.
+#
+# Usage: python write_marshalling.py [writes per case]
+import os
+import sys
+import time
+import timeit
+
+import dbus
+import dbus.lowlevel
+
+# Run against the library in this repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Adafruit_BluefruitLE.bluez_dbus.gatt import _to_byte_array
+
+
+PATH = '/org/bluez/hci0/dev_00_11_22_33_44_55/service000a/char000b'
+
+
+def marshal(value, options):
+    # Build the same method call message dbus-python sends for WriteValue.
+    message = dbus.lowlevel.MethodCallMessage('org.bluez', PATH,
+        'org.bluez.GattCharacteristic1', 'WriteValue')
+    message.append(value, options, signature='aya{sv}')
+
+
+def per_byte(payload, options):
+    # Old path: value is passed through untouched as a list of ints.
+    marshal([dbus.Byte(x) for x in bytearray(payload)], options)
+
+
+def byte_array(payload, options):
+    # New path: value is converted to a dbus.ByteArray.
+    marshal(_to_byte_array(payload), options)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    options = dbus.Dictionary({'type': 'command'}, signature='sv')
+    print('{0} writes per case'.format(count))
+    print('{0:>8} {1:>12} {2:>14} {3:>14} {4:>8}'.format('size', 'method',
+        'usec/write', 'writes/sec', 'speedup'))
+    for size in (20, 512):
+        payload = os.urandom(size)
+        results = []
+        for name, func in (('dbus.Byte', per_byte), ('ByteArray', byte_array)):
+            # Take the best of a few runs to reduce noise.
+            elapsed = min(timeit.repeat(lambda: func(payload, options),
+                                        repeat=3, number=count, timer=time.time))
+            results.append(elapsed)
+            print('{0:>8} {1:>12} {2:>14.2f} {3:>14.0f} {4:>8.1f}x'.format(size,
+                name, elapsed/count*1e6, count/elapsed, results[0]/elapsed))
+
+
+if __name__ == '__main__':
+    main()
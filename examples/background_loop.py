@@ -0,0 +1,43 @@
+# Example of using the BLE library from a program that keeps its own main
+# thread, in this case an asyncio event loop.  Instead of handing the main
+# thread to run_mainloop_with, the provider runs its main loop on a background
+# thread between calls to start() and stop().  Note this only works on Linux,
+# on Mac OSX CoreBluetooth needs the main thread.
+import asyncio
+
+import Adafruit_BluefruitLE
+from Adafruit_BluefruitLE.services import UART
+
+
+# Get the BLE provider for the current platform.
+ble = Adafruit_BluefruitLE.get_provider()
+
+
+def find_uart():
+    # Blocking BLE calls, run in a worker thread so asyncio isn't blocked.
+    adapter = ble.get_default_adapter()
+    adapter.power_on()
+    try:
+        adapter.start_scan()
+        return UART.find_device(timeout_sec=10)
+    finally:
+        adapter.stop_scan()
+
+
+async def main():
+    loop = asyncio.get_event_loop()
+    device = await loop.run_in_executor(None, find_uart)
+    if device is None:
+        print('No UART device found!')
+    else:
+        print('Found UART device: {0}'.format(device.name))
+
+
+# Initialize the BLE system and start its main loop in the background.
+ble.initialize()
+ble.start()
+try:
+    asyncio.get_event_loop().run_until_complete(main())
+finally:
+    # Stop the background main loop, this returns once its thread has ended.
+    ble.stop()
@@ -25,4 +25,5 @@ setup(name              = 'Adafruit_BluefruitLE',
       license           = 'MIT',
       url               = 'https://github.com/adafruit/Adafruit_Python_BluefruitLE/',
       install_requires  = ['future'] + platform_install_requires,
+      extras_require    = {'numpy': ['numpy']},
       packages          = find_packages())